@@ -0,0 +1,292 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MASK64 = (1 << 64) - 1
+
+# 2**-rank for every possible register value
+_INVERSE_POWERS = [2.0**-rank for rank in range(65)]
+
+
+def _mix64(value):
+    """splitmix64 finalizer: spreads consecutive user IDs over 64 bits"""
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def _hash_code(code):
+    """Stable 64-bit hash of a code (Python's hash() changes per process)"""
+    return int.from_bytes(
+        hashlib.blake2b(code.encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2**precision bytes
+
+    The standard error is about 1.04 / sqrt(2**precision): 6.5% at 8,
+    0.8% at 14.
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision=8, registers=None):
+        self.precision = precision
+        self.registers = registers or bytearray(1 << precision)
+
+    def add(self, user_id):
+        value = _mix64(user_id)
+        index = value >> (64 - self.precision)
+        rest = (value << self.precision) & MASK64
+        # Leading zeros of the remaining bits, plus one
+        rank = 65 - rest.bit_length() if rest else 65 - self.precision
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def __len__(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else \
+            {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(
+            _INVERSE_POWERS[rank] for rank in self.registers)
+        if estimate <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                # Linear counting is more accurate for small sets
+                estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def dump(self):
+        return base64.b64encode(self.registers).decode("ascii")
+
+    @classmethod
+    def load(cls, precision, data):
+        return cls(precision, bytearray(base64.b64decode(data)))
+
+
+class CountMinSketch:
+    """Approximate per-key counts in fixed memory (never undercounts)
+
+    With width w and depth d an estimate exceeds the true count by more
+    than 2N/w (N = all increments) with probability at most 2**-d.
+    """
+
+    def __init__(self, width=2048, depth=4, rows=None):
+        self.width = width
+        self.depth = depth
+        self.rows = rows or [[0] * width for _ in range(depth)]
+
+    def _columns(self, key_hash):
+        # Double hashing: d indexes from one 64-bit hash
+        h1, h2 = key_hash & 0xFFFFFFFF, (key_hash >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key_hash):
+        """Count one occurrence; returns the key's new estimate"""
+        estimate = None
+        for row, column in zip(self.rows, self._columns(key_hash)):
+            row[column] += 1
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, key_hash):
+        return min(row[column]
+                   for row, column in zip(self.rows, self._columns(key_hash)))
+
+
+class AccessAnalytics:
+    """Per-code access counts, unique users and top codes in fixed memory
+
+    Every access goes into a count-min sketch, so any code's hit count can
+    be estimated. The ``top_k`` codes with the highest estimates are
+    tracked individually from the moment they enter the top, each with a small
+    HyperLogLog of the users it reached (users seen before a code entered
+    the top are not counted). A larger HyperLogLog counts unique users
+    across all codes.
+
+    State is saved to ``path`` as JSON every ``flush_interval`` seconds
+    and loaded from it on creation, so totals survive restarts.
+    """
+
+    def __init__(self,
+                 top_k=100,
+                 width=2048,
+                 depth=4,
+                 precision=8,
+                 global_precision=14,
+                 path=None,
+                 flush_interval=60.0):
+        self.top_k = top_k
+        self.precision = precision
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self.sketch = CountMinSketch(width, depth)
+        self.users = HyperLogLog(global_precision)
+        # code -> [hits, HyperLogLog]
+        self._top = {}
+        # No tracked code has fewer hits; may lag behind the real minimum
+        self._floor = 0
+        self.accesses = 0
+        self.started_at = time.time()
+
+        self.flushes = 0
+        self._dirty = False
+        self._task = None
+
+        if path and os.path.exists(path):
+            try:
+                self._restore(path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.error(f"Could not load analytics from {path}: {e}")
+
+    def record(self, code, user_id):
+        """Count one access of code by user_id"""
+        self.accesses += 1
+        self._dirty = True
+        self.users.add(user_id)
+        hits = self.sketch.add(_hash_code(code))
+
+        entry = self._top.get(code)
+        if entry is not None:
+            entry[0] = hits
+        elif len(self._top) < self.top_k:
+            entry = self._top[code] = [hits, HyperLogLog(self.precision)]
+        elif hits > self._floor:
+            coldest = min(self._top, key=lambda key: self._top[key][0])
+            if hits > self._top[coldest][0]:
+                del self._top[coldest]
+                entry = self._top[code] = [hits, HyperLogLog(self.precision)]
+            self._floor = min(hits for hits, _ in self._top.values())
+        if entry is not None:
+            entry[1].add(user_id)
+
+    def hits(self, code):
+        """Estimated accesses of any code"""
+        return self.sketch.estimate(_hash_code(code))
+
+    def top(self, limit=10):
+        """The most accessed codes as (code, hits, unique users) tuples"""
+        ranked = sorted(self._top.items(), key=lambda item: -item[1][0])
+        return [(code, hits, len(users))
+                for code, (hits, users) in ranked[:limit]]
+
+    def stats(self):
+        """Totals only: codes are secrets, list them with top() instead"""
+        return {
+            "analytics_accesses": self.accesses,
+            "analytics_unique_users": len(self.users),
+            "analytics_tracked_codes": len(self._top),
+            "analytics_since": int(self.started_at),
+        }
+
+    def snapshot(self):
+        return {
+            "version": 1,
+            "started_at": self.started_at,
+            "accesses": self.accesses,
+            "sketch": [row[:] for row in self.sketch.rows],
+            "users": self.users.dump(),
+            "top": [[code, hits, users.dump()]
+                    for code, (hits, users) in self._top.items()],
+        }
+
+    def _restore(self, path):
+        with open(path) as fp:
+            data = json.load(fp)
+        rows = data["sketch"]
+        if (len(rows) != self.sketch.depth or
+                any(len(row) != self.sketch.width for row in rows)):
+            raise ValueError("sketch size changed")
+        self.sketch.rows = rows
+        self.users = HyperLogLog.load(self.users.precision, data["users"])
+        self._top = {
+            code: [hits, HyperLogLog.load(self.precision, users)]
+            for code, hits, users in data["top"][:self.top_k]
+        }
+        self._floor = min((hits for hits, _ in self._top.values()),
+                          default=0)
+        self.accesses = data["accesses"]
+        self.started_at = data["started_at"]
+
+    def _write(self, snapshot):
+        # Write then rename so a crash never leaves a torn file
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as fp:
+            json.dump(snapshot, fp, separators=(",", ":"))
+        os.replace(temporary, self.path)
+
+    async def flush(self):
+        """Save the current state to path if anything changed"""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            # Snapshot on the loop, serialize and write in a thread
+            await asyncio.to_thread(self._write, self.snapshot())
+            self.flushes += 1
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"Could not save analytics to {self.path}: {e}")
+
+    def start(self):
+        if self.path:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def stop(self):
+        """Stop the flush loop and save what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+if __name__ == "__main__":
+    # Accuracy and cost: 1M accesses over 50k codes (Zipf popularity) by
+    # 200k users, against exact counts
+    import random
+    from collections import Counter, defaultdict
+
+    random.seed(1)
+    codes = [f"{i:06x}" for i in range(50_000)]
+    weights = [1 / (rank + 1) for rank in range(len(codes))]
+    accesses = [(code, random.randrange(200_000))
+                for code in random.choices(codes, weights, k=1_000_000)]
+
+    analytics = AccessAnalytics()
+    started = time.perf_counter()
+    for code, user_id in accesses:
+        analytics.record(code, user_id)
+    elapsed = time.perf_counter() - started
+
+    exact_hits = Counter(code for code, _ in accesses)
+    exact_users = defaultdict(set)
+    for code, user_id in accesses:
+        exact_users[code].add(user_id)
+
+    print(f"record: {elapsed / len(accesses) * 1e6:.2f}us per access")
+    print(f"unique users: {len(analytics.users)} "
+          f"(exact {len({user_id for _, user_id in accesses})})")
+    exact_top = [code for code, _ in exact_hits.most_common(10)]
+    print(f"top-10 overlap with exact: "
+          f"{len(set(exact_top) & {c for c, _, _ in analytics.top(10)})}/10")
+    for code, hits, users in analytics.top(5):
+        print(f"  {code}: hits {hits} (exact {exact_hits[code]}), "
+              f"users {users} (exact {len(exact_users[code])})")
+    size = len(json.dumps(analytics.snapshot()))
+    print(f"snapshot: {size / 1024:.0f} KiB")
@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ("single_start", "batch_start", "membership_miss", "admin_batch",
+             "mint_each", "channel_autolink", "abuse_burst")
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Bench:
+    """Drives main.py's handlers against fakeapi.py and reports latency
+
+    Updates are fed through the application's own update processor at a
+    fixed arrival rate, so per-user ordering and the outbound scheduler
+    behave as in production; only the Telegram side is simulated.
+    """
+
+    def __init__(self, main, application, api_url, rate, seed):
+        self.main = main
+        self.application = application
+        self.api = httpx.AsyncClient(base_url=api_url)
+        self.rate = rate
+        self.random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"}
+
+    def _message(self, user_id, chat_id, chat_type, **fields):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def _update(self, **fields):
+        from telegram import Update
+        return Update.de_json({"update_id": next(self._update_ids), **fields},
+                              self.application.bot)
+
+    def command(self, user_id, text):
+        command = text.split()[0]
+        return self._update(message=self._message(
+            user_id, user_id, "private", text=text,
+            entities=[{"type": "bot_command", "offset": 0,
+                       "length": len(command)}]))
+
+    def media(self, user_id, chat_id, chat_type, media_group_id=None):
+        file_id = f"AgACAgQAAxkBAAI{self.random.getrandbits(128):032x}"
+        fields = {
+            "photo": [{"file_id": file_id, "file_unique_id": file_id[-16:],
+                       "width": 1280, "height": 720}]
+        }
+        if media_group_id:
+            fields["media_group_id"] = media_group_id
+        return self._update(
+            message=self._message(user_id, chat_id, chat_type, **fields))
+
+    def callback(self, user_id, data):
+        return self._update(callback_query={
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        })
+
+    def store_code(self, files):
+        """Put a code straight into the store; returns the code"""
+        code = self.main.generate_code()
+        expires_at = (datetime.utcnow() + timedelta(days=1)).isoformat()
+        if len(files) == 1:
+            metadata = {"code": code, "type": "single", "file_id": files[0],
+                        "media_type": "photo", "expires_at": expires_at}
+        else:
+            metadata = {"code": code, "type": "batch",
+                        "files": [[file_id, "photo"] for file_id in files],
+                        "expires_at": expires_at}
+        self.main.channel_message_storage[code] = {
+            'message_id': 1, 'metadata': metadata}
+        return code
+
+    async def warm_membership(self, user_ids):
+        async def member(user_id):
+            return True
+
+        for user_id in user_ids:
+            await self.main.channel_joined_users.is_member(user_id, member)
+
+    async def run(self, name, updates, measured=None):
+        """Feed updates at the arrival rate and collect the results
+
+        Latency percentiles cover the updates ``measured(update)`` accepts
+        (all of them by default).
+        """
+        await self.api.post("/_reset")
+        processor = self.application.update_processor
+        latencies = []
+
+        async def handle(update):
+            started = time.perf_counter()
+            await processor.process_update(
+                update, self.application.process_update(update))
+            if measured is None or measured(update):
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        tasks = []
+        for update in updates:
+            tasks.append(asyncio.create_task(handle(update)))
+            await asyncio.sleep(1 / self.rate)
+        await asyncio.gather(*tasks)
+        # Albums answer after their debounce window
+        await self.main.media_groups.flush()
+        elapsed = time.perf_counter() - started
+
+        api = (await self.api.get("/_stats")).json()
+        return {
+            "scenario": name,
+            "requests": len(updates),
+            "seconds": round(elapsed, 3),
+            "throughput_rps": round(len(updates) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "api_calls_per_request": round(
+                api["total_calls"] / len(updates), 2),
+            "flood_errors": api["flood_errors"],
+            "api_calls": api["calls"],
+        }
+
+    async def run_scenarios(self, names, requests, results):
+        for name in names:
+            result = await getattr(self, name)(requests)
+            results.append(result)
+            print(f"{result['scenario']:18s} {result['requests']:5d} req  "
+                  f"{result['throughput_rps']:7.1f} req/s  "
+                  f"p50 {result['p50_ms']:7.1f}ms  "
+                  f"p99 {result['p99_ms']:7.1f}ms  "
+                  f"{result['api_calls_per_request']:5.2f} calls/req  "
+                  f"{result['flood_errors']} 429s")
+            if "mint_ms" in result:
+                print(f"{'':18s} minting took "
+                      f"{result['mint_ms'] / 1000:.1f}s"
+                      + (f", {result['mint_flood_errors']} 429s"
+                         if "mint_flood_errors" in result else ""))
+
+    async def single_start(self, requests):
+        # Users open links to 20 codes; membership is already cached
+        codes = [self.store_code([f"file{i}"]) for i in range(20)]
+        users = list(range(10_000, 10_000 + requests))
+        await self.warm_membership(users)
+        return await self.run("single_start", [
+            self.command(user_id, f"/start media_{self.random.choice(codes)}")
+            for user_id in users
+        ])
+
+    async def batch_start(self, requests):
+        # A 30-file batch link, delivered as albums
+        code = self.store_code([f"batch{i}" for i in range(30)])
+        users = list(range(20_000, 20_000 + max(requests // 10, 1)))
+        await self.warm_membership(users)
+        return await self.run("batch_start", [
+            self.command(user_id, f"/start batch_{code}") for user_id in users
+        ])
+
+    async def membership_miss(self, requests):
+        # First-time users: every request checks the backup channel
+        code = self.store_code(["missfile"])
+        return await self.run("membership_miss", [
+            self.command(user_id, f"/start media_{code}")
+            for user_id in range(30_000, 30_000 + requests)
+        ])
+
+    async def admin_batch(self, requests):
+        # Admin sends 10 files, an album of 10, then mints the batch
+        admin = self.main.ADMIN_USER_ID
+        updates = [self.media(admin, admin, "private") for _ in range(10)]
+        updates += [
+            self.media(admin, admin, "private", media_group_id="bench-album")
+            for _ in range(10)
+        ]
+        result = await self.run("admin_batch", updates)
+        minted = await self.run("admin_batch_mint",
+                                [self.callback(admin, "generate_batch")])
+        result["mint_ms"] = minted["p50_ms"]
+        return result
+
+    async def mint_each(self, requests):
+        # Admin sends 40 files, then mints a link per file; every link is
+        # a database channel post, so this runs at the channel's limit
+        admin = self.main.ADMIN_USER_ID
+        result = await self.run(
+            "mint_each", [self.media(admin, admin, "private")
+                          for _ in range(40)])
+        minted = await self.run("mint_each_mint",
+                                [self.callback(admin, "generate_each")])
+        result["mint_ms"] = minted["p50_ms"]
+        result["mint_flood_errors"] = minted["flood_errors"]
+        return result
+
+    async def channel_autolink(self, requests):
+        # Admin uploads straight into the database channel
+        admin = self.main.ADMIN_USER_ID
+        channel = self.main.DATABASE_CHANNEL_ID
+        return await self.run("channel_autolink", [
+            self.media(admin, channel, "channel") for _ in range(20)
+        ])
+
+    async def abuse_burst(self, requests):
+        # 10 scripts replay a 30-file batch link as fast as the arrival
+        # rate allows while regular users open single links; latency is
+        # measured for the regular users only
+        batch = self.store_code([f"abuse{i}" for i in range(30)])
+        single = self.store_code(["legitfile"])
+        users = list(range(40_000, 40_000 + requests))
+        abusers = list(range(50_000, 50_010))
+        await self.warm_membership(users + abusers)
+
+        updates = []
+        for user_id in users:
+            updates.append(self.command(user_id, f"/start media_{single}"))
+            for abuser in abusers:
+                updates.append(self.command(abuser, f"/start batch_{batch}"))
+        return await self.run(
+            "abuse_burst", updates,
+            measured=lambda update: update.effective_user.id < 50_000)
+
+
+def start_fake_api(args, *options):
+    process = subprocess.Popen([
+        sys.executable,
+        os.path.join(HERE, "fakeapi.py"), "--port",
+        str(args.port), "--latency",
+        str(args.latency), "--seed",
+        str(args.seed), *options
+    ])
+    url = f"http://127.0.0.1:{args.port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/_stats")
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fakeapi.py did not start")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(api_url, directory, store):
+    """Point main.py at the fake API and a throwaway store
+
+    main.py reads its configuration at import time, so call this first.
+    """
+    os.environ["BOT_TOKEN"] = "123456:bench"
+    os.environ["BOT_API_BASE_URL"] = api_url
+    os.environ["CODE_STORE_URL"] = (f"sqlite:///{directory}/codes.db"
+                                    if store == "sqlite" else "memory://")
+    os.environ.setdefault("MEDIA_GROUP_DELAY", "0.2")
+
+
+@contextlib.asynccontextmanager
+async def running_application():
+    """Yield (main module, started Application) without polling"""
+    import main
+
+    application = main.build_application()
+    await application.initialize()
+    await main.post_init(application)
+    await application.start()
+    try:
+        yield main, application
+    finally:
+        await application.stop()
+        await main.media_groups.flush()
+        await application.shutdown()
+        await main.post_shutdown(application)
+
+
+async def run_bench(args, api_url):
+    results = []
+    async with running_application() as (main, application):
+        bench = Bench(main, application, api_url, args.rate, args.seed)
+        try:
+            await bench.run_scenarios(args.scenarios, args.requests,
+                                      results)
+        finally:
+            await bench.api.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bot's handlers against fakeapi.py")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per /start scenario")
+    parser.add_argument("--rate", type=float, default=25,
+                        help="update arrival rate per second")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="simulated Bot API latency in seconds")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--api-url",
+                        help="use a running fakeapi.py instead of starting one")
+    parser.add_argument("--store", default="sqlite",
+                        choices=("sqlite", "memory"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    process = None
+    if args.api_url:
+        api_url = args.api_url.rstrip("/")
+    else:
+        process, api_url = start_fake_api(args)
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(api_url, directory, args.store)
+        try:
+            results = asyncio.run(run_bench(args, api_url))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "timestamp": datetime.utcnow().isoformat(),
+                "settings": {
+                    "requests": args.requests,
+                    "rate": args.rate,
+                    "latency": args.latency,
+                    "store": args.store,
+                    "seed": args.seed,
+                },
+                "results": results,
+            }, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import base64
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+# Caption prefix of encoded metadata; the digit is the format version
+PREFIX = "C1:"
+VERSION = 1
+
+KIND_SINGLE = 0
+KIND_BATCH = 1
+
+FLAG_COMPRESSED = 0x01
+# The body ends with the upload dedup key ("content" in the metadata)
+FLAG_CONTENT = 0x02
+
+# File entry tag bit set when the file_id is stored as decoded base64 bytes
+TAG_BINARY_ID = 0x80
+
+# version, flags, kind, created_at, expires_at
+HEADER = struct.Struct(">BBBII")
+
+# Enough base64 characters to cover the header (4 chars per 3 bytes)
+HEADER_CHARS = -(-HEADER.size // 3) * 4
+
+# Timestamps are seconds since this (naive UTC) epoch
+EPOCH = datetime(1970, 1, 1)
+
+
+class MetadataError(ValueError):
+    """Raised when encoded metadata cannot be decoded"""
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_str(out, text):
+    raw = text.encode("utf-8")
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _read_str(data, pos):
+    length, pos = _read_varint(data, pos)
+    end = pos + length
+    return bytes(data[pos:end]).decode("utf-8"), end
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _pack_file_id(file_id):
+    """Return (is_binary, bytes) for a file_id
+
+    Telegram file_ids are unpadded urlsafe base64, so most of them pack to
+    three quarters of their length. Anything that does not round-trip
+    exactly is kept as text.
+    """
+    try:
+        raw = _b64decode(file_id)
+    except ValueError:
+        return False, file_id.encode("utf-8")
+    if _b64encode(raw) != file_id:
+        return False, file_id.encode("utf-8")
+    return True, raw
+
+
+def _unpack_file_id(is_binary, raw):
+    if is_binary:
+        return _b64encode(raw)
+    return raw.decode("utf-8")
+
+
+def _timestamp(value):
+    return int((datetime.fromisoformat(value) - EPOCH).total_seconds())
+
+
+def _isoformat(ts):
+    return (EPOCH + timedelta(seconds=ts)).isoformat()
+
+
+def encode_metadata(metadata):
+    """Encode a single/batch metadata dict into a compact caption token
+
+    The token is a fixed header (version, flags, kind, timestamps) followed
+    by a zlib-compressed body, all in unpadded urlsafe base64. Timestamps
+    are stored with one-second precision. The optional "content" dedup key
+    is kept, so recovered codes can still be reused for re-shared uploads.
+    """
+    if metadata["type"] == "batch":
+        kind = KIND_BATCH
+        files = metadata["files"]
+    else:
+        kind = KIND_SINGLE
+        files = [(metadata["file_id"], metadata["media_type"])]
+
+    body = bytearray()
+    _write_str(body, metadata["code"])
+
+    # Media types are written once and referenced by index
+    tags = []
+    for _, media_type in files:
+        if media_type not in tags:
+            tags.append(media_type)
+    _write_varint(body, len(tags))
+    for media_type in tags:
+        _write_str(body, media_type)
+
+    _write_varint(body, len(files))
+    for file_id, media_type in files:
+        is_binary, raw = _pack_file_id(file_id)
+        tag = tags.index(media_type)
+        body.append(tag | TAG_BINARY_ID if is_binary else tag)
+        _write_varint(body, len(raw))
+        body += raw
+
+    flags = 0
+    if metadata.get("content"):
+        _write_str(body, metadata["content"])
+        flags |= FLAG_CONTENT
+
+    compressed = zlib.compress(bytes(body), 9)
+    if len(compressed) < len(body):
+        body = compressed
+        flags |= FLAG_COMPRESSED
+
+    header = HEADER.pack(VERSION, flags, kind,
+                         _timestamp(metadata["created_at"]),
+                         _timestamp(metadata["expires_at"]))
+    return PREFIX + _b64encode(header + bytes(body))
+
+
+def peek_expires_at(token):
+    """Read only the expiry of an encoded token, without decoding the body"""
+    if not token.startswith(PREFIX):
+        raise MetadataError("Not an encoded metadata token")
+    chunk = token[len(PREFIX):len(PREFIX) + HEADER_CHARS]
+    try:
+        header = _b64decode(chunk)[:HEADER.size]
+        version, _, _, _, expires_at = HEADER.unpack(header)
+    except (ValueError, struct.error) as e:
+        raise MetadataError(f"Invalid metadata header: {e}") from e
+    if version != VERSION:
+        raise MetadataError(f"Unsupported metadata version: {version}")
+    return EPOCH + timedelta(seconds=expires_at)
+
+
+def decode_metadata(token):
+    """Decode a caption token produced by encode_metadata"""
+    if not token.startswith(PREFIX):
+        raise MetadataError("Not an encoded metadata token")
+    try:
+        data = _b64decode(token[len(PREFIX):])
+        version, flags, kind, created_at, expires_at = HEADER.unpack_from(
+            data)
+        if version != VERSION:
+            raise MetadataError(f"Unsupported metadata version: {version}")
+
+        body = data[HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            body = zlib.decompress(body)
+        body = memoryview(body)
+
+        code, pos = _read_str(body, 0)
+        tag_count, pos = _read_varint(body, pos)
+        tags = []
+        for _ in range(tag_count):
+            media_type, pos = _read_str(body, pos)
+            tags.append(media_type)
+
+        file_count, pos = _read_varint(body, pos)
+        files = []
+        for _ in range(file_count):
+            tag = body[pos]
+            length, pos = _read_varint(body, pos + 1)
+            raw = bytes(body[pos:pos + length])
+            pos += length
+            files.append((_unpack_file_id(tag & TAG_BINARY_ID, raw),
+                          tags[tag & ~TAG_BINARY_ID]))
+        content = None
+        if flags & FLAG_CONTENT:
+            content, pos = _read_str(body, pos)
+    except MetadataError:
+        raise
+    except (ValueError, IndexError, struct.error, zlib.error) as e:
+        raise MetadataError(f"Corrupt metadata token: {e}") from e
+
+    metadata = {"code": code}
+    if kind == KIND_BATCH:
+        metadata["type"] = "batch"
+        metadata["files"] = files
+    else:
+        metadata["type"] = "single"
+        metadata["file_id"], metadata["media_type"] = files[0]
+    metadata["expires_at"] = _isoformat(expires_at)
+    metadata["created_at"] = _isoformat(created_at)
+    if content is not None:
+        metadata["content"] = content
+    return metadata
+
+
+def split_token(token, first_size, rest_size):
+    """Split a token into caption-sized parts
+
+    A token that fits in ``first_size`` is returned unchanged. Otherwise
+    every part is prefixed with ``C1:<i>/<n>:`` so the parts can be found
+    and joined again with join_parts.
+    """
+    if len(token) <= first_size:
+        return [token]
+
+    # Leave room for the part prefix on every chunk
+    overhead = len(PREFIX) + 12
+    body = token[len(PREFIX):]
+    chunks = [body[:first_size - overhead]]
+    pos = first_size - overhead
+    while pos < len(body):
+        chunks.append(body[pos:pos + rest_size - overhead])
+        pos += rest_size - overhead
+
+    total = len(chunks)
+    return [
+        f"{PREFIX}{index}/{total}:{chunk}"
+        for index, chunk in enumerate(chunks, start=1)
+    ]
+
+
+def parse_part(text):
+    """Return (index, total, chunk) for a part token, or None for a whole one"""
+    body = text[len(PREFIX):]
+    head, sep, chunk = body.partition(":")
+    if not sep or "/" not in head:
+        return None
+    index, _, total = head.partition("/")
+    if not (index.isdigit() and total.isdigit()):
+        return None
+    return int(index), int(total), chunk
+
+
+def join_parts(chunks):
+    """Join the chunks of a split token (in order) back into a token"""
+    return PREFIX + "".join(chunks)
+
+
+if __name__ == "__main__":
+    # Size and speed comparison against the old str(metadata) captions
+    import ast
+    import random
+    import string
+    import timeit
+
+    def fake_file_id():
+        alphabet = string.ascii_letters + string.digits + "-_"
+        return "AgACAgQAAxkBAAI" + "".join(random.choices(alphabet, k=58))
+
+    now = datetime.utcnow()
+    for count in (1, 5, 10, 50):
+        files = [(fake_file_id(), random.choice(["photo", "video", "document"]))
+                 for _ in range(count)]
+        metadata = {
+            "code": "abc123",
+            "type": "batch" if count > 1 else "single",
+            "expires_at": (now + timedelta(days=2)).isoformat(),
+            "created_at": now.isoformat()
+        }
+        if count > 1:
+            metadata["files"] = files
+        else:
+            metadata["file_id"], metadata["media_type"] = files[0]
+
+        legacy = str(metadata)
+        token = encode_metadata(metadata)
+
+        repr_decode = timeit.timeit(lambda: ast.literal_eval(legacy),
+                                    number=2000) / 2000
+        token_decode = timeit.timeit(lambda: decode_metadata(token),
+                                     number=2000) / 2000
+        token_encode = timeit.timeit(lambda: encode_metadata(metadata),
+                                     number=2000) / 2000
+        print(f"{count:>3} files: repr {len(legacy):>5} chars "
+              f"(parse {repr_decode * 1e6:7.1f}us) | "
+              f"C1 {len(token):>5} chars "
+              f"(encode {token_encode * 1e6:6.1f}us, "
+              f"decode {token_decode * 1e6:6.1f}us)")
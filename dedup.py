@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DedupIndex:
+    """Finds the code already serving a file or batch the admin re-shares
+
+    Content is identified by Telegram's ``file_unique_id``, which stays the
+    same for one file however often it is forwarded or re-sent, unlike
+    ``file_id``. A single file is keyed on its unique ID and a batch on a
+    hash of its sorted, de-duplicated unique IDs. The key is saved in the
+    code's metadata as ``"content"`` so the index can be rebuilt from the
+    code store on startup.
+
+    Batches in progress only keep file_ids, so the unique ID of the last
+    ``max_file_ids`` files seen is remembered here.
+    """
+
+    def __init__(self, max_file_ids=10_000):
+        self.max_file_ids = max_file_ids
+        # file_id -> file_unique_id
+        self._unique_ids = OrderedDict()
+        # content key -> code
+        self._codes = {}
+
+        self.lookups = 0
+        self.codes_reused = 0
+        self.expiries_extended = 0
+        self.posts_reused = 0
+
+    def __len__(self):
+        return len(self._codes)
+
+    @property
+    def posts_saved(self):
+        """Channel posts avoided by serving re-shares from earlier ones"""
+        return self.codes_reused + self.expiries_extended + self.posts_reused
+
+    def stats(self):
+        return {
+            "dedup_index_entries": len(self._codes),
+            "dedup_lookups": self.lookups,
+            "dedup_codes_reused": self.codes_reused,
+            "dedup_expiries_extended": self.expiries_extended,
+            "dedup_posts_reused": self.posts_reused,
+            "dedup_posts_saved": self.posts_saved,
+        }
+
+    def remember(self, file_id, unique_id):
+        self._unique_ids[file_id] = unique_id
+        self._unique_ids.move_to_end(file_id)
+        while len(self._unique_ids) > self.max_file_ids:
+            self._unique_ids.popitem(last=False)
+
+    def content_key(self, files, kind="single"):
+        """Key of (file_id, media_type) pairs, or None if a file is unknown"""
+        unique_ids = []
+        for file_id, _ in files:
+            unique_id = self._unique_ids.get(file_id)
+            if unique_id is None:
+                return None
+            unique_ids.append(unique_id)
+
+        if kind == "single":
+            return f"s:{unique_ids[0]}"
+        digest = hashlib.sha256(
+            "\n".join(sorted(set(unique_ids))).encode()).hexdigest()
+        return f"b:{digest[:32]}"
+
+    def lookup(self, key):
+        self.lookups += 1
+        return self._codes.get(key)
+
+    def add(self, key, code):
+        self._codes[key] = code
+
+    def discard(self, key, code):
+        """Forget key, unless it has been pointed at another code since"""
+        if self._codes.get(key) == code:
+            del self._codes[key]
+
+    def load(self, store):
+        """Rebuild the index from the content keys of every stored code"""
+        codes = {}
+        for page in store.iter_pages():
+            for code, _, metadata in page:
+                # Only codes minted with dedup on carry a key
+                if '"content"' not in metadata:
+                    continue
+                key = json.loads(metadata).get("content")
+                if key:
+                    codes[key] = code
+        # Codes minted while loading win over what was read
+        codes.update(self._codes)
+        self._codes = codes
+        logger.info(f"Dedup index loaded with {len(codes)} entries")
@@ -0,0 +1,194 @@
+import logging
+from datetime import datetime
+
+from telegram import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.error import TelegramError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts 2-10 items per media group
+MAX_ALBUM_SIZE = 10
+
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+}
+
+# Naive UTC epoch; metadata timestamps are naive UTC ISO strings
+EPOCH = datetime(1970, 1, 1)
+
+# Rough per-file overhead of a prepared delivery, for the cache size cap
+PREPARED_FILE_OVERHEAD = 400
+
+
+def album_kind(media_type):
+    """Photos and videos can share an album; documents need their own"""
+    return "visual" if media_type in ("photo", "video") else "document"
+
+
+def plan_albums(files):
+    """Split (file_id, media_type) pairs into albums of compatible items
+
+    Order is kept within each kind, and albums are ordered by the position
+    of their first file in the batch.
+    """
+    open_albums = {}
+    albums = []
+    for position, (file_id, media_type) in enumerate(files):
+        kind = album_kind(media_type)
+        album = open_albums.get(kind)
+        if album is None or len(album[1]) == MAX_ALBUM_SIZE:
+            album = (position, [])
+            open_albums[kind] = album
+            albums.append(album)
+        album[1].append((file_id, media_type))
+
+    albums.sort(key=lambda album: album[0])
+    return [items for _, items in albums]
+
+
+async def send_file(bot, chat_id, file_id, media_type, **kwargs):
+    """Send one stored file with the matching send_* method"""
+    if media_type == "photo":
+        return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+    if media_type == "video":
+        return await bot.send_video(chat_id=chat_id, video=file_id, **kwargs)
+    return await bot.send_document(chat_id=chat_id, document=file_id, **kwargs)
+
+
+def album_media(album):
+    return [INPUT_MEDIA.get(media_type, InputMediaDocument)(file_id)
+            for file_id, media_type in album]
+
+
+async def send_album(bot, chat_id, album, media=None):
+    """Send one planned album, falling back to single sends if it fails
+
+    ``media`` is the album's InputMedia list if it was built beforehand.
+    Returns the number of files delivered.
+    """
+    if len(album) == 1:
+        file_id, media_type = album[0]
+        await send_file(bot, chat_id, file_id, media_type)
+        return 1
+
+    if media is None:
+        media = album_media(album)
+    try:
+        await bot.send_media_group(chat_id=chat_id, media=media)
+        return len(album)
+    except TelegramError as e:
+        logger.warning(
+            f"Album of {len(album)} failed for chat {chat_id}, "
+            f"sending files one by one: {e}")
+
+    delivered = 0
+    for file_id, media_type in album:
+        try:
+            await send_file(bot, chat_id, file_id, media_type)
+            delivered += 1
+        except TelegramError as e:
+            logger.error(f"Failed to deliver {media_type} to {chat_id}: {e}")
+    return delivered
+
+
+async def deliver_range(bot, chat_id, albums, start, limit, checkpoint=None):
+    """Deliver up to ``limit`` files of a planned batch from ``start``
+
+    Positions count files across ``albums`` (``(album, media)`` pairs) in
+    delivery order, so a batch can be sent in pages and resumed where it
+    stopped. ``checkpoint(position)`` is called after every successful
+    send. Stops at the first file that cannot be delivered; returns
+    ``(position, error)`` with ``error`` None if the range went out.
+    """
+    end = start + limit
+    position = start
+    offset = 0
+    for album, media in albums:
+        album_start, offset = offset, offset + len(album)
+        if offset <= position:
+            continue
+        if album_start >= end:
+            break
+
+        # Only part of the album may fall in the range
+        items = album[position - album_start:min(end, offset) - album_start]
+        if len(items) > 1:
+            if len(items) < len(album) or media is None:
+                media = album_media(items)
+            try:
+                await bot.send_media_group(chat_id=chat_id, media=media)
+                position += len(items)
+                if checkpoint:
+                    checkpoint(position)
+                continue
+            except TimedOut as e:
+                # The album may have gone out; let the user resume instead
+                return position, e
+            except TelegramError as e:
+                logger.warning(
+                    f"Album of {len(items)} failed for chat {chat_id}, "
+                    f"sending files one by one: {e}")
+
+        for file_id, media_type in items:
+            try:
+                await send_file(bot, chat_id, file_id, media_type)
+            except TelegramError as e:
+                logger.error(
+                    f"Failed to deliver {media_type} to {chat_id}: {e}")
+                return position, e
+            position += 1
+            if checkpoint:
+                checkpoint(position)
+    return position, None
+
+
+class PreparedDelivery:
+    """Everything needed to deliver a code, built once and reused
+
+    ``albums`` holds ``(album, media)`` pairs ready for send_album;
+    signed codes without file_ids are copied from ``message_id`` instead.
+    """
+
+    __slots__ = ("kind", "expires_at", "albums", "file_count", "header",
+                 "message_id", "from_chat_id", "size")
+
+    def __init__(self, metadata, from_chat_id):
+        self.kind = metadata["type"]
+        self.expires_at = (datetime.fromisoformat(metadata["expires_at"]) -
+                           EPOCH).total_seconds()
+        self.from_chat_id = from_chat_id
+        self.message_id = None
+        self.header = None
+
+        if self.kind == "batch":
+            files = [tuple(item) for item in metadata["files"]]
+            self.header = f"📦 **Batch Media ({len(files)} files)**"
+        elif metadata.get("file_id") is None:
+            # Signed code: deliver by copying the database channel post
+            files = []
+            self.message_id = metadata["message_id"]
+        else:
+            files = [(metadata["file_id"], metadata["media_type"])]
+
+        self.albums = [(album, album_media(album) if len(album) > 1 else None)
+                       for album in plan_albums(files)]
+        self.file_count = max(len(files), 1)
+        self.size = PREPARED_FILE_OVERHEAD * self.file_count + sum(
+            len(file_id) for file_id, _ in files)
+
+
+async def deliver_prepared(bot, chat_id, prepared):
+    """Deliver a prepared code; returns files delivered"""
+    if prepared.message_id is not None:
+        await bot.copy_message(chat_id=chat_id,
+                               from_chat_id=prepared.from_chat_id,
+                               message_id=prepared.message_id,
+                               caption="")
+        return 1
+
+    delivered = 0
+    for album, media in prepared.albums:
+        delivered += await send_album(bot, chat_id, album, media)
+    return delivered
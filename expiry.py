@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import logging
+from collections import deque
+from datetime import datetime
+
+from outbound import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Naive UTC epoch used for heap keys (metadata timestamps are naive UTC)
+EPOCH = datetime(1970, 1, 1)
+
+# Longest sleep between checks; bounds drift if the clock jumps
+MAX_SLEEP = 60.0
+
+# What to do with the database channel post of an expired code
+POST_ACTIONS = ("keep", "delete", "edit")
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value - EPOCH).total_seconds()
+
+
+class ExpiryScheduler:
+    """Evicts codes from the store as soon as they expire
+
+    Codes sit in a min-heap keyed on ``expires_at``; a single task on the
+    event loop sleeps until the earliest one is due, so scheduling and
+    eviction are both O(log n). Posts of evicted codes can optionally be
+    deleted or edited in the database channel, a throttled batch at a time.
+
+    With several replicas, ``owns(code)`` limits the scheduler to its share
+    of the codes and ``rebuild_interval`` reloads that share periodically
+    to pick up codes minted by other replicas. ``on_evict(code)`` is called
+    for every code removed, e.g. to drop it from caches.
+    """
+
+    def __init__(self,
+                 store,
+                 chat_id=None,
+                 post_action="keep",
+                 batch_size=100,
+                 batch_interval=1.0,
+                 owns=None,
+                 rebuild_interval=None,
+                 on_evict=None):
+        if post_action not in POST_ACTIONS:
+            raise ValueError(f"Unknown expired post action: {post_action}")
+        self.store = store
+        self.chat_id = chat_id
+        self.post_action = post_action
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.owns = owns
+        self.rebuild_interval = rebuild_interval
+        self.on_evict = on_evict
+
+        self.evicted = 0
+        self.posts_cleaned = 0
+        self.posts_failed = 0
+
+        self._heap = []
+        self._posts = deque()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._bot = None
+
+    @property
+    def pending(self):
+        return len(self._heap)
+
+    def stats(self):
+        return {
+            "pending_expiries": self.pending,
+            "evicted_codes": self.evicted,
+            "expired_posts_cleaned": self.posts_cleaned,
+            "expired_posts_queued": len(self._posts),
+        }
+
+    def schedule(self, code, expires_at, message_id=None):
+        """Track a code; expires_at is a datetime or ISO string (naive UTC)"""
+        if self.owns is not None and not self.owns(code):
+            return
+        item = (_timestamp(expires_at), code, message_id)
+        heapq.heappush(self._heap, item)
+        # Wake the loop only if this code is now the next one due
+        if self._heap[0] is item:
+            self._wakeup.set()
+
+    def _load_heap(self):
+        heap = [(_timestamp(expires_at), code, message_id)
+                for code, expires_at, message_id in self.store.iter_expiries()
+                if self.owns is None or self.owns(code)]
+        heapq.heapify(heap)
+        return heap
+
+    def rebuild(self, heap=None):
+        """Reload the heap from every code currently in the store"""
+        self._heap = self._load_heap() if heap is None else heap
+        self._wakeup.set()
+        logger.info(f"Expiry scheduler tracking {len(self._heap)} codes")
+
+    async def reload(self):
+        """Rebuild the heap, reading the store off the event loop"""
+        self.rebuild(await asyncio.to_thread(self._load_heap))
+
+    def start(self, bot):
+        self._bot = bot
+        self._tasks.append(asyncio.create_task(self._run()))
+        if self.post_action != "keep":
+            self._tasks.append(asyncio.create_task(self._clean_posts()))
+        if self.rebuild_interval:
+            self._tasks.append(
+                asyncio.create_task(self._rebuild_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _evict_due(self):
+        now = _timestamp(datetime.utcnow())
+        while self._heap and self._heap[0][0] <= now:
+            _, code, message_id = heapq.heappop(self._heap)
+
+            # The code may have been removed already or given a new expiry,
+            # possibly by another replica, so skip any cached copy
+            entry = self.store.refresh(code)
+            if entry is None:
+                continue
+            if _timestamp(entry['metadata']['expires_at']) > now:
+                continue
+
+            try:
+                del self.store[code]
+            except KeyError:
+                # Another replica got there first
+                continue
+            self.evicted += 1
+            if self.on_evict is not None:
+                self.on_evict(code)
+            message_id = message_id or entry.get('message_id')
+            if self.post_action != "keep" and message_id is not None:
+                self._posts.append((code, message_id))
+        return now
+
+    async def _run(self):
+        while True:
+            try:
+                now = self._evict_due()
+            except Exception as e:
+                logger.error(f"Expiry sweep failed: {e}")
+                now = _timestamp(datetime.utcnow())
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(max(self._heap[0][0] - now, 0), MAX_SLEEP)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _rebuild_periodically(self):
+        while True:
+            await asyncio.sleep(self.rebuild_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Expiry rebuild failed: {e}")
+
+    async def _clean_posts(self):
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            batch = []
+            while self._posts and len(batch) < self.batch_size:
+                batch.append(self._posts.popleft())
+            if not batch:
+                continue
+
+            if self.post_action == "delete":
+                await self._delete_posts(batch)
+            else:
+                await self._edit_posts(batch)
+
+    async def _delete_posts(self, batch):
+        message_ids = [message_id for _, message_id in batch]
+        try:
+            await self._bot.delete_messages(self.chat_id, message_ids,
+                                            rate_limit_args=PRIORITY_BULK)
+            self.posts_cleaned += len(message_ids)
+        except Exception as e:
+            # Telegram refuses to delete posts older than 48 hours
+            self.posts_failed += len(message_ids)
+            logger.warning(f"Could not delete expired posts: {e}")
+
+    async def _edit_posts(self, batch):
+        for code, message_id in batch:
+            try:
+                await self._bot.edit_message_caption(
+                    chat_id=self.chat_id,
+                    message_id=message_id,
+                    caption=f"⌛ Expired\nCode: {code}",
+                    rate_limit_args=PRIORITY_BULK)
+                self.posts_cleaned += 1
+            except Exception as e:
+                self.posts_failed += 1
+                logger.warning(
+                    f"Could not mark post {message_id} as expired: {e}")
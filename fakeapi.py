@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from outbound import THROTTLED_PREFIXES, TokenBucket
+
+BOT_USER = {
+    "id": 7000000001,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+MEDIA_METHODS = {
+    "sendPhoto": "photo",
+    "sendVideo": "video",
+    "sendDocument": "document",
+}
+
+
+class FakeBotAPI:
+    """Local stand-in for the Telegram Bot API, for benchmarks
+
+    Answers the methods this bot uses with well-formed results after a
+    simulated latency, enforces Telegram-like flood limits with 429
+    RetryAfter errors and derives membership from the user ID, so runs
+    are reproducible. Point the bot at it with
+    ``BOT_API_BASE_URL=http://host:port``.
+
+    ``GET /_stats`` returns call counts per method, ``POST /_reset``
+    clears them.
+    """
+
+    def __init__(self,
+                 latency=0.05,
+                 jitter=0.01,
+                 global_rate=30,
+                 chat_rate=1,
+                 chat_burst=3,
+                 group_rate=1,
+                 group_burst=20,
+                 member_percent=80,
+                 flood_limits=True,
+                 seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.member_percent = member_percent
+        self.flood_limits = flood_limits
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.random = random.Random(self.seed)
+        self.calls = Counter()
+        self.flood_errors = 0
+        self._message_ids = itertools.count(1000)
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats = {}
+
+    def stats(self):
+        return {
+            "calls": dict(self.calls),
+            "total_calls": sum(self.calls.values()),
+            "flood_errors": self.flood_errors,
+        }
+
+    def _retry_after(self, chat_id):
+        """Seconds the caller must wait, or 0 if the call may go through"""
+        now = time.monotonic()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                rate, burst = self.chat_rate, self.chat_burst
+            else:
+                rate, burst = self.group_rate, self.group_burst
+            bucket = self._chats[chat_id] = TokenBucket(rate, burst, now)
+
+        wait = max(self._global.wait_time(now), bucket.wait_time(now))
+        if wait:
+            return max(1, math.ceil(wait))
+        self._global.reserve(now)
+        bucket.reserve(now)
+        return 0
+
+    def _message(self, chat_id, **fields):
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 \
+            else "channel"
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": BOT_USER,
+            **fields,
+        }
+
+    def _media(self, media_type, file_id):
+        item = {"file_id": file_id, "file_unique_id": f"u{file_id[-16:]}"}
+        if media_type == "photo":
+            return {"photo": [dict(item, width=1280, height=720)]}
+        if media_type == "video":
+            return {"video": dict(item, width=1280, height=720, duration=10)}
+        return {"document": item}
+
+    def _is_member(self, user_id):
+        return user_id % 100 < self.member_percent
+
+    def result(self, method, params):
+        chat_id = params.get("chat_id")
+        if method == "getMe":
+            return BOT_USER
+        if method in MEDIA_METHODS:
+            media_type = MEDIA_METHODS[method]
+            return self._message(
+                chat_id, caption=params.get("caption"),
+                **self._media(media_type, str(params.get(media_type))))
+        if method == "sendMediaGroup":
+            return [
+                self._message(chat_id,
+                              **self._media(item["type"], item["media"]))
+                for item in params.get("media", [])
+            ]
+        if method == "sendMessage":
+            return self._message(chat_id, text=str(params.get("text", "")))
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in ("editMessageText", "editMessageCaption"):
+            return True if params.get("inline_message_id") else \
+                self._message(chat_id or 1, text=str(params.get("text", "")))
+        if method == "getChatMember":
+            user = {"id": params["user_id"], "is_bot": False,
+                    "first_name": "User"}
+            status = "member" if self._is_member(params["user_id"]) else "left"
+            return {"status": status, "user": user}
+        if method == "getUpdates":
+            return []
+        # answerCallbackQuery, deleteMessages, setWebhook, deleteWebhook...
+        return True
+
+    async def _params(self, request):
+        """Call parameters; PTB form-encodes them with JSON values"""
+        body = await request.body()
+        if request.headers.get("content-type", "").startswith(
+                "application/json"):
+            return json.loads(body or b"{}")
+
+        # Uploads (multipart) are not simulated; file_id sends are forms
+        params = {}
+        for key, value in parse_qsl(body.decode("utf-8")):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def handle(self, request):
+        method = request.path_params["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+        await asyncio.sleep(delay)
+
+        if self.flood_limits and method.startswith(THROTTLED_PREFIXES):
+            retry_after = self._retry_after(params.get("chat_id"))
+            if retry_after:
+                self.flood_errors += 1
+                return JSONResponse({
+                    "ok": False,
+                    "error_code": 429,
+                    "description":
+                    f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }, status_code=429)
+
+        return JSONResponse({"ok": True, "result": self.result(method, params)})
+
+    def app(self):
+
+        async def stats(request):
+            return JSONResponse(self.stats())
+
+        async def reset(request):
+            self.reset()
+            return JSONResponse({"ok": True})
+
+        return Starlette(routes=[
+            Route("/_stats", stats),
+            Route("/_reset", reset, methods=["POST"]),
+            Route("/bot{token}/{method}", self.handle, methods=["GET", "POST"]),
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mean seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--chat-rate", type=float, default=1)
+    parser.add_argument("--group-rate", type=float, default=1)
+    parser.add_argument("--member-percent", type=int, default=80)
+    parser.add_argument("--no-flood-limits", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency,
+                     jitter=args.jitter,
+                     global_rate=args.global_rate,
+                     chat_rate=args.chat_rate,
+                     group_rate=args.group_rate,
+                     member_percent=args.member_percent,
+                     flood_limits=not args.no_flood_limits,
+                     seed=args.seed)
+    uvicorn.run(api.app(), host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryCache:
+    """Prepared deliveries for popular codes
+
+    Lookups of a cached code cost one dict read and an expiry comparison.
+    Concurrent misses for the same code share one ``load`` call, so a link
+    going viral is resolved and prepared once. Every hit counts towards the
+    code's popularity; when the cache is over ``max_entries`` or
+    ``max_bytes`` the least popular entry is evicted (expired ones first).
+    Popularity is halved periodically so yesterday's hits fade out.
+
+    ``load(code)`` returns a PreparedDelivery, or None for unknown codes;
+    None is never cached since a pending code can become valid.
+    ``on_hit(code)`` is called for lookups answered from the cache, which
+    never reach ``load``. Callers invalidate codes they change; when other
+    processes change the store too, ``max_age`` bounds how many seconds an
+    entry is served before it is loaded again.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=8 * 1024 * 1024,
+                 on_hit=None, max_age=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_hit = on_hit
+        self.max_age = max_age
+
+        # code -> [prepared, hits, loaded at (monotonic)]
+        self._entries = {}
+        self._inflight = {}
+        self._bytes = 0
+        self._hits_until_decay = max_entries * 10
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "delivery_cache_entries": len(self._entries),
+            "delivery_cache_bytes": self._bytes,
+            "delivery_cache_hit_rate": round(self.hits / lookups, 4)
+            if lookups else 0.0,
+            "delivery_cache_coalesced": self.coalesced,
+            "delivery_cache_evictions": self.evictions,
+        }
+
+    def invalidate(self, code):
+        entry = self._entries.pop(code, None)
+        if entry is not None:
+            self._bytes -= entry[0].size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _decay(self):
+        for entry in self._entries.values():
+            entry[1] >>= 1
+        self._hits_until_decay = self.max_entries * 10
+
+    def _evict(self, keep):
+        now = time.time()
+        while (len(self._entries) > self.max_entries or
+               self._bytes > self.max_bytes) and len(self._entries) > 1:
+            victim = None
+            for code, (prepared, hits, _) in self._entries.items():
+                if code == keep:
+                    continue
+                if prepared.expires_at <= now:
+                    victim = code
+                    break
+                if victim is None or hits < self._entries[victim][1]:
+                    victim = code
+            self.invalidate(victim)
+            self.evictions += 1
+
+    def _store(self, code, prepared):
+        self.invalidate(code)
+        self._entries[code] = [prepared, 1, time.monotonic()]
+        self._bytes += prepared.size
+        self._evict(keep=code)
+
+    async def _load(self, code, load):
+        prepared = await load(code)
+        if prepared is not None:
+            self._store(code, prepared)
+        return prepared
+
+    def _load_once(self, code, load):
+        task = self._inflight.get(code)
+        if task is not None:
+            self.coalesced += 1
+            return task
+
+        task = asyncio.ensure_future(self._load(code, load))
+        self._inflight[code] = task
+        task.add_done_callback(lambda _: self._inflight.pop(code, None))
+        return task
+
+    async def get(self, code, load):
+        """Return the prepared delivery for a code, loading it if needed"""
+        entry = self._entries.get(code)
+        if entry is not None:
+            if entry[0].expires_at > time.time() and (
+                    self.max_age is None or
+                    time.monotonic() - entry[2] < self.max_age):
+                self.hits += 1
+                entry[1] += 1
+                if self.on_hit is not None:
+                    self.on_hit(code)
+                self._hits_until_decay -= 1
+                if not self._hits_until_decay:
+                    self._decay()
+                return entry[0]
+            self.invalidate(code)
+
+        self.misses += 1
+        # Shield so a cancelled request does not cancel the shared load
+        return await asyncio.shield(self._load_once(code, load))
+
+
+if __name__ == "__main__":
+    # Viral link simulation: many concurrent /start requests for one batch
+    import random
+    import timeit
+    from datetime import datetime, timedelta
+
+    from delivery import PreparedDelivery
+
+    expires_at = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    metadata = {
+        "code": "abc123",
+        "type": "batch",
+        "files": [[f"BAACAgQAAxkBAAI{i:058d}", random.choice(
+            ("photo", "video", "document"))] for i in range(30)],
+        "expires_at": expires_at,
+    }
+    loads = 0
+
+    async def load(code):
+        global loads
+        loads += 1
+        await asyncio.sleep(0.01)  # store read
+        return PreparedDelivery(metadata, -100)
+
+    async def simulate():
+        cache = DeliveryCache()
+        await asyncio.gather(*(cache.get("abc123", load) for _ in range(1000)))
+        print(f"1000 concurrent requests -> {loads} load(s)")
+
+        runs = 100000
+        started = time.perf_counter()
+        for _ in range(runs):
+            await cache.get("abc123", load)
+        hot = (time.perf_counter() - started) / runs
+        cold = timeit.timeit(lambda: PreparedDelivery(metadata, -100),
+                             number=1000) / 1000
+        print(f"cached lookup:     {hot * 1e6:7.2f}us")
+        print(f"prepare (no read): {cold * 1e6:7.2f}us")
+
+    asyncio.run(simulate())
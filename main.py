@@ -1,10 +1,41 @@
 import os
+import asyncio
+import hmac
 import logging
 import string
 import random
+import tempfile
+import zlib
+from functools import partial
 from datetime import datetime, timedelta
-import threading
-from flask import Flask, jsonify
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import (JSONResponse, PlainTextResponse, Response,
+                                 StreamingResponse)
+from starlette.routing import Route
+
+from codec import encode_metadata, split_token
+from admission import AdmissionController
+from analytics import AccessAnalytics
+from concurrency import PerUserUpdateProcessor, map_bounded
+from dedup import DedupIndex
+from delivery import PreparedDelivery, deliver_prepared, deliver_range
+from eventlog import EventLogger, parse_sample_rates, setup_logging
+from expiry import ExpiryScheduler
+from hotcache import DeliveryCache
+from mediagroups import MediaGroupCollector
+from memberset import MemberSet
+from membership import MembershipCache
+from metrics import CODE_LOOKUPS, REGISTRY, instrument
+from outbound import PRIORITY_BULK, PRIORITY_HIGH, OutboundScheduler
+from recovery import recover_from_file
+from replay import UpdateRecorder
+from sessions import WriteBehindSessionStore
+from signed_codes import CodeSigner, is_signed_code
+from storage import open_code_store, open_session_store
+from transfer import (PAGE_SIZE, Importer, export_chunks, export_to_file,
+                      import_from_file)
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -13,39 +44,280 @@ from telegram.ext import (
     MessageHandler,
     ContextTypes,
     CallbackQueryHandler,
+    ChatMemberHandler,
     filters,
 )
 
 # Logging setup
-logging.basicConfig(level=logging.INFO)
+# Log records are formatted and written by a background thread; LOG_FORMAT
+# is text or json. LOG_SAMPLE keeps 1 in 1/rate of busy INFO events
+# (e.g. "code_hit=0.01"); warnings and errors are always logged.
+log_writer = setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    fmt=os.getenv("LOG_FORMAT", "text"))
 logger = logging.getLogger(__name__)
-
-# Flask app setup
-app = Flask(__name__)
+events = EventLogger(
+    logger,
+    parse_sample_rates(os.getenv("LOG_SAMPLE", "code_hit=0.01,code_miss=0.1")))
 
 # Bot token from env
 TOKEN = os.getenv("BOT_TOKEN")
 
+# Bot API server; point this at a local Bot API server or at fakeapi.py
+# for benchmarks
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL",
+                             "https://api.telegram.org").rstrip("/")
+
+# How updates arrive: "polling" (getUpdates) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Web server for health checks, stats and the webhook endpoint
+PORT = int(os.getenv("PORT", "5000"))
+
+# Bearer token for the /export and /import endpoints (disabled if unset)
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+# Webhook settings (BOT_MODE=webhook): public base URL Telegram posts to,
+# the path it posts to and the secret token it must send back (required;
+# updates without it are rejected)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
 # Database channel ID - replace with your database channel ID
 DATABASE_CHANNEL_ID = -1002678155201  # Replace with your actual channel ID
 
-# Track users who have previously joined the backup channel
-channel_joined_users = set()
+# Replica layout when several bot processes share one store: this process
+# is REPLICA_INDEX of REPLICA_COUNT (0-based). Expiry work is partitioned
+# by code and the flood budget is split between replicas.
+REPLICA_INDEX = int(os.getenv("REPLICA_INDEX", "0"))
+REPLICA_COUNT = int(os.getenv("REPLICA_COUNT", "1"))
 
 # Storage for message IDs in database channel (code -> message_id mapping)
-channel_message_storage = {}
+# Backed by SQLite by default so links survive restarts; use memory:// to disable
+# With several replicas, cached codes are re-read from SQLite after
+# CODE_STORE_LRU_TTL seconds (2 by default) to see other replicas' writes
+CODE_STORE_URL = os.getenv("CODE_STORE_URL", "sqlite:///data/codes.db")
+channel_message_storage = open_code_store(CODE_STORE_URL,
+                                          shared=REPLICA_COUNT > 1)
+
+
+def data_path(name):
+    """Path for a state file next to the SQLite store (None without one)"""
+    if not CODE_STORE_URL.startswith("sqlite:///"):
+        return None
+    if REPLICA_COUNT > 1:
+        stem, extension = os.path.splitext(name)
+        name = f"{stem}-{REPLICA_INDEX}{extension}"
+    return os.path.join(os.path.dirname(CODE_STORE_URL[len("sqlite:///"):]),
+                        name)
+
+
+# Track users who have joined the backup channel. Members are re-checked
+# after MEMBERSHIP_TTL seconds (in the background while they stay active),
+# non-members after MEMBERSHIP_NEGATIVE_TTL seconds. Members are kept in a
+# compact set saved every MEMBERSHIP_SNAPSHOT_INTERVAL seconds to
+# MEMBERSHIP_PATH (next to the SQLite store by default) and mapped back in
+# on start; members not confirmed for MEMBERSHIP_MAX_AGE seconds are dropped.
+MEMBERSHIP_PATH = os.getenv("MEMBERSHIP_PATH", data_path("members.bin"))
+channel_joined_users = MembershipCache(
+    positive_ttl=int(os.getenv("MEMBERSHIP_TTL", str(6 * 3600))),
+    negative_ttl=int(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "5")),
+    members=MemberSet(
+        path=MEMBERSHIP_PATH or None,
+        max_age=int(os.getenv("MEMBERSHIP_MAX_AGE", str(30 * 86400)))),
+    snapshot_interval=float(os.getenv("MEMBERSHIP_SNAPSHOT_INTERVAL", "300")))
+
+# Admin session state (custom timer, batch in progress), stored next to the
+# codes so it survives restarts. A single process serves it from memory and
+# writes changes behind every SESSION_FLUSH_INTERVAL seconds; replicas use
+# the shared store directly so every replica sees the same batch.
+session_store = open_session_store(CODE_STORE_URL)
+if REPLICA_COUNT == 1 and not CODE_STORE_URL.startswith("memory://"):
+    session_store = WriteBehindSessionStore(
+        session_store,
+        flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", "1")))
+
+# Optional export of the database channel (result.json or .jsonl) to rebuild
+# the code index from on startup
+RECOVER_FROM = os.getenv("RECOVER_FROM")
+
+# What happens to the database channel post of an expired code:
+# keep, delete or edit (caption replaced with an "Expired" note)
+EXPIRED_POST_ACTION = os.getenv("EXPIRED_POST_ACTION", "keep")
+
+# Secret key for signed codes. Signed codes carry the database channel
+# post and expiry themselves and are verified without a store lookup; they
+# can only be revoked all at once by changing the key. With SIGNED_CODES=1
+# new single-file links use them (batches always get random codes).
+CODE_SIGNING_KEY = os.getenv("CODE_SIGNING_KEY", "")
+SIGNED_CODES = os.getenv("SIGNED_CODES", "0") == "1"
+code_signer = CodeSigner(CODE_SIGNING_KEY) if CODE_SIGNING_KEY else None
+
+# Re-shared uploads (same file_unique_id, or same set of them for a batch)
+# are served from the code or channel post that already exists instead of
+# being posted again. A live code that expires too early is extended when
+# DEDUP_EXTEND_EXPIRY=1. Otherwise, or if the live code outlives the new
+# expiry, a new code is minted on the same post; that is only done while
+# expired posts are kept, since two codes must not share a post that the
+# first to expire would delete or mark expired.
+DEDUP_UPLOADS = os.getenv("DEDUP_UPLOADS", "1") == "1"
+DEDUP_EXTEND_EXPIRY = os.getenv("DEDUP_EXTEND_EXPIRY", "1") == "1"
+dedup_index = DedupIndex()
 
 # Backup channel username (without @)
 BACKUP_CHANNEL = "baapBolbey"  # Replace with your backup channel username
 
+# Telegram message size limits (with a little headroom for UTF-16 emoji)
+CAPTION_LIMIT = 1000
+TEXT_LIMIT = 4000
+
 # Admin user ID - replace with your actual admin user ID
 ADMIN_USER_ID = 1524529804  # Replace with your Telegram user ID
 
-
-# Flask routes
-@app.route('/')
-def home():
-    return jsonify({
+# Channel saves running at once when minting a link per file. Past the
+# channel's burst, minting runs at DATABASE_CHANNEL_RATE posts a minute
+# (100 links take about four minutes at the default 20)
+MINT_CONCURRENCY = int(os.getenv("MINT_CONCURRENCY", "8"))
+
+# Outbound flood limits (messages per second)
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", str(30 / REPLICA_COUNT)))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+
+# Posts per minute to the database channel, and how many may go out back
+# to back; Telegram allows about 20 a minute in one group or channel
+DATABASE_CHANNEL_RATE = float(
+    os.getenv("DATABASE_CHANNEL_RATE", str(20 / REPLICA_COUNT)))
+DATABASE_CHANNEL_BURST = int(
+    os.getenv("DATABASE_CHANNEL_BURST", str(max(1, 20 // REPLICA_COUNT))))
+
+# Every context.bot call goes through this scheduler. Admin chats jump the
+# queue; the database channel keeps to its own flood limit, and bulk work
+# there (minting a link per file, expiry cleanup) waits behind deliveries.
+outbound_scheduler = OutboundScheduler(
+    overall_rate=OUTBOUND_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_limits={
+        DATABASE_CHANNEL_ID:
+        (DATABASE_CHANNEL_RATE / 60, DATABASE_CHANNEL_BURST)
+    },
+    priority_chats={ADMIN_USER_ID})
+
+# Updates are handled concurrently by up to UPDATE_WORKERS handlers; each
+# user's updates still run one at a time, in order. 1 means sequential.
+# RECORD_UPDATES appends every incoming update to that JSONL file (.gz to
+# compress) for replay.py; it holds user data, so enable it only briefly.
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
+update_processor = PerUserUpdateProcessor(
+    workers=int(os.getenv("UPDATE_WORKERS", "32")),
+    recorder=UpdateRecorder(RECORD_UPDATES) if RECORD_UPDATES else None)
+
+
+def owns_code(code):
+    """Whether this replica is responsible for the code's background work"""
+    return zlib.crc32(code.encode()) % REPLICA_COUNT == REPLICA_INDEX
+
+
+def count_cached_lookup(code):
+    """Count a lookup the delivery cache answered as the store would have"""
+    CODE_LOOKUPS.labels(
+        "signed" if code_signer and is_signed_code(code) else "hit").inc()
+
+
+# Prepared deliveries of popular codes, so viral links skip the store.
+# Local changes invalidate them; with several replicas an entry is also
+# reloaded after DELIVERY_CACHE_TTL seconds (2 by default) to pick up
+# changes made by the others.
+DELIVERY_CACHE_TTL = os.getenv("DELIVERY_CACHE_TTL",
+                               "2" if REPLICA_COUNT > 1 else "")
+delivery_cache = DeliveryCache(
+    max_entries=int(os.getenv("DELIVERY_CACHE_SIZE", "1000")),
+    on_hit=count_cached_lookup,
+    max_age=float(DELIVERY_CACHE_TTL) if DELIVERY_CACHE_TTL else None)
+
+# Evicts codes from the store as soon as they expire. With several replicas
+# each one handles its own share and reloads it every 10 minutes.
+expiry_scheduler = ExpiryScheduler(
+    channel_message_storage,
+    chat_id=DATABASE_CHANNEL_ID,
+    post_action=EXPIRED_POST_ACTION,
+    owns=owns_code if REPLICA_COUNT > 1 else None,
+    rebuild_interval=600 if REPLICA_COUNT > 1 else None,
+    on_evict=delivery_cache.invalidate)
+
+# Per-user /start limits: a burst of START_BURST_* requests, then
+# START_RATE_* per second. Every request is charged to the single budget
+# before its code is looked up; batch codes cost many sends each, so they
+# (and unknown codes) must fit the tighter batch budget too, checked once
+# the code is resolved. Throttled users are told once per throttled
+# stretch; further requests are dropped silently.
+admission = AdmissionController({
+    "single": (float(os.getenv("START_RATE_SINGLE", "0.5")),
+               int(os.getenv("START_BURST_SINGLE", "5"))),
+    "batch": (float(os.getenv("START_RATE_BATCH", "0.1")),
+              int(os.getenv("START_BURST_BATCH", "3"))),
+})
+THROTTLED_TEXT = "⏳ Too many requests. Please wait a moment and try again."
+
+# Batches larger than this are sent in pages, each behind a "Next page"
+# button; progress is saved per user and code so delivery can resume
+DELIVERY_PAGE_SIZE = int(os.getenv("DELIVERY_PAGE_SIZE", "50"))
+
+# Per-code access analytics (hits, unique users, top codes) in fixed
+# memory, saved every ANALYTICS_FLUSH_INTERVAL seconds next to the SQLite
+# store (or to ANALYTICS_PATH) and reloaded on start
+ANALYTICS_PATH = os.getenv("ANALYTICS_PATH", data_path("analytics.json"))
+access_analytics = AccessAnalytics(
+    top_k=int(os.getenv("ANALYTICS_TOP_K", "100")),
+    path=ANALYTICS_PATH or None,
+    flush_interval=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "60")))
+
+# Album uploads arrive as one update per file; files sharing a
+# media_group_id are handled together once none arrived for this long
+MEDIA_GROUP_DELAY = float(os.getenv("MEDIA_GROUP_DELAY", "1.0"))
+media_groups = MediaGroupCollector(delay=MEDIA_GROUP_DELAY)
+
+# Gauges read at scrape time from the objects above
+REGISTRY.gauge("telebot_stored_codes", "Codes in the code store",
+               lambda: len(channel_message_storage))
+REGISTRY.gauge("telebot_code_store_lru_hits", "Code store LRU hits",
+               lambda: getattr(channel_message_storage, "lru_hits", 0))
+REGISTRY.gauge("telebot_code_store_lru_misses", "Code store LRU misses",
+               lambda: getattr(channel_message_storage, "lru_misses", 0))
+REGISTRY.gauge("telebot_pending_expiries", "Codes waiting to expire",
+               lambda: expiry_scheduler.pending)
+REGISTRY.gauge("telebot_outbound_queue_depth",
+               "Outbound calls waiting for a global token",
+               lambda: outbound_scheduler.queue_depth)
+REGISTRY.gauge("telebot_updates_running", "Updates being handled",
+               lambda: update_processor.running)
+REGISTRY.gauge("telebot_delivery_cache_entries",
+               "Prepared deliveries cached", lambda: len(delivery_cache))
+REGISTRY.callback_counter("telebot_delivery_cache_hits_total",
+                          "Code lookups answered from the delivery cache",
+                          lambda: delivery_cache.hits)
+REGISTRY.callback_counter("telebot_delivery_cache_misses_total",
+                          "Code lookups the delivery cache passed on",
+                          lambda: delivery_cache.misses)
+REGISTRY.callback_counter("telebot_delivery_cache_evictions_total",
+                          "Prepared deliveries evicted from the cache",
+                          lambda: delivery_cache.evictions)
+REGISTRY.gauge("telebot_dedup_posts_saved",
+               "Channel posts avoided by upload dedup",
+               lambda: dedup_index.posts_saved)
+REGISTRY.gauge("telebot_throttled_requests",
+               "/start requests rejected by per-user limits",
+               lambda: sum(limit.throttled
+                           for limit in admission.limits.values()))
+REGISTRY.gauge("telebot_membership_cached", "Cached membership entries",
+               lambda: channel_joined_users.stats()["membership_cached"])
+REGISTRY.gauge("telebot_membership_hit_rate", "Membership cache hit rate",
+               lambda: channel_joined_users.stats()["membership_hit_rate"])
+
+
+# Web server routes
+async def home(request):
+    return JSONResponse({
         "status": "Bot is active",
         "bot_name": "Media Share Bot",
         "timestamp": datetime.utcnow().isoformat(),
@@ -53,35 +325,176 @@ def home():
         "active_users": len(channel_joined_users)
     })
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "healthy", "timestamp": datetime.utcnow().isoformat()})
 
-@app.route('/stats')
-def stats():
-    return jsonify({
+async def health(request):
+    return JSONResponse({
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+
+async def stats(request):
+    return JSONResponse({
         "channel_members": len(channel_joined_users),
         "stored_codes": len(channel_message_storage),
         "backup_channel": BACKUP_CHANNEL,
-        "database_channel_id": DATABASE_CHANNEL_ID
+        "database_channel_id": DATABASE_CHANNEL_ID,
+        **expiry_scheduler.stats(),
+        **outbound_scheduler.stats(),
+        **channel_joined_users.stats(),
+        **delivery_cache.stats(),
+        **update_processor.stats(),
+        **dedup_index.stats(),
+        **log_writer.stats(),
+        **access_analytics.stats(),
+        **admission.stats(),
+        **(session_store.stats()
+           if isinstance(session_store, WriteBehindSessionStore) else {})
     })
 
-def run_flask():
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+
+async def metrics(request):
+    return PlainTextResponse(REGISTRY.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
+def authorized(request):
+    """Whether the request carries the admin API token"""
+    return bool(ADMIN_API_TOKEN) and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {ADMIN_API_TOKEN}")
+
+
+async def export_codes(request):
+    """Stream the whole code index as JSONL"""
+    if not authorized(request):
+        return Response(status_code=403)
+    # Pages are read in a worker thread, one at a time
+    return StreamingResponse(export_chunks(channel_message_storage),
+                             media_type="application/x-ndjson")
+
+
+async def import_codes(request):
+    """Load a JSONL export (optionally gzip-encoded) streamed in the body"""
+    if not authorized(request):
+        return Response(status_code=403)
+
+    decompressor = None
+    if request.headers.get("Content-Encoding") == "gzip":
+        decompressor = zlib.decompressobj(wbits=31)
+    importer = Importer(channel_message_storage)
+    buffer = b""
+    lines = []
+    async for chunk in request.stream():
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        *complete, buffer = (buffer + chunk).split(b"\n")
+        lines.extend(complete)
+        if len(lines) >= PAGE_SIZE:
+            await asyncio.to_thread(importer.feed, lines)
+            lines = []
+    lines.append(buffer)
+    await asyncio.to_thread(importer.feed, lines)
+    stats = await asyncio.to_thread(importer.finish)
+
+    delivery_cache.clear()
+    await expiry_scheduler.reload()
+    return JSONResponse(stats)
+
+
+async def telegram_webhook(request):
+    """Queue an incoming update and acknowledge it right away"""
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return Response(status_code=403)
+
+    application = request.app.state.application
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except ValueError:
+        return Response(status_code=400)
+
+    # Handlers run on the application's update processor, not in here
+    await application.update_queue.put(update)
+    return Response(status_code=200)
+
+
+web_app = Starlette(routes=[
+    Route("/", home),
+    Route("/health", health),
+    Route("/stats", stats),
+    Route("/metrics", metrics),
+    Route("/export", export_codes),
+    Route("/import", import_codes, methods=["POST"]),
+])
+if BOT_MODE == "webhook":
+    # Only mounted when Telegram is told to post here with WEBHOOK_SECRET
+    web_app.add_route(WEBHOOK_PATH, telegram_webhook, methods=["POST"])
+
+
+def share_link(bot, kind, code):
+    """Deep link for a code; the bot's username is cached at startup"""
+    return f"https://t.me/{bot.username}?start={kind}_{code}"
+
 
 def generate_code(length=6):
     return ''.join(
         random.choices(string.ascii_lowercase + string.digits, k=length))
 
 
+def claim_code(expires_at, attempts=5):
+    """Reserve an unused code in the store before it is handed out
+
+    The insert fails if the code exists, so two replicas can never mint
+    the same code. The placeholder is overwritten once the post is saved.
+    """
+    for _ in range(attempts):
+        code = generate_code()
+        placeholder = {
+            "code": code,
+            "type": "pending",
+            "expires_at": expires_at.isoformat()
+        }
+        if channel_message_storage.add(code, {
+                'message_id': None,
+                'metadata': placeholder
+        }):
+            return code
+    raise RuntimeError("Could not find a free code")
+
+
 async def save_media_to_channel(context,
                                 file_id,
                                 media_type,
                                 minutes=2880,
-                                files_data=None):
-    """Save media to database channel and return access code"""
-    code = generate_code()
+                                files_data=None,
+                                priority=PRIORITY_HIGH):
+    """Save media to database channel and return access code
+
+    ``priority`` is the outbound lane for the channel posts: the admin
+    waits on single saves, bulk minting passes PRIORITY_BULK.
+    """
     expires_at = datetime.utcnow() + timedelta(minutes=minutes)
+    content = None
+    if DEDUP_UPLOADS:
+        content = dedup_index.content_key(
+            files_data or [(file_id, media_type)],
+            "batch" if files_data else "single")
+        if content:
+            code = reuse_upload(content, expires_at)
+            if code:
+                return code
+
+    if SIGNED_CODES and code_signer and not files_data:
+        code = await save_signed_media(context, file_id, media_type,
+                                       expires_at, priority)
+        if code and content:
+            dedup_index.add(content, code)
+        return code
+    try:
+        code = claim_code(expires_at)
+    except Exception as e:
+        events.error("code_reserve_failed", error=e)
+        return None
 
     # Create metadata
     if files_data:  # Batch upload
@@ -92,6 +505,8 @@ async def save_media_to_channel(context,
             "expires_at": expires_at.isoformat(),
             "created_at": datetime.utcnow().isoformat()
         }
+        if content:
+            metadata["content"] = content
         caption = f"🔗 Batch Media\nCode: {code}\nFiles: {len(files_data)}\nExpires: {expires_at.strftime('%Y-%m-%d %H:%M:%S')} UTC"
     else:  # Single file
         metadata = {
@@ -102,8 +517,16 @@ async def save_media_to_channel(context,
             "expires_at": expires_at.isoformat(),
             "created_at": datetime.utcnow().isoformat()
         }
+        if content:
+            metadata["content"] = content
         caption = f"🔗 Media Link\nCode: {code}\nType: {media_type}\nExpires: {expires_at.strftime('%Y-%m-%d %H:%M:%S')} UTC"
 
+    # Encode metadata compactly; whatever does not fit in the caption spills
+    # into follow-up posts replying to the media post
+    caption_room = CAPTION_LIMIT - len(caption) - len("\n\nMetadata: ")
+    metadata_parts = split_token(encode_metadata(metadata), caption_room,
+                                 TEXT_LIMIT - len(f"🔗 Code: {code}\nMetadata: "))
+
     try:
         # Send metadata to database channel
         if files_data:
@@ -113,158 +536,334 @@ async def save_media_to_channel(context,
                 message = await context.bot.send_photo(
                     chat_id=DATABASE_CHANNEL_ID,
                     photo=first_file_id,
-                    caption=caption + f"\n\nMetadata: {str(metadata)}")
+                    caption=caption + f"\n\nMetadata: {metadata_parts[0]}",
+                    rate_limit_args=priority)
             elif first_media_type == "video":
                 message = await context.bot.send_video(
                     chat_id=DATABASE_CHANNEL_ID,
                     video=first_file_id,
-                    caption=caption + f"\n\nMetadata: {str(metadata)}")
+                    caption=caption + f"\n\nMetadata: {metadata_parts[0]}",
+                    rate_limit_args=priority)
             else:
                 message = await context.bot.send_document(
                     chat_id=DATABASE_CHANNEL_ID,
                     document=first_file_id,
-                    caption=caption + f"\n\nMetadata: {str(metadata)}")
+                    caption=caption + f"\n\nMetadata: {metadata_parts[0]}",
+                    rate_limit_args=priority)
         else:
             # For single file
             if media_type == "photo":
                 message = await context.bot.send_photo(
                     chat_id=DATABASE_CHANNEL_ID,
                     photo=file_id,
-                    caption=caption + f"\n\nMetadata: {str(metadata)}")
+                    caption=caption + f"\n\nMetadata: {metadata_parts[0]}",
+                    rate_limit_args=priority)
             elif media_type == "video":
                 message = await context.bot.send_video(
                     chat_id=DATABASE_CHANNEL_ID,
                     video=file_id,
-                    caption=caption + f"\n\nMetadata: {str(metadata)}")
+                    caption=caption + f"\n\nMetadata: {metadata_parts[0]}",
+                    rate_limit_args=priority)
             else:
                 message = await context.bot.send_document(
                     chat_id=DATABASE_CHANNEL_ID,
                     document=file_id,
-                    caption=caption + f"\n\nMetadata: {str(metadata)}")
+                    caption=caption + f"\n\nMetadata: {metadata_parts[0]}",
+                    rate_limit_args=priority)
+
+        for part in metadata_parts[1:]:
+            await context.bot.send_message(
+                chat_id=DATABASE_CHANNEL_ID,
+                text=f"🔗 Code: {code}\nMetadata: {part}",
+                reply_to_message_id=message.message_id,
+                rate_limit_args=priority)
 
         # Store message ID for retrieval
         channel_message_storage[code] = {
             'message_id': message.message_id,
             'metadata': metadata
         }
+        expiry_scheduler.schedule(code, expires_at, message.message_id)
+        if content:
+            dedup_index.add(content, code)
+
+        events.info("code_saved",
+                    code=code,
+                    type=metadata["type"],
+                    files=len(files_data) if files_data else 1)
+        return code
+    except Exception as e:
+        events.error("code_save_failed", error=e)
+        # Release the reserved code
+        channel_message_storage.pop(code, None)
+        return None
+
+
+def same_expiry(a, b):
+    """Whether two expiry datetimes match to the second"""
+    return abs((a - b).total_seconds()) < 1
 
-        logger.info(f"Saved media to database channel with code: {code}")
+
+def reuse_upload(content, expires_at):
+    """Serve re-shared content from an earlier code or post (None if not)"""
+    code = dedup_index.lookup(content)
+    if code is None:
+        return None
+
+    if is_signed_code(code):
+        # Signed codes' posts are never cleaned up, so any of them will do
+        metadata = code_signer.verify(code, now=0) if code_signer else None
+        if metadata is None:
+            dedup_index.discard(content, code)
+            return None
+        live_until = datetime.fromisoformat(metadata["expires_at"])
+        if same_expiry(live_until, expires_at):
+            dedup_index.codes_reused += 1
+            return code
+        code = code_signer.sign(metadata["message_id"],
+                                metadata["media_type"], expires_at)
+        if live_until < expires_at:
+            dedup_index.add(content, code)
+        dedup_index.posts_reused += 1
+        events.info("dedup_reuse", code=code, action="resigned")
         return code
+
+    entry = channel_message_storage.get(code)
+    metadata = entry['metadata'] if entry else None
+    if not metadata or metadata.get("content") != content:
+        dedup_index.discard(content, code)
+        return None
+
+    # The code handed back must expire when the admin asked, so a live
+    # code is reused as is only if its expiry matches
+    live_until = datetime.fromisoformat(metadata["expires_at"])
+    if same_expiry(live_until, expires_at):
+        dedup_index.codes_reused += 1
+        events.info("dedup_reuse", code=code, action="reused")
+        return code
+
+    message_id = entry['message_id']
+    outlives = live_until > expires_at
+    if not outlives and live_until > datetime.utcnow() and DEDUP_EXTEND_EXPIRY:
+        channel_message_storage[code] = {
+            'message_id': message_id,
+            'metadata': dict(metadata, expires_at=expires_at.isoformat())
+        }
+        expiry_scheduler.schedule(code, expires_at, message_id)
+        delivery_cache.invalidate(code)
+        dedup_index.expiries_extended += 1
+        events.info("dedup_reuse",
+                    code=code,
+                    action="extended",
+                    expires_at=expires_at.isoformat())
+        return code
+
+    if EXPIRED_POST_ACTION != "keep":
+        # Each code's post goes away with it, so two codes must not share
+        # one: whichever expires first would take the other's post along
+        return None
+    try:
+        new_code = claim_code(expires_at)
+    except Exception as e:
+        events.error("code_reserve_failed", error=e)
+        return None
+    channel_message_storage[new_code] = {
+        'message_id': message_id,
+        'metadata': dict(metadata, code=new_code,
+                         expires_at=expires_at.isoformat(),
+                         created_at=datetime.utcnow().isoformat())
+    }
+    expiry_scheduler.schedule(new_code, expires_at, message_id)
+    if not outlives:
+        # Otherwise the longer-lived code stays the one to reuse
+        dedup_index.add(content, new_code)
+    dedup_index.posts_reused += 1
+    events.info("dedup_reuse", code=new_code, action="reposted", of=code)
+    return new_code
+
+
+async def save_signed_media(context, file_id, media_type, expires_at,
+                            priority=PRIORITY_HIGH):
+    """Post a single file and return a signed code pointing at the post"""
+    caption = f"🔗 Media Link\nType: {media_type}\nExpires: {expires_at.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+    try:
+        if media_type == "photo":
+            message = await context.bot.send_photo(
+                chat_id=DATABASE_CHANNEL_ID, photo=file_id, caption=caption,
+                rate_limit_args=priority)
+        elif media_type == "video":
+            message = await context.bot.send_video(
+                chat_id=DATABASE_CHANNEL_ID, video=file_id, caption=caption,
+                rate_limit_args=priority)
+        else:
+            message = await context.bot.send_document(
+                chat_id=DATABASE_CHANNEL_ID, document=file_id, caption=caption,
+                rate_limit_args=priority)
     except Exception as e:
-        logger.error(f"Failed to save media to database channel: {e}")
+        events.error("code_save_failed", error=e)
         return None
 
+    code = code_signer.sign(message.message_id, media_type, expires_at)
+    events.info("code_saved", code=code, type="signed", files=1)
+    return code
+
 
 async def get_media_from_channel(context, code):
     """Retrieve media metadata from database channel by code"""
+    if code_signer and is_signed_code(code):
+        # Signed codes resolve without touching the store
+        metadata = code_signer.verify(code)
+        CODE_LOOKUPS.labels("signed" if metadata else "invalid").inc()
+        return metadata
+
     try:
         # Check if we have the code in our storage
         if code in channel_message_storage:
             stored_data = channel_message_storage[code]
             metadata = stored_data['metadata']
+            if metadata["type"] == "pending":
+                # Reserved by claim_code but not saved yet
+                CODE_LOOKUPS.labels("miss").inc()
+                return None
 
             # Check if not expired
             expires_at = datetime.fromisoformat(metadata["expires_at"])
+            if expires_at <= datetime.utcnow():
+                # Another replica may have extended it since it was cached
+                stored_data = channel_message_storage.refresh(code)
+                metadata = stored_data['metadata'] if stored_data else None
+                if metadata is not None:
+                    expires_at = datetime.fromisoformat(metadata["expires_at"])
+            if metadata is None:
+                CODE_LOOKUPS.labels("miss").inc()
+                events.info("code_miss", code=code)
+                return None
             if expires_at > datetime.utcnow():
-                logger.info(f"Retrieved media metadata for code: {code}")
+                CODE_LOOKUPS.labels("hit").inc()
+                events.info("code_hit", code=code)
                 return metadata
             else:
                 # Remove expired entry
-                del channel_message_storage[code]
-                logger.info(
-                    f"Media with code {code} has expired and was removed")
+                CODE_LOOKUPS.labels("expired").inc()
+                channel_message_storage.pop(code, None)
+                delivery_cache.invalidate(code)
+                events.info("code_expired", code=code)
                 return None
         else:
-            logger.info(f"Media with code {code} not found in storage")
+            CODE_LOOKUPS.labels("miss").inc()
+            events.info("code_miss", code=code)
             return None
 
     except Exception as e:
-        logger.error(f"Failed to retrieve media from storage: {e}")
+        events.error("code_lookup_failed", code=code, error=e)
+        return None
+
+
+async def load_delivery(context, code):
+    """Resolve a code and prepare its delivery (None if invalid or expired)"""
+    metadata = await get_media_from_channel(context, code)
+    if metadata is None:
         return None
+    return PreparedDelivery(metadata, DATABASE_CHANNEL_ID)
 
 
 async def check_channel_membership(context, user_id):
-    """Check if user is a member of the backup channel"""
+    """Check if user is a member of the backup channel (None if unknown)"""
     try:
         member = await context.bot.get_chat_member(f"@{BACKUP_CHANNEL}",
                                                    user_id)
         # Check if user is a member (not left or kicked)
         return member.status in ['member', 'administrator', 'creator']
     except Exception as e:
-        logger.warning(f"Could not check membership for user {user_id}: {e}")
-        return False
+        events.warning("membership_check_failed", user_id=user_id, error=e)
+        return None
+
+
+async def track_backup_channel(update: Update,
+                               context: ContextTypes.DEFAULT_TYPE):
+    """Forget users who leave the backup channel so their next link re-checks
 
+    Telegram only sends these updates while the bot is an admin there.
+    """
+    change = update.chat_member
+    if (change.chat.username or "").lower() != BACKUP_CHANNEL.lower():
+        return
+    if change.new_chat_member.status in ("left", "kicked"):
+        channel_joined_users.forget(change.new_chat_member.user.id)
+        events.info("backup_channel_left",
+                    user_id=change.new_chat_member.user.id)
+
+
+async def throttled(update, user_id, kind):
+    """Charge a request to the user's budget; True if it was rejected"""
+    retry_after, notify = admission.admit(user_id, kind)
+    if retry_after and notify:
+        await update.message.reply_text(THROTTLED_TEXT)
+    return bool(retry_after)
 
+
+@instrument("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     args = context.args
 
-    if args:
-        code = args[0].replace("media_", "").replace("batch_", "")
+    # Users over the general budget are turned away before any lookup
+    if user_id != ADMIN_USER_ID and await throttled(update, user_id,
+                                                    "single"):
+        return
 
-        # Get media metadata from database channel
-        metadata = await get_media_from_channel(context, code)
+    prepared = None
+    if args:
+        code = args[0]
+        for prefix in ("media_", "batch_"):
+            if code.startswith(prefix):
+                code = code[len(prefix):]
+                break
+
+        # Get the prepared delivery (cached for popular codes)
+        prepared = await delivery_cache.get(code,
+                                            partial(load_delivery, context))
+
+        # Charge by what the code really is, not the link's prefix
+        if user_id != ADMIN_USER_ID and (prepared is None or
+                                         prepared.kind == "batch"):
+            if await throttled(update, user_id, "batch"):
+                return
 
-        if metadata:
+    if args:
+        if prepared:
             # Admins bypass channel membership check
             if user_id != ADMIN_USER_ID:
-                # Skip backup channel check for users who previously joined
-                if user_id not in channel_joined_users:
-                    # Check if user has joined the backup channel
-                    is_member = await check_channel_membership(
-                        context, user_id)
-
-                    if not is_member:
-                        # Create join backup channel button for non-members
-                        keyboard = [[
-                            InlineKeyboardButton(
-                                "📢 Join Backup Channel",
-                                url=f"https://t.me/{BACKUP_CHANNEL}")
-                        ]]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-
-                        await update.message.reply_text(
-                            "🔒 **Access Restricted**\n\n"
-                            "To access shared media, you must first join our backup channel.\n\n"
-                            "After joining, try the link again:",
-                            reply_markup=reply_markup,
-                            parse_mode='Markdown')
-                        return
-                    else:
-                        # User is a member, add them to joined users list
-                        channel_joined_users.add(user_id)
-
-            # Send media based on type
-            if metadata["type"] == "single":
-                file_id = metadata["file_id"]
-                media_type = metadata["media_type"]
-
-                if media_type == "photo":
-                    await context.bot.send_photo(
-                        chat_id=update.effective_chat.id, photo=file_id)
-                elif media_type == "video":
-                    await context.bot.send_video(
-                        chat_id=update.effective_chat.id, video=file_id)
-                elif media_type == "document":
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id, document=file_id)
-
-            elif metadata["type"] == "batch":
-                files_data = metadata["files"]
-                await update.message.reply_text(
-                    f"📦 **Batch Media ({len(files_data)} files)**")
-
-                # Send all files in the batch
-                for file_id, media_type in files_data:
-                    if media_type == "photo":
-                        await context.bot.send_photo(
-                            chat_id=update.effective_chat.id, photo=file_id)
-                    elif media_type == "video":
-                        await context.bot.send_video(
-                            chat_id=update.effective_chat.id, video=file_id)
-                    elif media_type == "document":
-                        await context.bot.send_document(
-                            chat_id=update.effective_chat.id, document=file_id)
+                # Check if user has joined the backup channel (cached)
+                is_member = await channel_joined_users.is_member(
+                    user_id, partial(check_channel_membership, context))
+
+                if not is_member:
+                    # Create join backup channel button for non-members
+                    keyboard = [[
+                        InlineKeyboardButton(
+                            "📢 Join Backup Channel",
+                            url=f"https://t.me/{BACKUP_CHANNEL}")
+                    ]]
+                    reply_markup = InlineKeyboardMarkup(keyboard)
+
+                    await update.message.reply_text(
+                        "🔒 **Access Restricted**\n\n"
+                        "To access shared media, you must first join our backup channel.\n\n"
+                        "After joining, try the link again:",
+                        reply_markup=reply_markup,
+                        parse_mode='Markdown')
+                    return
+
+            access_analytics.record(code, user_id)
+
+            if prepared.kind == "batch":
+                await deliver_batch_page(context, update.effective_chat.id,
+                                         user_id, code, prepared)
+                return
+
+            await deliver_prepared(context.bot, update.effective_chat.id,
+                                   prepared)
         else:
             await update.message.reply_text("❌ Invalid or expired code.")
     else:
@@ -290,6 +889,77 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup=reply_markup)
 
 
+async def deliver_batch_page(context, chat_id, user_id, code, prepared):
+    """Send the next page of a batch, resuming from the user's progress"""
+    position = session_store.get_progress(user_id, code) or 0
+    if position >= prepared.file_count:
+        # Delivered in full before; a new /start sends it again
+        position = 0
+
+    if position == 0:
+        await context.bot.send_message(chat_id, prepared.header)
+    else:
+        await context.bot.send_message(
+            chat_id, f"⏩ Continuing from file {position + 1} "
+            f"of {prepared.file_count}")
+
+    def checkpoint(done):
+        session_store.set_progress(user_id, code, done, prepared.expires_at)
+
+    # Batches go out as albums of up to 10 files
+    position, error = await deliver_range(context.bot, chat_id,
+                                          prepared.albums, position,
+                                          DELIVERY_PAGE_SIZE, checkpoint)
+    if position >= prepared.file_count:
+        session_store.clear_progress(user_id, code)
+        return
+
+    if error is not None:
+        # Saved even at 0, so Resume works when the first file failed
+        checkpoint(position)
+        text = (f"⚠️ Delivery stopped after {position} of "
+                f"{prepared.file_count} files.")
+        button = "🔁 Resume"
+    else:
+        text = f"📦 Sent {position} of {prepared.file_count} files."
+        button = "▶️ Next page"
+    await context.bot.send_message(
+        chat_id, text,
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton(button, callback_data=f"page:{code}")]]))
+
+
+@instrument("deliver_next_page")
+async def deliver_next_page(update: Update,
+                            context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    code = query.data[len("page:"):]
+
+    if user_id != ADMIN_USER_ID and admission.admit(user_id, "batch")[0]:
+        await query.answer(THROTTLED_TEXT, show_alert=True)
+        return
+
+    prepared = await delivery_cache.get(code, partial(load_delivery, context))
+    if not prepared or session_store.get_progress(user_id, code) is None:
+        await query.answer("❌ This link has expired or was already sent.",
+                           show_alert=True)
+        return
+
+    if user_id != ADMIN_USER_ID and not await channel_joined_users.is_member(
+            user_id, partial(check_channel_membership, context)):
+        await query.answer("🔒 Join the backup channel first.",
+                           show_alert=True)
+        return
+
+    await query.answer()
+    # The button has done its job; a new one follows the next page
+    await query.edit_message_reply_markup(None)
+    await deliver_batch_page(context, query.message.chat_id, user_id, code,
+                             prepared)
+
+
+@instrument("admin_panel")
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
@@ -305,7 +975,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if not args:
         # Show admin panel menu
-        current_timer = context.user_data.get('custom_timer', 2880)
+        current_timer = session_store.get_timer(user_id, 2880)
         hours = current_timer // 60
         remaining_mins = current_timer % 60
         time_str = f"{hours}h {remaining_mins}m" if hours > 0 and remaining_mins > 0 else f"{hours}h" if hours > 0 else f"{current_timer}m"
@@ -321,7 +991,10 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"⚙️ **Available Commands:**\n"
             f"• `/admin timer <minutes>` - Set custom timer\n"
             f"• `/admin stats` - View statistics\n"
-            f"• `/admin reset` - Reset timer to default (2 days)",
+            f"• `/admin top` - Most opened links\n"
+            f"• `/admin reset` - Reset timer to default (2 days)\n"
+            f"• `/admin export` - Download all codes as JSONL\n"
+            f"• `/admin import` - Reply to an export file to load it",
             parse_mode='Markdown')
         return
 
@@ -349,7 +1022,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "❌ Maximum timer is 10080 minutes (1 week).")
                 return
 
-            context.user_data['custom_timer'] = minutes
+            session_store.set_timer(user_id, minutes)
 
             hours = minutes // 60
             remaining_mins = minutes % 60
@@ -365,22 +1038,91 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif command == "stats":
         # Statistics
         channel_members = len(channel_joined_users)
-        current_timer = context.user_data.get('custom_timer', 2880)
+        current_timer = session_store.get_timer(user_id, 2880)
 
         await update.message.reply_text(
             f"📊 **Statistics**\n\n"
             f"• Channel members: {channel_members}\n"
             f"• Current timer: {current_timer} minutes\n"
+            f"• Live codes: {len(channel_message_storage)}\n"
+            f"• Pending expiries: {expiry_scheduler.pending}\n"
+            f"• Expired codes evicted: {expiry_scheduler.evicted}\n"
+            f"• Links opened: {access_analytics.accesses}\n"
+            f"• Unique visitors: ~{len(access_analytics.users)}\n"
             f"• Backup channel: @{BACKUP_CHANNEL}\n"
             f"• Database channel: {DATABASE_CHANNEL_ID}",
             parse_mode='Markdown')
 
+    elif command == "top":
+        try:
+            limit = min(max(int(args[1]), 1), 50) if len(args) > 1 else 10
+        except ValueError:
+            await update.message.reply_text("❌ Please provide a valid number.")
+            return
+
+        top = access_analytics.top(limit)
+        if not top:
+            await update.message.reply_text("📈 No links opened yet.")
+            return
+        lines = [
+            f"{rank}. `{code}` - {hits} opens, ~{users} users"
+            for rank, (code, hits, users) in enumerate(top, 1)
+        ]
+        await update.message.reply_text(
+            f"📈 **Top {len(top)} Links**\n\n" + "\n".join(lines) +
+            f"\n\nTotal: {access_analytics.accesses} opens by "
+            f"~{len(access_analytics.users)} users",
+            parse_mode='Markdown')
+
     elif command == "reset":
-        context.user_data['custom_timer'] = 2880
+        session_store.set_timer(user_id, 2880)
         await update.message.reply_text(
             "🔄 **Timer Reset**\n\n"
             "Timer has been reset to default (2 days).")
 
+    elif command == "export":
+        await update.message.reply_text("⏳ Exporting codes...")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = f"codes-{datetime.utcnow():%Y%m%d-%H%M%S}.jsonl.gz"
+            path = os.path.join(directory, filename)
+            count = await asyncio.to_thread(export_to_file,
+                                            channel_message_storage, path)
+            with open(path, "rb") as fp:
+                await update.message.reply_document(
+                    document=fp,
+                    filename=filename,
+                    caption=f"📦 {count} codes exported")
+
+    elif command == "import":
+        reply = update.message.reply_to_message
+        if not reply or not reply.document:
+            await update.message.reply_text(
+                "📥 **Import Codes**\n\n"
+                "Reply to an export file (`.jsonl` or `.jsonl.gz`) with "
+                "`/admin import`.",
+                parse_mode='Markdown')
+            return
+
+        await update.message.reply_text("⏳ Importing codes...")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "import")
+            # Bots can download files up to 20 MB; use /import beyond that
+            telegram_file = await context.bot.get_file(reply.document.file_id)
+            await telegram_file.download_to_drive(path)
+            stats = await asyncio.to_thread(import_from_file,
+                                            channel_message_storage, path)
+        delivery_cache.clear()
+        await expiry_scheduler.reload()
+
+        await update.message.reply_text(
+            f"✅ **Import Finished**\n\n"
+            f"• Imported: {stats['imported']}\n"
+            f"• Already present: {stats['existing']}\n"
+            f"• Expired (skipped): {stats['expired']}\n"
+            f"• Invalid (skipped): {stats['invalid']}\n"
+            f"• Time: {stats['seconds']}s",
+            parse_mode='Markdown')
+
     else:
         await update.message.reply_text(
             "❌ **Unknown Command**\n\n"
@@ -388,6 +1130,33 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown')
 
 
+# Options shown after files are added to the batch
+BATCH_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📤 Generate Link Now",
+                          callback_data="generate_single")],
+    [InlineKeyboardButton("📦 Add More Files", callback_data="add_more")],
+    [InlineKeyboardButton("🔗 Generate Batch Link",
+                          callback_data="generate_batch")],
+    [InlineKeyboardButton("🔢 Separate Link per File",
+                          callback_data="generate_each")],
+])
+
+
+async def add_album_to_batch(context, chat_id, user_id, items):
+    """Add a collected album to the batch and answer with one summary"""
+    files = [(file_id, media_type) for _, file_id, media_type in items]
+    file_count = session_store.append_files(user_id, files)
+
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"📁 **Album Added** ({len(files)} files, {file_count} total)\n\n"
+        f"Choose what to do:",
+        reply_markup=BATCH_KEYBOARD,
+        parse_mode='Markdown',
+        reply_to_message_id=items[0][0])
+
+
+@instrument("handle_media")
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if effective_user exists (prevent channel message processing)
     if not update.effective_user:
@@ -417,43 +1186,38 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         media_type = "photo"
 
     if file:
-        # Get custom timer or use default
-        custom_timer = context.user_data.get('custom_timer', 2880)
-
         file_id = file.file_id
+        dedup_index.remember(file_id, file.file_unique_id)
+
+        # Albums are added when their collection window closes, outside
+        # this user's update lock; add any sent before this file first
+        group_id = update.message.media_group_id
+        await media_groups.flush(
+            lambda key: key[0] == user_id and key[1] != group_id)
+
+        if group_id:
+            # Collect the whole album and add it in one step
+            media_groups.add(
+                (user_id, group_id),
+                (update.message.message_id, file_id, media_type),
+                partial(add_album_to_batch, context,
+                        update.effective_chat.id, user_id))
+            return
 
-        # Check if user is in batch mode
-        if 'batch_files' not in context.user_data:
-            context.user_data['batch_files'] = []
-
-        # Add file to batch
-        context.user_data['batch_files'].append((file_id, media_type))
-
-        # Send options for batch or single upload
-        keyboard = [[
-            InlineKeyboardButton("📤 Generate Link Now",
-                                 callback_data="generate_single")
-        ], [
-            InlineKeyboardButton("📦 Add More Files", callback_data="add_more")
-        ],
-                    [
-                        InlineKeyboardButton("🔗 Generate Batch Link",
-                                             callback_data="generate_batch")
-                    ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        file_count = len(context.user_data['batch_files'])
+        # Add file to batch (shared between replicas)
+        file_count = session_store.append_file(user_id, file_id, media_type)
 
         await update.message.reply_text(
             f"📁 **File Added** ({file_count} total)\n\n"
             f"Choose what to do:",
-            reply_markup=reply_markup,
+            reply_markup=BATCH_KEYBOARD,
             parse_mode='Markdown')
     else:
         await update.message.reply_text(
             "❌ Unsupported media. Send document, video, or photo.")
 
 
+@instrument("handle_channel_media")
 async def handle_channel_media(update: Update,
                                context: ContextTypes.DEFAULT_TYPE):
     """Handle media uploaded directly to the database channel"""
@@ -484,30 +1248,49 @@ async def handle_channel_media(update: Update,
 
     if file:
         file_id = file.file_id
+        dedup_index.remember(file_id, file.file_unique_id)
+        content = f"s:{file.file_unique_id}"
+
+        if update.message.media_group_id:
+            # An album gets one batch link instead of one link per file
+            media_groups.add(
+                (DATABASE_CHANNEL_ID, update.message.media_group_id),
+                (update.message.message_id, file_id, media_type),
+                partial(link_channel_album, context))
+            return
 
         # Generate code and save metadata
-        code = generate_code()
         expires_at = datetime.utcnow() + timedelta(
             minutes=2880)  # Default 2 days
-
-        metadata = {
-            "code": code,
-            "type": "single",
-            "file_id": file_id,
-            "media_type": media_type,
-            "expires_at": expires_at.isoformat(),
-            "created_at": datetime.utcnow().isoformat()
-        }
-
-        # Store the metadata using the existing message
-        channel_message_storage[code] = {
-            'message_id': update.message.message_id,
-            'metadata': metadata
-        }
+        if SIGNED_CODES and code_signer:
+            # The upload itself is the post the code points at
+            code = code_signer.sign(update.message.message_id, media_type,
+                                    expires_at)
+            dedup_index.add(content, code)
+        else:
+            code = claim_code(expires_at)
+
+            metadata = {
+                "code": code,
+                "type": "single",
+                "file_id": file_id,
+                "media_type": media_type,
+                "expires_at": expires_at.isoformat(),
+                "created_at": datetime.utcnow().isoformat(),
+                "content": content
+            }
+
+            # Store the metadata using the existing message
+            channel_message_storage[code] = {
+                'message_id': update.message.message_id,
+                'metadata': metadata
+            }
+            expiry_scheduler.schedule(code, expires_at,
+                                      update.message.message_id)
+            dedup_index.add(content, code)
 
         # Get bot username for link generation
-        bot_username = (await context.bot.get_me()).username
-        link = f"https://t.me/{bot_username}?start=media_{code}"
+        link = share_link(context.bot, "media", code)
 
         # Reply to the uploaded file with the link
         try:
@@ -521,13 +1304,84 @@ async def handle_channel_media(update: Update,
                 parse_mode='Markdown',
                 reply_to_message_id=update.message.message_id)
 
-            logger.info(
-                f"Auto-generated link for channel upload with code: {code}")
+            events.info("channel_link", code=code, type=media_type)
 
         except Exception as e:
-            logger.error(f"Failed to send link reply in database channel: {e}")
+            events.error("channel_link_reply_failed", code=code, error=e)
+
+
+async def link_channel_album(context, items):
+    """Create one batch code for an album posted into the database channel"""
+    first_message_id = items[0][0]
+    files = [(file_id, media_type) for _, file_id, media_type in items]
+
+    expires_at = datetime.utcnow() + timedelta(
+        minutes=2880)  # Default 2 days
+    code = claim_code(expires_at)
+    content = dedup_index.content_key(files, "batch")
+
+    metadata = {
+        "code": code,
+        "type": "batch",
+        "files": files,
+        "expires_at": expires_at.isoformat(),
+        "created_at": datetime.utcnow().isoformat()
+    }
+    if content:
+        metadata["content"] = content
+        dedup_index.add(content, code)
+
+    # Store the metadata using the album's first post
+    channel_message_storage[code] = {
+        'message_id': first_message_id,
+        'metadata': metadata
+    }
+    expiry_scheduler.schedule(code, expires_at, first_message_id)
+
+    link = share_link(context.bot, "batch", code)
+
+    try:
+        await context.bot.send_message(
+            chat_id=DATABASE_CHANNEL_ID,
+            text=f"🔗 **Auto-Generated Batch Link**\n\n"
+            f"Code: `{code}`\n"
+            f"Files: {len(files)}\n"
+            f"Expires: {expires_at.strftime('%Y-%m-%d %H:%M:%S')} UTC\n\n"
+            f"Link: {link}",
+            parse_mode='Markdown',
+            reply_to_message_id=first_message_id)
+
+        events.info("channel_link", code=code, type="batch", files=len(files))
+
+    except Exception as e:
+        events.error("channel_link_reply_failed", code=code, error=e)
+
+
+async def mint_links(context, files, minutes):
+    """Save every file as its own link, MINT_CONCURRENCY saves at a time
+
+    Returns a code (or None/an exception on failure) per file, in order.
+    """
+    return await map_bounded(
+        lambda item: save_media_to_channel(context, item[0], item[1], minutes,
+                                           priority=PRIORITY_BULK), files,
+        MINT_CONCURRENCY)
+
 
+def split_lines(lines, limit):
+    """Join lines into as few messages under limit characters as possible"""
+    chunks = []
+    current = ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    chunks.append(current)
+    return chunks
 
+
+@instrument("handle_callback")
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -539,15 +1393,21 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("🔒 Access Denied")
         return
 
-    custom_timer = context.user_data.get('custom_timer', 2880)
-    batch_files = context.user_data.get('batch_files', [])
+    # Albums the admin sent before pressing the button belong to the batch
+    await media_groups.flush(lambda key: key[0] == user_id)
+
+    custom_timer = session_store.get_timer(user_id, 2880)
+    if query.data in ("generate_single", "generate_batch", "generate_each"):
+        # Take and clear the batch in one step so it is minted only once,
+        # even if another replica sees the same button press
+        batch_files = session_store.take_files(user_id)
+    else:
+        batch_files = session_store.get_files(user_id)
 
     if not batch_files:
         await query.edit_message_text("❌ No files to process.")
         return
 
-    bot_username = (await context.bot.get_me()).username
-
     # Format time display
     hours = custom_timer // 60
     remaining_mins = custom_timer % 60
@@ -560,7 +1420,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                            custom_timer)
 
         if code:
-            link = f"https://t.me/{bot_username}?start=media_{code}"
+            link = share_link(context.bot, "media", code)
             await query.edit_message_text(
                 f"✅ **Single File Link Generated**\n\n"
                 f"🔗 Link (valid {time_str}):\n{link}")
@@ -568,16 +1428,13 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text(
                 "❌ Failed to generate link. Please try again.")
 
-        # Clear batch
-        context.user_data['batch_files'] = []
-
     elif query.data == "generate_batch":
         # Generate batch link for all files
         code = await save_media_to_channel(context, None, None, custom_timer,
                                            batch_files)
 
         if code:
-            link = f"https://t.me/{bot_username}?start=batch_{code}"
+            link = share_link(context.bot, "batch", code)
             await query.edit_message_text(
                 f"✅ **Batch Link Generated** ({len(batch_files)} files)\n\n"
                 f"🔗 Link (valid {time_str}):\n{link}")
@@ -585,8 +1442,32 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text(
                 "❌ Failed to generate batch link. Please try again.")
 
-        # Clear batch
-        context.user_data['batch_files'] = []
+    elif query.data == "generate_each":
+        # One link per file, minted through a bounded pipeline
+        await query.edit_message_text(
+            f"⏳ Generating {len(batch_files)} links...")
+        codes = await mint_links(context, batch_files, custom_timer)
+
+        lines = []
+        failed = 0
+        for number, ((_, media_type), code) in enumerate(
+                zip(batch_files, codes), 1):
+            if isinstance(code, str):
+                link = share_link(context.bot, "media", code)
+                lines.append(f"{number}. {media_type}: {link}")
+            else:
+                failed += 1
+                lines.append(f"{number}. {media_type}: ❌ failed")
+
+        header = (f"✅ **{len(batch_files) - failed} Links Generated**"
+                  f" (valid {time_str})")
+        if failed:
+            header += f", {failed} failed"
+        chunks = split_lines([header, ""] + lines, TEXT_LIMIT)
+        await query.edit_message_text(chunks[0])
+        for chunk in chunks[1:]:
+            await context.bot.send_message(chat_id=query.message.chat_id,
+                                           text=chunk)
 
     elif query.data == "add_more":
         await query.edit_message_text(
@@ -594,22 +1475,71 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Send more files to add them to the batch.")
 
 
-def main():
-    if not TOKEN:
-        print("❌ Please set BOT_TOKEN in Replit Secrets")
-        return
-
-    # Start Flask server in a separate thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info("🌐 Flask server started on http://0.0.0.0:5000")
-
-    # Create bot application
-    application = ApplicationBuilder().token(TOKEN).build()
+async def recover_code_index():
+    """Rebuild the code index off the event loop, then reschedule expiries"""
+    logger.info(f"♻️ Rebuilding code index from {RECOVER_FROM}")
+    try:
+        await asyncio.to_thread(recover_from_file, channel_message_storage,
+                                RECOVER_FROM)
+    except Exception as e:
+        logger.error(f"Failed to rebuild code index: {e}")
+    expiry_scheduler.rebuild()
+
+
+async def post_init(application):
+    """Start background services once the event loop is running"""
+    expiry_scheduler.rebuild()
+    expiry_scheduler.start(application.bot)
+    if DEDUP_UPLOADS:
+        await asyncio.to_thread(dedup_index.load, channel_message_storage)
+    access_analytics.start()
+    channel_joined_users.start()
+    if isinstance(session_store, WriteBehindSessionStore):
+        session_store.start()
+
+    # Rebuild the code index in the background so the bot serves right away
+    if RECOVER_FROM:
+        application.create_task(recover_code_index())
+
+
+async def post_shutdown(application):
+    """Stop background services and close the code store"""
+    await expiry_scheduler.stop()
+    await access_analytics.stop()
+    await channel_joined_users.stop()
+    if isinstance(session_store, WriteBehindSessionStore):
+        # Write the last session changes before the store closes
+        await session_store.stop()
+    channel_message_storage.close()
+    session_store.close()
+    if update_processor.recorder is not None:
+        update_processor.recorder.close()
+        logger.info(f"Recorded {update_processor.recorder.recorded} updates "
+                    f"to {RECORD_UPDATES}")
+
+
+def build_application():
+    """Create the bot application with all handlers registered"""
+    builder = (ApplicationBuilder().token(TOKEN)
+               .base_url(f"{BOT_API_BASE_URL}/bot")
+               .base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+               .rate_limiter(outbound_scheduler)
+               .concurrent_updates(update_processor)
+               .post_init(post_init)
+               .post_shutdown(post_shutdown))
+    if BOT_MODE == "webhook":
+        # Updates arrive through telegram_webhook instead of getUpdates
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(
+        ChatMemberHandler(track_backup_channel,
+                          ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(
+        CallbackQueryHandler(deliver_next_page, pattern="^page:"))
     application.add_handler(CallbackQueryHandler(handle_callback))
     application.add_handler(
         MessageHandler(
@@ -621,11 +1551,81 @@ def main():
             ~filters.ChatType.CHANNEL &
             (filters.Document.ALL | filters.VIDEO | filters.PHOTO),
             handle_media))
+    return application
+
+
+async def run_bot(application):
+    """Run the bot and the web server together on one event loop"""
+    web_app.state.application = application
+    server = uvicorn.Server(
+        uvicorn.Config(web_app, host="0.0.0.0", port=PORT,
+                       log_level="warning"))
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    if BOT_MODE == "webhook":
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES)
+        logger.info(f"🪝 Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        await application.bot.delete_webhook()
+        await application.updater.start_polling(
+            allowed_updates=Update.ALL_TYPES)
 
+    logger.info(f"🌐 Web server started on http://0.0.0.0:{PORT}")
     logger.info("🤖 Bot started...")
 
+    # Serves until SIGINT/SIGTERM, then shuts everything down in order
+    try:
+        await server.serve()
+    finally:
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        # Albums still inside their debounce window are handled before the
+        # bot shuts down
+        await media_groups.flush()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def main():
+    if not TOKEN:
+        print("❌ Please set BOT_TOKEN in Replit Secrets")
+        return
+
+    if BOT_MODE not in ("polling", "webhook"):
+        print(f"❌ Unknown BOT_MODE: {BOT_MODE} (use polling or webhook)")
+        return
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        print("❌ Please set WEBHOOK_URL to use webhook mode")
+        return
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        print("❌ Please set WEBHOOK_SECRET to use webhook mode")
+        return
+    if REPLICA_COUNT > 1 and BOT_MODE != "webhook":
+        # Only one getUpdates poller per bot; the others get 409 Conflict
+        print("❌ REPLICA_COUNT > 1 needs BOT_MODE=webhook behind a load "
+              "balancer")
+        return
+    if not 0 <= REPLICA_INDEX < REPLICA_COUNT:
+        print(f"❌ REPLICA_INDEX must be between 0 and {REPLICA_COUNT - 1}")
+        return
+    if SIGNED_CODES and not CODE_SIGNING_KEY:
+        print("❌ Please set CODE_SIGNING_KEY to use SIGNED_CODES")
+        return
+
+    # Create bot application
+    application = build_application()
+
     # Run the bot
-    application.run_polling()
+    asyncio.run(run_bot(application))
 
 
 if __name__ == "__main__":
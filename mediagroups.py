@@ -0,0 +1,78 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Telegram albums hold at most 10 items
+MAX_GROUP_SIZE = 10
+
+
+class MediaGroupCollector:
+    """Gathers the updates of one album before handling them together
+
+    Telegram delivers an album as one update per file sharing a
+    ``media_group_id``. Items added under the same key are held until no
+    new one arrived for ``delay`` seconds (or the album is full), then
+    ``callback(items)`` runs once with all of them, sorted.
+    """
+
+    def __init__(self, delay=1.0, max_items=MAX_GROUP_SIZE):
+        self.delay = delay
+        self.max_items = max_items
+
+        # key -> [items, timer handle, callback]
+        self._groups = {}
+        # running callback -> its key
+        self._tasks = {}
+
+        self.groups_handled = 0
+        self.items_collected = 0
+
+    @property
+    def pending(self):
+        return len(self._groups)
+
+    def add(self, key, item, callback):
+        """Add an album item; callback is taken from the first item"""
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = [[], None, callback]
+        else:
+            group[1].cancel()
+        group[0].append(item)
+        self.items_collected += 1
+
+        if len(group[0]) >= self.max_items:
+            self._fire(key)
+        else:
+            group[1] = asyncio.get_running_loop().call_later(
+                self.delay, self._fire, key)
+
+    def _fire(self, key):
+        items, handle, callback = self._groups.pop(key)
+        if handle is not None:
+            handle.cancel()
+        self.groups_handled += 1
+
+        task = asyncio.ensure_future(callback(sorted(items)))
+        self._tasks[task] = key
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._tasks.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Handling media group failed: {task.exception()}")
+
+    async def flush(self, match=None):
+        """Handle albums still waiting, and wait for their callbacks
+
+        With ``match``, only albums whose key it accepts are flushed, so a
+        user's next upload can wait for the albums they sent before it.
+        """
+        for key in list(self._groups):
+            if match is None or match(key):
+                self._fire(key)
+        tasks = [task for task, key in self._tasks.items()
+                 if match is None or match(key)]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
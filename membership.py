@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from memberset import MemberSet
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipCache:
+    """Backup channel membership cache with separate positive/negative TTLs
+
+    Concurrent checks for the same user share one ``get_chat_member``
+    call. Members whose entry is about to expire are re-checked in the
+    background when they show up, so hot users never wait on the API and
+    users who left the channel lose access within ``positive_ttl``.
+
+    Members are kept in a compact ``MemberSet`` with the time each was
+    last confirmed, compacted and saved every ``snapshot_interval``
+    seconds, so returning users are not checked again after a restart.
+    Non-members are only cached for ``negative_ttl``, in memory.
+
+    ``check`` callables return True/False, or None when the API could not
+    answer; unknown results are never cached.
+    """
+
+    def __init__(self,
+                 positive_ttl=6 * 3600,
+                 negative_ttl=30,
+                 refresh_ahead=0.2,
+                 max_entries=1_000_000,
+                 members=None,
+                 snapshot_interval=300.0):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        # Fraction of the positive TTL before expiry that triggers a refresh
+        self.refresh_ahead = refresh_ahead
+        # Bound on cached non-members
+        self.max_entries = max_entries
+        self.snapshot_interval = snapshot_interval
+
+        # user_id -> last confirmed as a member (Unix seconds)
+        self.members = members if members is not None else MemberSet()
+        # non-member user_id -> expires_at (monotonic)
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.api_checks = 0
+        self.revoked = 0
+
+    def __len__(self):
+        """Number of users known as members"""
+        return len(self.members)
+
+    def __contains__(self, user_id):
+        confirmed = self.members.last_seen(user_id)
+        return (confirmed is not None and
+                confirmed + self.positive_ttl > time.time())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "membership_cached": len(self._entries) + len(self.members),
+            "membership_members": len(self.members),
+            "membership_hit_rate": round(self.hits / lookups, 4)
+            if lookups else 0.0,
+            "membership_api_checks": self.api_checks,
+            "membership_coalesced": self.coalesced,
+            "membership_refreshes": self.refreshes,
+            "membership_revoked": self.revoked,
+            **self.members.stats(),
+        }
+
+    def _store(self, user_id, is_member):
+        if is_member:
+            self._entries.pop(user_id, None)
+            self.members.add(user_id)
+            return
+
+        if user_id in self.members:
+            self.revoked += 1
+            self.members.discard(user_id)
+        self._entries[user_id] = time.monotonic() + self.negative_ttl
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        self._entries.pop(user_id, None)
+        self.members.discard(user_id)
+
+    async def _fetch(self, user_id, check):
+        self.api_checks += 1
+        try:
+            result = await check(user_id)
+        except Exception as e:
+            logger.warning(f"Membership check failed for {user_id}: {e}")
+            result = None
+        if result is not None:
+            self._store(user_id, bool(result))
+        return result
+
+    def _fetch_once(self, user_id, check):
+        """Start a check for the user, or join the one already running"""
+        task = self._inflight.get(user_id)
+        if task is not None:
+            self.coalesced += 1
+            return task
+
+        task = asyncio.ensure_future(self._fetch(user_id, check))
+        self._inflight[user_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return task
+
+    async def is_member(self, user_id, check):
+        """Return whether the user is a member, calling check(user_id) if needed"""
+        expires_at = self._entries.get(user_id)
+        if expires_at is not None and expires_at > time.monotonic():
+            self.hits += 1
+            return False
+
+        confirmed = self.members.last_seen(user_id)
+        if confirmed is not None:
+            age = time.time() - confirmed
+            if age < self.positive_ttl:
+                self.hits += 1
+                if (age > self.positive_ttl * (1 - self.refresh_ahead) and
+                        user_id not in self._inflight):
+                    # Hot member close to expiry: re-check off the request path
+                    self.refreshes += 1
+                    self._fetch_once(user_id, check)
+                return True
+
+        self.misses += 1
+        # Shield so a cancelled request does not cancel the shared check
+        result = await asyncio.shield(self._fetch_once(user_id, check))
+        if result is None:
+            # API unavailable: trust a stale positive answer, deny otherwise
+            return confirmed is not None
+        return result
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.snapshot()
+
+    async def snapshot(self):
+        """Compact and save the member set if it changed"""
+        if not self.members.pending_changes:
+            return
+        try:
+            await self.members.compact_async()
+        except Exception as e:
+            logger.error(f"Could not save the member set: {e}")
+
+    async def stop(self):
+        """Stop the snapshot loop and save what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.snapshot()
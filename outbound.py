@@ -0,0 +1,258 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import API_ERRORS, API_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower runs first
+PRIORITY_HIGH = 0  # admin replies, callback answers
+PRIORITY_NORMAL = 1  # user deliveries
+PRIORITY_BULK = 2  # background and bulk work
+
+# Endpoints that count against Telegram's message flood limits
+THROTTLED_PREFIXES = ("send", "copy", "forward", "edit")
+
+# Endpoints that should never wait behind deliveries
+HIGH_PRIORITY_ENDPOINTS = {"answerCallbackQuery"}
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now):
+        """Take a token, going into debt if needed; returns the wait"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Central scheduler for every outbound Bot API call
+
+    Plugs into ``ApplicationBuilder.rate_limiter`` so every
+    ``context.bot`` call goes through it. Message-sending calls wait for a
+    per-chat token and then for a global token, handed out by priority
+    lane. A RetryAfter pauses the whole scheduler for the requested time
+    and the call is retried instead of dropped.
+
+    ``rate_limit_args`` may be a priority (int) or a dict with
+    ``priority`` and/or ``max_retries`` keys.
+    """
+
+    def __init__(self,
+                 overall_rate=30,
+                 chat_rate=1,
+                 chat_burst=3,
+                 group_rate=20 / 60,
+                 group_burst=5,
+                 chat_limits=None,
+                 priority_chats=(),
+                 max_retries=3):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.chat_limits = dict(chat_limits or {})
+        self.priority_chats = set(priority_chats)
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(overall_rate, overall_rate)
+        self._chats = {}
+        self._prune_at = 10000
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+        # Metrics
+        self.requests = [0, 0, 0]
+        self.retry_after_hits = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waited_requests = 0
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def stats(self):
+        waited = self.waited_requests
+        return {
+            "outbound_queue_depth": self.queue_depth,
+            "outbound_requests": dict(zip(("high", "normal", "bulk"),
+                                          self.requests)),
+            "outbound_retry_after": self.retry_after_hits,
+            "outbound_dropped": self.dropped,
+            "outbound_wait_avg_ms": round(
+                self.wait_total / waited * 1000, 2) if waited else 0.0,
+            "outbound_wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id in self.chat_limits:
+                rate, burst = self.chat_limits[chat_id]
+            elif isinstance(chat_id, str) or chat_id < 0:
+                # Groups and channels have a stricter per-minute limit
+                rate, burst = self.group_rate, self.group_burst
+            else:
+                rate, burst = self.chat_rate, self.chat_burst
+            bucket = self._chats[chat_id] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _priority(self, endpoint, chat_id, rate_limit_args):
+        if isinstance(rate_limit_args, dict):
+            priority = rate_limit_args.get("priority")
+        else:
+            priority = rate_limit_args
+        if priority is not None:
+            return min(max(int(priority), PRIORITY_HIGH), PRIORITY_BULK)
+        if endpoint in HIGH_PRIORITY_ENDPOINTS or chat_id in self.priority_chats:
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    async def _acquire(self, chat_id, priority):
+        now = time.monotonic()
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id, now).reserve(now)
+            if delay:
+                await asyncio.sleep(delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters,
+                       (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        """Hand out global tokens to waiters, highest priority first"""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = max(self._paused_until - now,
+                        self._global.wait_time(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._global.reserve(now)
+            future.set_result(None)
+
+            # Drop idle per-chat buckets so memory tracks active chats only
+            if len(self._chats) > self._prune_at:
+                self._chats = {
+                    chat_id: bucket
+                    for chat_id, bucket in self._chats.items()
+                    if not bucket.is_full(now)
+                }
+                self._prune_at = max(10000, 2 * len(self._chats))
+
+    async def process_request(self, callback, args, kwargs, endpoint, data,
+                              rate_limit_args):
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        throttled = endpoint.startswith(THROTTLED_PREFIXES)
+        priority = self._priority(endpoint, chat_id, rate_limit_args)
+        max_retries = self.max_retries
+        if isinstance(rate_limit_args, dict):
+            max_retries = rate_limit_args.get("max_retries", max_retries)
+        self.requests[priority] += 1
+
+        for attempt in range(max_retries + 1):
+            if throttled:
+                started = time.monotonic()
+                await self._acquire(chat_id, priority)
+                waited = time.monotonic() - started
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                self.waited_requests += 1
+            else:
+                # Unthrottled calls still respect a flood pause
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                API_ERRORS.labels(endpoint, "RetryAfter").inc()
+                self.retry_after_hits += 1
+                retry_after = exc.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                if attempt == max_retries:
+                    self.dropped += 1
+                    logger.error(
+                        f"{endpoint} still flood limited after "
+                        f"{max_retries} retries")
+                    raise
+                logger.warning(
+                    f"Flood limit on {endpoint}, pausing outbound calls "
+                    f"for {retry_after}s")
+                self._paused_until = max(self._paused_until,
+                                         time.monotonic() + retry_after + 0.1)
+            except Exception as e:
+                API_ERRORS.labels(endpoint, type(e).__name__).inc()
+                raise
+            finally:
+                API_LATENCY.labels(endpoint).observe(time.perf_counter() -
+                                                     started)
+        return None
@@ -0,0 +1,233 @@
+import ast
+import json
+import logging
+import re
+import time
+from datetime import datetime
+
+from codec import (PREFIX, MetadataError, decode_metadata, join_parts,
+                   parse_part, peek_expires_at)
+
+logger = logging.getLogger(__name__)
+
+# Caption markers written by save_media_to_channel
+METADATA_MARKER = "Metadata: "
+EXPIRES_PATTERN = re.compile(r"'expires_at': '([^']+)'")
+CODE_PATTERN = re.compile(r"Code: `?([\w-]+)")
+
+# Returned by parse_entry for a metadata part that is waiting for the rest
+PENDING = object()
+
+# Maximum number of split metadata tokens being reassembled at once
+MAX_PENDING_PARTS = 1000
+
+# Number of recovered entries written to the store per transaction
+BATCH_SIZE = 1000
+
+# Seconds between progress log lines
+PROGRESS_INTERVAL = 2.0
+
+
+def iter_export_messages(fp, chunk_size=1 << 16):
+    """Stream message objects out of a Telegram Desktop ``result.json`` export
+
+    Only one message (plus one read chunk) is held in memory at a time, so
+    exports with hundreds of thousands of posts parse in constant memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+
+    # Skip ahead to the opening bracket of the "messages" array
+    while True:
+        idx = buf.find('"messages"')
+        if idx != -1:
+            bracket = buf.find("[", idx)
+            if bracket != -1:
+                buf = buf[bracket + 1:]
+                break
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            return
+        # Keep a short tail in case the key is split across chunks
+        buf = buf[-16:] + chunk
+
+    eof = False
+    pos = 0
+    whitespace = re.compile(r"[\s,]*")
+    while True:
+        pos = whitespace.match(buf, pos).end()
+        if buf.startswith("]", pos):
+            return
+        try:
+            message, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                if pos < len(buf):
+                    logger.warning("Export ended with a truncated message")
+                return
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                eof = True
+            # Drop consumed text only when refilling to avoid quadratic copies
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield message
+
+
+def iter_jsonl_messages(fp):
+    """Stream Bot API message objects from a JSONL file (one per line)"""
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def message_caption(message):
+    """Return the caption/text of an exported or Bot API message"""
+    caption = message.get("caption")
+    if caption is not None:
+        return caption
+
+    text = message.get("text", "")
+    if isinstance(text, list):
+        # Exports split formatted text into plain strings and entity dicts
+        return "".join(part if isinstance(part, str) else part.get("text", "")
+                       for part in text)
+    return text
+
+
+def _parse_part(message, part, pending, now):
+    """Collect one part of a split metadata token
+
+    Parts are posted right after each other, so at most a handful are
+    pending at any time; the oldest are dropped beyond MAX_PENDING_PARTS.
+    """
+    index, total, chunk = part
+    match = CODE_PATTERN.search(message_caption(message))
+    if not match:
+        return None
+    code = match.group(1)
+
+    if index == 1:
+        # The first part carries the header, so expiry is known up front
+        if peek_expires_at(PREFIX + chunk) <= now:
+            return False
+        message_id = message.get("message_id", message.get("id"))
+        pending[code] = (message_id, [chunk])
+        if len(pending) > MAX_PENDING_PARTS:
+            del pending[next(iter(pending))]
+        return PENDING
+
+    if code not in pending or len(pending[code][1]) != index - 1:
+        return None
+    message_id, chunks = pending[code]
+    chunks.append(chunk)
+    if index < total:
+        return PENDING
+
+    del pending[code]
+    metadata = decode_metadata(join_parts(chunks))
+    return metadata["code"], {'message_id': message_id, 'metadata': metadata}
+
+
+def parse_entry(message, now, pending=None):
+    """Turn one database channel post into a (code, entry) pair
+
+    Returns ``None`` for posts without metadata, ``False`` for expired ones
+    and ``PENDING`` for parts of a split token. Expiry is checked on the
+    raw caption before the metadata is decoded, so expired posts are never
+    materialized. Both the compact ``C1:`` encoding and the legacy dict
+    repr are understood.
+    """
+    caption = message_caption(message)
+    marker = caption.find(METADATA_MARKER)
+    if marker == -1:
+        return None
+    raw = caption[marker + len(METADATA_MARKER):].strip()
+
+    if raw.startswith(PREFIX):
+        part = parse_part(raw)
+        if part is not None:
+            if pending is None:
+                return None
+            return _parse_part(message, part, pending, now)
+        if peek_expires_at(raw) <= now:
+            return False
+        metadata = decode_metadata(raw)
+    else:
+        match = EXPIRES_PATTERN.search(raw)
+        if not match:
+            return None
+        if datetime.fromisoformat(match.group(1)) <= now:
+            return False
+        try:
+            metadata = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return None
+        if not isinstance(metadata, dict) or "code" not in metadata:
+            return None
+
+    message_id = message.get("message_id", message.get("id"))
+    return metadata["code"], {'message_id': message_id, 'metadata': metadata}
+
+
+def rebuild_index(store, messages):
+    """Rebuild the code index from a stream of database channel posts
+
+    Entries already in the store win over recovered ones. Returns a dict
+    of counters for the run.
+    """
+    stats = {"messages": 0, "recovered": 0, "expired": 0, "skipped": 0}
+    now = datetime.utcnow()
+    started = last_report = time.monotonic()
+    batch = []
+    pending = {}
+
+    for message in messages:
+        stats["messages"] += 1
+        try:
+            result = parse_entry(message, now, pending)
+        except (MetadataError, ValueError, KeyError, TypeError) as e:
+            logger.debug(f"Skipping unparseable post: {e}")
+            result = None
+
+        if result is PENDING:
+            pass
+        elif result is None:
+            stats["skipped"] += 1
+        elif result is False:
+            stats["expired"] += 1
+        else:
+            batch.append(result)
+            if len(batch) >= BATCH_SIZE:
+                stats["recovered"] += store.load_many(batch)
+                batch = []
+
+        current = time.monotonic()
+        if current - last_report >= PROGRESS_INTERVAL:
+            last_report = current
+            rate = stats["messages"] / (current - started)
+            logger.info(
+                f"Recovery progress: {stats['messages']} posts scanned, "
+                f"{stats['recovered']} codes recovered ({rate:.0f} posts/s)")
+
+    if batch:
+        stats["recovered"] += store.load_many(batch)
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 3)
+    logger.info(
+        f"Recovery finished: {stats['messages']} posts, "
+        f"{stats['recovered']} recovered, {stats['expired']} expired, "
+        f"{stats['skipped']} skipped in {elapsed:.1f}s "
+        f"({stats['messages'] / max(elapsed, 1e-9):.0f} posts/s)")
+    return stats
+
+
+def recover_from_file(store, path):
+    """Rebuild the index from an export file (``.json``) or JSONL stand-in"""
+    with open(path, encoding="utf-8") as fp:
+        if path.endswith(".jsonl"):
+            return rebuild_index(store, iter_jsonl_messages(fp))
+        return rebuild_index(store, iter_export_messages(fp))
@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import platform
+import queue
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from bench import (configure_environment, git_revision, percentile,
+                   running_application, start_fake_api)
+from eventlog import LogWriter
+
+# Latency increase (percent) that counts as a regression in compare
+DEFAULT_THRESHOLD = 10.0
+
+# Differences below this many milliseconds are treated as noise
+NOISE_FLOOR_MS = 2.0
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class _RecordFormatter:
+    """Renders queued (offset, update) pairs on the writer thread"""
+
+    def format(self, item):
+        offset, update = item
+        return json.dumps({"t": offset, "u": update.to_dict()},
+                          ensure_ascii=False,
+                          separators=(",", ":"))
+
+
+class UpdateRecorder:
+    """Appends incoming updates to a JSONL file with their arrival time
+
+    Each line is ``{"t": seconds since recording started, "u": update}``;
+    a ``.gz`` path is compressed. ``record`` only queues the update:
+    serializing, compressing and writing happen on a background
+    eventlog.LogWriter thread. Call close() on shutdown to write the rest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.recorded = 0
+        self._fp = _open(path, "a")
+        self._records = queue.SimpleQueue()
+        self._writer = LogWriter(self._records, self._fp, _RecordFormatter())
+        self._writer.start()
+        self._started = time.monotonic()
+
+    def record(self, update):
+        self._records.put((round(time.monotonic() - self._started, 4),
+                           update))
+        self.recorded += 1
+
+    def close(self):
+        self._writer.stop()
+        self._fp.close()
+
+
+def read_recording(path):
+    """Yield (offset, update dict) pairs from a recording"""
+    with _open(path, "r") as fp:
+        for line in fp:
+            # The writer puts an error line in place of unserializable updates
+            if line.startswith("{"):
+                record = json.loads(line)
+                yield record["t"], record["u"]
+
+
+def update_kind(update):
+    """The handler an update is meant for, for grouping latencies"""
+    if update.channel_post or update.edited_channel_post:
+        return "channel"
+    if update.callback_query:
+        data = update.callback_query.data or ""
+        return "deliver_next_page" if data.startswith("page:") else \
+            "handle_callback"
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.text and message.text.startswith("/"):
+        command = message.text.split()[0][1:].split("@")[0]
+        return {"start": "start", "admin": "admin_panel"}.get(command, "other")
+    if message.photo or message.video or message.document:
+        return "handle_media"
+    return "other"
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+async def replay(application, records, speed=1.0):
+    """Feed recorded updates through the application's update processor
+
+    Updates are released at their recorded offsets divided by ``speed``
+    (0 sends them as fast as possible). Returns latencies in seconds
+    grouped by update_kind, and the wall time of the run.
+    """
+    from telegram import Update
+
+    processor = application.update_processor
+    latencies = {}
+    tasks = []
+
+    async def handle(update):
+        started = time.perf_counter()
+        await processor.process_update(update,
+                                       application.process_update(update))
+        latencies.setdefault(update_kind(update),
+                             []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for offset, data in records:
+        if speed:
+            delay = started + offset / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = Update.de_json(data, application.bot)
+        tasks.append(asyncio.create_task(handle(update)))
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - started
+
+
+def summarize(latencies):
+    return {
+        kind: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+            "p90_ms": round(percentile(values, 0.90) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1),
+        }
+        for kind, values in sorted(latencies.items())
+    }
+
+
+async def run_replay(args, api_url):
+    records = list(read_recording(args.recording))
+    async with running_application() as (main, application):
+        if args.codes:
+            # Recorded deep links only resolve if their codes exist
+            from transfer import import_from_file
+            stats = await asyncio.to_thread(import_from_file,
+                                            main.channel_message_storage,
+                                            args.codes)
+            await main.expiry_scheduler.reload()
+            print(f"Loaded {stats['imported']} codes from {args.codes}")
+
+        async with httpx.AsyncClient(base_url=api_url) as api:
+            await api.post("/_reset")
+            latencies, elapsed = await replay(application, records,
+                                              args.speed)
+            await main.media_groups.flush()
+            calls = (await api.get("/_stats")).json()
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "recording": os.path.basename(args.recording),
+        "speed": args.speed,
+        "updates": len(records),
+        "seconds": round(elapsed, 3),
+        "api_calls_per_update":
+        round(calls["total_calls"] / max(len(records), 1), 2),
+        "api_calls": calls["calls"],
+        "flood_errors": calls["flood_errors"],
+        "peak_rss_mib": peak_rss_mib(),
+        "handlers": summarize(latencies),
+    }
+
+
+def print_result(result):
+    print(f"{result['updates']} updates in {result['seconds']}s  "
+          f"{result['api_calls_per_update']} API calls/update  "
+          f"{result['flood_errors']} 429s  "
+          f"peak RSS {result['peak_rss_mib']} MiB")
+    for kind, stats in result["handlers"].items():
+        print(f"  {kind:20s} {stats['count']:6d}  p50 {stats['p50_ms']:7.1f}ms"
+              f"  p90 {stats['p90_ms']:7.1f}ms  p99 {stats['p99_ms']:7.1f}ms")
+
+
+def compare(base, new, threshold=DEFAULT_THRESHOLD):
+    """Print base vs new side by side; returns the regressions found"""
+    regressions = []
+
+    def check(label, before, after, floor=NOISE_FLOOR_MS):
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > threshold and after - before > floor:
+            flag = "  REGRESSION"
+            regressions.append(label)
+        print(f"  {label:32s} {before:9.2f} -> {after:9.2f} "
+              f"({change:+6.1f}%){flag}")
+
+    print(f"{base.get('revision')} -> {new.get('revision')}")
+    if (base.get("recording"), base.get("speed")) != (new.get("recording"),
+                                                      new.get("speed")):
+        print("  warning: the runs replayed different recordings or speeds")
+    for kind in sorted(set(base["handlers"]) | set(new["handlers"])):
+        if kind not in base["handlers"] or kind not in new["handlers"]:
+            print(f"  {kind}: only in one run")
+            continue
+        for stat in ("p50_ms", "p99_ms"):
+            check(f"{kind} {stat}", base["handlers"][kind][stat],
+                  new["handlers"][kind][stat])
+    check("api_calls_per_update", base["api_calls_per_update"],
+          new["api_calls_per_update"], floor=0.01)
+    check("peak_rss_mib", base["peak_rss_mib"], new["peak_rss_mib"],
+          floor=1.0)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded updates against fakeapi.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="replay a recording")
+    run.add_argument("recording",
+                     help="JSONL written with RECORD_UPDATES=path")
+    run.add_argument("--speed", type=float, default=1.0,
+                     help="time compression; 0 replays as fast as possible")
+    run.add_argument("--codes",
+                     help="code export (/admin export) to load first")
+    run.add_argument("--latency", type=float, default=0.05,
+                     help="simulated Bot API latency in seconds")
+    run.add_argument("--port", type=int, default=8081)
+    run.add_argument("--api-url",
+                     help="use a running fakeapi.py instead of starting one")
+    run.add_argument("--store", default="sqlite", choices=("sqlite", "memory"))
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--json", help="write the results to this file")
+
+    diff = commands.add_parser("compare", help="compare two replay results")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                      help="latency increase in percent that fails")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base) as fp:
+            base = json.load(fp)
+        with open(args.new) as fp:
+            new = json.load(fp)
+        regressions = compare(base, new, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            sys.exit(1)
+        return
+
+    process = None
+    if args.api_url:
+        api_url = args.api_url.rstrip("/")
+    else:
+        process, api_url = start_fake_api(args)
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(api_url, directory, args.store)
+        try:
+            result = asyncio.run(run_replay(args, api_url))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print_result(result)
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
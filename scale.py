@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from bench import HERE, git_revision, start_fake_api
+
+SECRET = "scale"
+
+
+def seed_codes(store_url, count):
+    """Put single-file codes straight into the shared store"""
+    from storage import open_code_store
+
+    store = open_code_store(store_url)
+    expires_at = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    codes = []
+    for i in range(count):
+        code = f"scale{i:04d}"
+        store[code] = {
+            "message_id": 1,
+            "metadata": {"code": code, "type": "single",
+                         "file_id": f"scalefile{i}", "media_type": "photo",
+                         "expires_at": expires_at}
+        }
+        codes.append(code)
+    store.close()
+    return codes
+
+
+def start_replicas(count, api_url, directory, base_port):
+    """Start count webhook replicas of main.py sharing one SQLite store"""
+    processes = []
+    for index in range(count):
+        env = dict(
+            os.environ,
+            BOT_TOKEN="123456:scale",
+            BOT_API_BASE_URL=api_url,
+            BOT_MODE="webhook",
+            WEBHOOK_URL="http://127.0.0.1",
+            WEBHOOK_SECRET=SECRET,
+            PORT=str(base_port + index),
+            CODE_STORE_URL=f"sqlite:///{directory}/codes.db",
+            REPLICA_INDEX=str(index),
+            REPLICA_COUNT=str(count),
+            # The fake API runs without flood limits, so the client side
+            # must not hold calls back either
+            OUTBOUND_RATE="100000",
+            LOG_LEVEL="WARNING")
+        processes.append(
+            subprocess.Popen([sys.executable,
+                              os.path.join(HERE, "main.py")],
+                             env=env))
+
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(count)]
+    for url in urls:
+        for _ in range(150):
+            try:
+                httpx.get(f"{url}/health")
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        else:
+            stop(processes)
+            raise RuntimeError(f"replica at {url} did not start")
+    return processes, urls
+
+
+def stop(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def start_update(update_id, user_id, code):
+    text = f"/start media_{code}"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False,
+                     "first_name": f"u{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0,
+                          "length": len("/start")}],
+        }
+    }
+
+
+async def processed(client, urls):
+    total = 0
+    for url in urls:
+        stats = (await client.get(f"{url}/stats")).json()
+        total += stats["updates_processed"]
+    return total
+
+
+async def drive(urls, codes, requests, concurrency, seed):
+    """Post /start updates round-robin and wait until all are handled
+
+    Returns updates per second from the first post to the last update
+    handled by any replica.
+    """
+    rng = random.Random(seed)
+    updates = [start_update(i + 1, 100_000 + i, rng.choice(codes))
+               for i in range(requests)]
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    limit = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_connections=concurrency)) as client:
+        before = await processed(client, urls)
+
+        async def post(i, update):
+            async with limit:
+                response = await client.post(
+                    f"{urls[i % len(urls)]}/telegram", json=update,
+                    headers=headers)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i, update)
+                               for i, update in enumerate(updates)))
+        while await processed(client, urls) - before < requests:
+            await asyncio.sleep(0.05)
+        return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure /start throughput with 1..N webhook replicas "
+        "sharing a SQLite store, against fakeapi.py")
+    parser.add_argument("--replicas", default="1,2,4",
+                        help="comma-separated replica counts to try")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="webhook posts in flight")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="simulated Bot API latency in seconds")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--replica-port", type=int, default=8200,
+                        help="first replica's web server port")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    counts = [int(count) for count in args.replicas.split(",")]
+    if max(counts) >= (os.cpu_count() or 1):
+        # The client, the fake API and every replica share these CPUs
+        print(f"note: only {os.cpu_count()} CPU(s); replicas compete with "
+              f"each other and the load generator for them")
+
+    # Telegram's per-bot flood limit caps outbound messages no matter how
+    # many replicas run; lifting it shows what the bot itself can handle
+    api_process, api_url = start_fake_api(args, "--no-flood-limits",
+                                          "--member-percent", "100")
+    results = []
+    try:
+        for count in counts:
+            with tempfile.TemporaryDirectory() as directory:
+                codes = seed_codes(f"sqlite:///{directory}/codes.db", 50)
+                processes, urls = start_replicas(count, api_url, directory,
+                                                 args.replica_port)
+                try:
+                    # Warm up: membership checks, caches, connections
+                    asyncio.run(drive(urls, codes, 200, args.concurrency,
+                                      args.seed + 1))
+                    throughput = asyncio.run(
+                        drive(urls, codes, args.requests, args.concurrency,
+                              args.seed))
+                finally:
+                    stop(processes)
+            speedup = throughput / results[0]["throughput_rps"] \
+                if results else 1.0
+            results.append({
+                "replicas": count,
+                "throughput_rps": round(throughput, 1),
+                "speedup": round(speedup, 2),
+            })
+            print(f"{count:2d} replica(s)  {throughput:8.1f} updates/s  "
+                  f"x{speedup:.2f}")
+    finally:
+        api_process.terminate()
+        api_process.wait()
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "timestamp": datetime.utcnow().isoformat(),
+                "cpus": os.cpu_count(),
+                "settings": {
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "latency": args.latency,
+                },
+                "results": results,
+            }, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindSessionStore:
+    """Session state served from memory and written behind to a store
+
+    Same interface as the session stores in storage.py, but every call
+    only touches memory. Changed users are marked dirty and their latest
+    state is written to ``backend`` in one transaction every
+    ``flush_interval`` seconds and on shutdown, from a worker thread, so
+    handlers never wait on disk. Several changes to one user between
+    flushes cost a single write.
+
+    State is loaded from the backend on creation; a crash loses at most
+    the last ``flush_interval`` seconds of changes. Only use this when one
+    process owns the sessions: replicas must share the backend directly.
+    """
+
+    def __init__(self, backend, flush_interval=1.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+
+        self._timers, self._files, self._progress = backend.load_sessions()
+        self._dirty_timers = set()
+        self._dirty_files = set()
+        self._dirty_progress = set()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        self._task = None
+
+        self.changes = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.last_flush_ms = 0.0
+
+    def stats(self):
+        return {
+            "session_dirty_users":
+            len(self._dirty_timers | self._dirty_files |
+                {user_id for user_id, _ in self._dirty_progress}),
+            "session_changes": self.changes,
+            "session_flushes": self.flushes,
+            "session_flush_failures": self.flush_failures,
+            "session_last_flush_ms": self.last_flush_ms,
+        }
+
+    def get_timer(self, user_id, default):
+        return self._timers.get(user_id, default)
+
+    def set_timer(self, user_id, minutes):
+        self._timers[user_id] = minutes
+        self._dirty_timers.add(user_id)
+        self.changes += 1
+
+    def append_file(self, user_id, file_id, media_type):
+        """Add a file to the user's batch; returns the new batch size"""
+        files = self._files.setdefault(user_id, [])
+        files.append((file_id, media_type))
+        self._dirty_files.add(user_id)
+        self.changes += 1
+        return len(files)
+
+    def append_files(self, user_id, new_files):
+        """Add several (file_id, media_type) pairs; returns the batch size"""
+        files = self._files.setdefault(user_id, [])
+        files.extend(new_files)
+        self._dirty_files.add(user_id)
+        self.changes += 1
+        return len(files)
+
+    def get_files(self, user_id):
+        return list(self._files.get(user_id, []))
+
+    def take_files(self, user_id):
+        """Return the user's batch and clear it in one step"""
+        files = self._files.pop(user_id, [])
+        if files:
+            self._dirty_files.add(user_id)
+            self.changes += 1
+        return files
+
+    def get_progress(self, user_id, code):
+        """Files of code already delivered to the user (None if no session)"""
+        entry = self._progress.get((user_id, code))
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def set_progress(self, user_id, code, position, expires_at):
+        """Record delivery progress; kept until expires_at (a timestamp)"""
+        self._progress[(user_id, code)] = (position, expires_at)
+        self._dirty_progress.add((user_id, code))
+        self.changes += 1
+
+    def clear_progress(self, user_id, code):
+        if self._progress.pop((user_id, code), None) is not None:
+            self._dirty_progress.add((user_id, code))
+            self.changes += 1
+
+    def _take_dirty(self):
+        """Snapshot the current state of every dirty user"""
+        timers = {user_id: self._timers[user_id]
+                  for user_id in self._dirty_timers}
+        files = {user_id: list(self._files.get(user_id, ()))
+                 for user_id in self._dirty_files}
+        progress = {key: self._progress.get(key)
+                    for key in self._dirty_progress}
+        self._dirty_timers = set()
+        self._dirty_files = set()
+        self._dirty_progress = set()
+        return timers, files, progress
+
+    async def flush(self):
+        """Write every pending change to the backend"""
+        async with self._flush_lock:
+            if (not self._dirty_timers and not self._dirty_files and
+                    not self._dirty_progress):
+                return
+            timers, files, progress = self._take_dirty()
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.backend.save_sessions, timers,
+                                        files, progress)
+            except Exception as e:
+                # Memory still holds the latest state; retry next time
+                self._dirty_timers.update(timers)
+                self._dirty_files.update(files)
+                self._dirty_progress.update(progress)
+                self.flush_failures += 1
+                logger.error(f"Session flush failed: {e}")
+                return
+            self.flushes += 1
+            self.last_flush_ms = round(
+                (time.perf_counter() - started) * 1000, 2)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(),
+                                       self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def stop(self):
+        """Stop the flush loop after writing everything still pending"""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def close(self):
+        self.backend.close()
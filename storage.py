@@ -0,0 +1,817 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+# Default number of entries kept in the in-process LRU
+DEFAULT_LRU_SIZE = 10000
+
+# Seconds a shared store caches its row count (other replicas write too)
+SHARED_COUNT_TTL = 5.0
+
+# Seconds a shared store trusts an LRU entry before re-reading the row
+SHARED_LRU_TTL = 2.0
+
+# Naive UTC epoch; metadata timestamps are naive UTC ISO strings
+EPOCH = datetime(1970, 1, 1)
+
+
+def _expiry_timestamp(entry):
+    expires_at = datetime.fromisoformat(entry['metadata']['expires_at'])
+    return (expires_at - EPOCH).total_seconds()
+
+
+def _connect(path):
+    """Open a SQLite database in WAL mode, shareable between processes"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path,
+                           timeout=10,
+                           isolation_level=None,
+                           check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class MemoryCodeStore(dict):
+    """Plain in-memory code index (lost on restart)"""
+
+    def load_many(self, items):
+        """Insert (code, entry) pairs that are not already present"""
+        added = 0
+        for code, entry in items:
+            if code not in self:
+                self[code] = entry
+                added += 1
+        return added
+
+    def refresh(self, code):
+        """The entry as stored now (None if gone); nothing is cached here"""
+        return self.get(code)
+
+    def add(self, code, entry):
+        """Insert a new code; returns False if the code is already taken"""
+        if code in self:
+            return False
+        self[code] = entry
+        return True
+
+    def iter_expiries(self):
+        """Yield (code, expires_at, message_id) for every stored code"""
+        for code, entry in list(self.items()):
+            yield code, entry['metadata']['expires_at'], entry.get('message_id')
+
+    def iter_pages(self, page_size=1000):
+        """Yield lists of (code, message_id, metadata JSON) rows"""
+        codes = list(self)
+        for start in range(0, len(codes), page_size):
+            page = []
+            for code in codes[start:start + page_size]:
+                entry = self.get(code)
+                if entry is not None:
+                    page.append((code, entry.get('message_id'),
+                                 json.dumps(entry['metadata'],
+                                            separators=(',', ':'))))
+            yield page
+
+    def close(self):
+        pass
+
+
+class SQLiteCodeStore(MutableMapping):
+    """Code index stored in SQLite (WAL mode) with a bounded LRU in front
+
+    Behaves like the old ``channel_message_storage`` dict: keys are codes,
+    values are ``{'message_id': ..., 'metadata': {...}}`` entries.
+
+    Several processes can share one database file. Set ``lru_ttl`` in that
+    case so entries changed by another replica are re-read after that many
+    seconds, and call refresh() before acting on an entry that may have
+    changed since (e.g. deleting a code that looks expired).
+    """
+
+    def __init__(self, path, lru_size=DEFAULT_LRU_SIZE, lru_ttl=None):
+        self.path = path
+        self.lru_size = lru_size
+        self.lru_ttl = lru_ttl
+        self._lru = OrderedDict()
+        self._lock = threading.RLock()
+        self.lru_hits = 0
+        self.lru_misses = 0
+
+        self._conn = _connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS codes (
+                code TEXT PRIMARY KEY,
+                message_id INTEGER,
+                expires_at TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            ) WITHOUT ROWID""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS codes_expires_at ON codes (expires_at)")
+
+        # Row count is kept in memory so len() stays O(1)
+        self._count = self._conn.execute(
+            "SELECT COUNT(*) FROM codes").fetchone()[0]
+        self._counted_at = time.monotonic()
+
+    def _remember(self, code, entry):
+        self._lru[code] = (entry, time.monotonic())
+        self._lru.move_to_end(code)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _cached(self, code):
+        cached = self._lru.get(code)
+        if cached is None or (self.lru_ttl is not None and
+                              time.monotonic() - cached[1] >= self.lru_ttl):
+            return None
+        self._lru.move_to_end(code)
+        return cached[0]
+
+    def __getitem__(self, code):
+        with self._lock:
+            entry = self._cached(code)
+            if entry is not None:
+                self.lru_hits += 1
+                return entry
+
+            self.lru_misses += 1
+            row = self._conn.execute(
+                "SELECT message_id, metadata FROM codes WHERE code = ?",
+                (code, )).fetchone()
+            if row is None:
+                self._lru.pop(code, None)
+                raise KeyError(code)
+
+            entry = {'message_id': row[0], 'metadata': json.loads(row[1])}
+            self._remember(code, entry)
+            return entry
+
+    def __setitem__(self, code, entry):
+        metadata = entry['metadata']
+        row = (entry.get('message_id'), metadata['expires_at'],
+               json.dumps(metadata, separators=(',', ':')), code)
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE codes SET message_id = ?, expires_at = ?, metadata = ? "
+                "WHERE code = ?", row).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT INTO codes (message_id, expires_at, metadata, code) "
+                    "VALUES (?, ?, ?, ?)", row)
+                self._count += 1
+            self._remember(code, entry)
+
+    def __delitem__(self, code):
+        with self._lock:
+            self._lru.pop(code, None)
+            deleted = self._conn.execute("DELETE FROM codes WHERE code = ?",
+                                         (code, )).rowcount
+            if not deleted:
+                raise KeyError(code)
+            self._count -= deleted
+
+    def add(self, code, entry):
+        """Insert a new code; returns False if the code is already taken
+
+        The primary key makes this safe across processes sharing the file.
+        """
+        metadata = entry['metadata']
+        with self._lock:
+            added = self._conn.execute(
+                "INSERT OR IGNORE INTO codes "
+                "(code, message_id, expires_at, metadata) VALUES (?, ?, ?, ?)",
+                (code, entry.get('message_id'), metadata['expires_at'],
+                 json.dumps(metadata, separators=(',', ':')))).rowcount
+            if added:
+                self._count += 1
+                self._remember(code, entry)
+        return bool(added)
+
+    def load_many(self, items):
+        """Insert (code, entry) pairs that are not already present
+
+        Runs as a single transaction and bypasses the LRU, so bulk loads
+        neither evict hot entries nor grow memory.
+        """
+        rows = [(code, entry.get('message_id'),
+                 entry['metadata']['expires_at'],
+                 json.dumps(entry['metadata'], separators=(',', ':')))
+                for code, entry in items]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO codes "
+                    "(code, message_id, expires_at, metadata) "
+                    "VALUES (?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            added = self._conn.total_changes - before
+            self._count += added
+        return added
+
+    def iter_expiries(self):
+        """Yield (code, expires_at, message_id) for every stored code
+
+        Reads only the indexed columns, never the metadata blobs.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT code, expires_at, message_id FROM codes").fetchall()
+        return iter(rows)
+
+    def iter_pages(self, page_size=1000):
+        """Yield lists of (code, message_id, metadata JSON) rows
+
+        Pages are read by primary key range, so memory stays constant and
+        writers are only held up for one short read per page.
+        """
+        last = ""
+        while True:
+            with self._lock:
+                page = self._conn.execute(
+                    "SELECT code, message_id, metadata FROM codes "
+                    "WHERE code > ? ORDER BY code LIMIT ?",
+                    (last, page_size)).fetchall()
+            if not page:
+                return
+            yield page
+            last = page[-1][0]
+
+    def refresh(self, code):
+        """Re-read a code's row, bypassing the LRU (None if it is gone)"""
+        with self._lock:
+            self._lru.pop(code, None)
+        return self.get(code)
+
+    def __contains__(self, code):
+        with self._lock:
+            if self._cached(code) is not None:
+                return True
+        try:
+            self[code]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        # Iterate over a cursor so huge indexes are never loaded at once
+        cursor = self._conn.execute("SELECT code FROM codes")
+        for (code, ) in cursor:
+            yield code
+
+    def __len__(self):
+        if (self.lru_ttl is not None and
+                time.monotonic() - self._counted_at > SHARED_COUNT_TTL):
+            # Other replicas write to the same file; recount now and then
+            with self._lock:
+                self._count = self._conn.execute(
+                    "SELECT COUNT(*) FROM codes").fetchone()[0]
+                self._counted_at = time.monotonic()
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._lru.clear()
+            self._conn.close()
+
+
+class RedisCodeStore(MutableMapping):
+    """Code index in Redis (or any Redis-compatible server)
+
+    Each code is a JSON string that Redis expires by itself; a sorted set
+    keyed on expiry backs len() and iter_expiries(). Meant for replicas on
+    several hosts.
+    """
+
+    def __init__(self, client, prefix="telebot:"):
+        self._redis = client
+        self._prefix = prefix
+        self._index = prefix + "codes"
+
+    def _key(self, code):
+        return f"{self._prefix}code:{code}"
+
+    def _ttl(self, entry):
+        return max(1, int(_expiry_timestamp(entry) - time.time()))
+
+    def __getitem__(self, code):
+        raw = self._redis.get(self._key(code))
+        if raw is None:
+            raise KeyError(code)
+        return json.loads(raw)
+
+    def __setitem__(self, code, entry):
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(code), json.dumps(entry, separators=(',', ':')),
+                 ex=self._ttl(entry))
+        pipe.zadd(self._index, {code: _expiry_timestamp(entry)})
+        pipe.execute()
+
+    def __delitem__(self, code):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(code))
+        pipe.zrem(self._index, code)
+        deleted, _ = pipe.execute()
+        if not deleted:
+            raise KeyError(code)
+
+    def refresh(self, code):
+        """The entry as stored now (None if gone); nothing is cached here"""
+        return self.get(code)
+
+    def add(self, code, entry):
+        """Insert a new code; returns False if the code is already taken"""
+        if not self._redis.set(self._key(code),
+                               json.dumps(entry, separators=(',', ':')),
+                               ex=self._ttl(entry),
+                               nx=True):
+            return False
+        self._redis.zadd(self._index, {code: _expiry_timestamp(entry)})
+        return True
+
+    def load_many(self, items):
+        """Insert (code, entry) pairs that are not already present"""
+        items = list(items)
+        pipe = self._redis.pipeline(transaction=False)
+        for code, entry in items:
+            pipe.set(self._key(code),
+                     json.dumps(entry, separators=(',', ':')),
+                     ex=self._ttl(entry),
+                     nx=True)
+        results = pipe.execute()
+
+        added = [(code, entry)
+                 for (code, entry), ok in zip(items, results) if ok]
+        if added:
+            self._redis.zadd(self._index, {
+                code: _expiry_timestamp(entry)
+                for code, entry in added
+            })
+        return len(added)
+
+    def iter_expiries(self):
+        """Yield (code, expires_at, message_id) for every stored code"""
+        for code, score in self._redis.zscan_iter(self._index):
+            if isinstance(code, bytes):
+                code = code.decode()
+            expires_at = (EPOCH + timedelta(seconds=score)).isoformat()
+            # message_id is read from the entry when the code is evicted
+            yield code, expires_at, None
+
+    def iter_pages(self, page_size=1000):
+        """Yield lists of (code, message_id, metadata JSON) rows"""
+        codes = []
+        for code in self:
+            codes.append(code)
+            if len(codes) == page_size:
+                yield self._page(codes)
+                codes = []
+        if codes:
+            yield self._page(codes)
+
+    def _page(self, codes):
+        page = []
+        for code, raw in zip(codes,
+                             self._redis.mget([self._key(c) for c in codes])):
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+            page.append((code, entry.get('message_id'),
+                         json.dumps(entry['metadata'], separators=(',', ':'))))
+        return page
+
+    def __iter__(self):
+        for code, _ in self._redis.zscan_iter(self._index):
+            yield code.decode() if isinstance(code, bytes) else code
+
+    def __len__(self):
+        # Drop index entries whose keys Redis has already expired
+        self._redis.zremrangebyscore(self._index, "-inf", time.time())
+        return self._redis.zcard(self._index)
+
+    def close(self):
+        self._redis.close()
+
+
+class MemorySessionStore:
+    """Session state (admin timer and batch, delivery progress) in memory"""
+
+    def __init__(self):
+        self._timers = {}
+        self._files = {}
+        self._progress = {}
+
+    def get_timer(self, user_id, default):
+        return self._timers.get(user_id, default)
+
+    def set_timer(self, user_id, minutes):
+        self._timers[user_id] = minutes
+
+    def append_file(self, user_id, file_id, media_type):
+        """Add a file to the user's batch; returns the new batch size"""
+        files = self._files.setdefault(user_id, [])
+        files.append((file_id, media_type))
+        return len(files)
+
+    def append_files(self, user_id, new_files):
+        """Add several (file_id, media_type) pairs; returns the batch size"""
+        files = self._files.setdefault(user_id, [])
+        files.extend(new_files)
+        return len(files)
+
+    def get_files(self, user_id):
+        return list(self._files.get(user_id, []))
+
+    def take_files(self, user_id):
+        """Return the user's batch and clear it in one step"""
+        return self._files.pop(user_id, [])
+
+    def get_progress(self, user_id, code):
+        """Files of code already delivered to the user (None if no session)"""
+        entry = self._progress.get((user_id, code))
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def set_progress(self, user_id, code, position, expires_at):
+        """Record delivery progress; kept until expires_at (a timestamp)"""
+        self._progress[(user_id, code)] = (position, expires_at)
+
+    def clear_progress(self, user_id, code):
+        self._progress.pop((user_id, code), None)
+
+    def load_sessions(self):
+        """Return (timers, batches, progress) dicts for every user"""
+        return dict(self._timers), {
+            user_id: list(files)
+            for user_id, files in self._files.items()
+        }, dict(self._progress)
+
+    def save_sessions(self, timers, files, progress=None):
+        """Overwrite the timers, batches and progress entries given"""
+        self._timers.update(timers)
+        for user_id, batch in files.items():
+            if batch:
+                self._files[user_id] = list(batch)
+            else:
+                self._files.pop(user_id, None)
+        for key, entry in (progress or {}).items():
+            if entry is None:
+                self._progress.pop(key, None)
+            else:
+                self._progress[key] = entry
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore:
+    """Session state in SQLite, shared by every replica on the host
+
+    Appends and take-and-clear run in one transaction each, so album files
+    handled by different replicas all land in the same batch and a batch
+    is turned into a link exactly once.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_timers (
+                user_id INTEGER PRIMARY KEY,
+                minutes INTEGER NOT NULL
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_files (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                media_type TEXT NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS batch_files_user "
+                           "ON batch_files (user_id, seq)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS delivery_progress (
+                user_id INTEGER NOT NULL,
+                code TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (user_id, code)
+            ) WITHOUT ROWID""")
+
+    def get_timer(self, user_id, default):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT minutes FROM session_timers WHERE user_id = ?",
+                (user_id, )).fetchone()
+        return row[0] if row else default
+
+    def set_timer(self, user_id, minutes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO session_timers (user_id, minutes) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET minutes = excluded.minutes",
+                (user_id, minutes))
+
+    def append_file(self, user_id, file_id, media_type):
+        """Add a file to the user's batch; returns the new batch size"""
+        return self.append_files(user_id, [(file_id, media_type)])
+
+    def append_files(self, user_id, new_files):
+        """Add several (file_id, media_type) pairs; returns the batch size"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO batch_files (user_id, file_id, media_type) "
+                    "VALUES (?, ?, ?)",
+                    [(user_id, file_id, media_type)
+                     for file_id, media_type in new_files])
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM batch_files WHERE user_id = ?",
+                    (user_id, )).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def get_files(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id, media_type FROM batch_files "
+                "WHERE user_id = ? ORDER BY seq", (user_id, )).fetchall()
+        return rows
+
+    def take_files(self, user_id):
+        """Return the user's batch and clear it in one step"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT file_id, media_type FROM batch_files "
+                    "WHERE user_id = ? ORDER BY seq", (user_id, )).fetchall()
+                self._conn.execute("DELETE FROM batch_files WHERE user_id = ?",
+                                   (user_id, ))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def get_progress(self, user_id, code):
+        """Files of code already delivered to the user (None if no session)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT position FROM delivery_progress "
+                "WHERE user_id = ? AND code = ? AND expires_at > ?",
+                (user_id, code, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set_progress(self, user_id, code, position, expires_at):
+        """Record delivery progress; kept until expires_at (a timestamp)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO delivery_progress "
+                "(user_id, code, position, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, code, position, expires_at))
+
+    def clear_progress(self, user_id, code):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM delivery_progress WHERE user_id = ? AND code = ?",
+                (user_id, code))
+
+    def load_sessions(self):
+        """Return (timers, batches, progress) dicts for every user"""
+        files = {}
+        with self._lock:
+            timers = dict(
+                self._conn.execute(
+                    "SELECT user_id, minutes FROM session_timers"))
+            for user_id, file_id, media_type in self._conn.execute(
+                    "SELECT user_id, file_id, media_type FROM batch_files "
+                    "ORDER BY seq"):
+                files.setdefault(user_id, []).append((file_id, media_type))
+            # Progress of expired codes is dropped on the way in
+            self._conn.execute(
+                "DELETE FROM delivery_progress WHERE expires_at <= ?",
+                (time.time(), ))
+            progress = {
+                (user_id, code): (position, expires_at)
+                for user_id, code, position, expires_at in self._conn.execute(
+                    "SELECT user_id, code, position, expires_at "
+                    "FROM delivery_progress")
+            }
+        return timers, files, progress
+
+    def save_sessions(self, timers, files, progress=None):
+        """Overwrite the timers, batches and progress entries atomically"""
+        rows = [(user_id, file_id, media_type)
+                for user_id, batch in files.items()
+                for file_id, media_type in batch]
+        progress = progress or {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO session_timers (user_id, minutes) "
+                    "VALUES (?, ?) ON CONFLICT(user_id) "
+                    "DO UPDATE SET minutes = excluded.minutes",
+                    timers.items())
+                self._conn.executemany(
+                    "DELETE FROM batch_files WHERE user_id = ?",
+                    [(user_id, ) for user_id in files])
+                self._conn.executemany(
+                    "INSERT INTO batch_files (user_id, file_id, media_type) "
+                    "VALUES (?, ?, ?)", rows)
+                self._conn.executemany(
+                    "DELETE FROM delivery_progress "
+                    "WHERE user_id = ? AND code = ?",
+                    [key for key, entry in progress.items() if entry is None])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO delivery_progress "
+                    "(user_id, code, position, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [key + entry for key, entry in progress.items()
+                     if entry is not None])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore:
+    """Session state in Redis, shared by replicas on several hosts"""
+
+    def __init__(self, client, prefix="telebot:"):
+        self._redis = client
+        self._prefix = prefix
+
+    def _timer_key(self, user_id):
+        return f"{self._prefix}session:{user_id}:timer"
+
+    def _files_key(self, user_id):
+        return f"{self._prefix}session:{user_id}:files"
+
+    def _progress_key(self, user_id, code):
+        return f"{self._prefix}progress:{user_id}:{code}"
+
+    def get_timer(self, user_id, default):
+        value = self._redis.get(self._timer_key(user_id))
+        return int(value) if value is not None else default
+
+    def set_timer(self, user_id, minutes):
+        self._redis.set(self._timer_key(user_id), minutes)
+
+    def append_file(self, user_id, file_id, media_type):
+        """Add a file to the user's batch; returns the new batch size"""
+        return self._redis.rpush(self._files_key(user_id),
+                                 f"{media_type}:{file_id}")
+
+    def append_files(self, user_id, new_files):
+        """Add several (file_id, media_type) pairs; returns the batch size"""
+        return self._redis.rpush(
+            self._files_key(user_id),
+            *(f"{media_type}:{file_id}" for file_id, media_type in new_files))
+
+    @staticmethod
+    def _decode(items):
+        files = []
+        for item in items:
+            if isinstance(item, bytes):
+                item = item.decode()
+            media_type, _, file_id = item.partition(":")
+            files.append((file_id, media_type))
+        return files
+
+    def get_files(self, user_id):
+        return self._decode(self._redis.lrange(self._files_key(user_id), 0,
+                                               -1))
+
+    def take_files(self, user_id):
+        """Return the user's batch and clear it in one step"""
+        pipe = self._redis.pipeline()
+        pipe.lrange(self._files_key(user_id), 0, -1)
+        pipe.delete(self._files_key(user_id))
+        items, _ = pipe.execute()
+        return self._decode(items)
+
+    def get_progress(self, user_id, code):
+        """Files of code already delivered to the user (None if no session)"""
+        value = self._redis.get(self._progress_key(user_id, code))
+        return int(value) if value is not None else None
+
+    def set_progress(self, user_id, code, position, expires_at):
+        """Record delivery progress; kept until expires_at (a timestamp)"""
+        self._redis.set(self._progress_key(user_id, code), position,
+                        exat=int(expires_at) + 1)
+
+    def clear_progress(self, user_id, code):
+        self._redis.delete(self._progress_key(user_id, code))
+
+    def load_sessions(self):
+        """Return (timers, batches, progress) dicts for every user"""
+        timers, files, progress = {}, {}, {}
+        start = len(f"{self._prefix}session:")
+        for key in self._redis.scan_iter(f"{self._prefix}session:*"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            user_id, _, kind = key[start:].partition(":")
+            if kind == "timer":
+                timers[int(user_id)] = self.get_timer(int(user_id), None)
+            elif kind == "files":
+                files[int(user_id)] = self.get_files(int(user_id))
+
+        start = len(f"{self._prefix}progress:")
+        for key in self._redis.scan_iter(f"{self._prefix}progress:*"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            user_id, _, code = key[start:].partition(":")
+            value = self._redis.get(key)
+            expires_at = self._redis.expiretime(key)
+            if value is not None and expires_at > 0:
+                progress[(int(user_id), code)] = (int(value), expires_at)
+        return timers, files, progress
+
+    def save_sessions(self, timers, files, progress=None):
+        """Overwrite the timers, batches and progress entries atomically"""
+        pipe = self._redis.pipeline()
+        for user_id, minutes in timers.items():
+            pipe.set(self._timer_key(user_id), minutes)
+        for user_id, batch in files.items():
+            pipe.delete(self._files_key(user_id))
+            if batch:
+                pipe.rpush(self._files_key(user_id),
+                           *(f"{media_type}:{file_id}"
+                             for file_id, media_type in batch))
+        for (user_id, code), entry in (progress or {}).items():
+            if entry is None:
+                pipe.delete(self._progress_key(user_id, code))
+            else:
+                pipe.set(self._progress_key(user_id, code), entry[0],
+                         exat=int(entry[1]) + 1)
+        pipe.execute()
+
+    def close(self):
+        self._redis.close()
+
+
+def _redis_client(url):
+    try:
+        import redis
+    except ImportError as e:
+        raise RuntimeError(
+            "Redis stores need the redis package: pip install redis") from e
+    return redis.Redis.from_url(url)
+
+
+def open_code_store(url, shared=False):
+    """Open a code store from a URL
+
+    ``memory://``, ``sqlite:///codes.db`` (relative) or
+    ``sqlite:////data/codes.db`` (absolute), or ``redis://host:6379/0``.
+    ``shared`` means other processes write to the same store, so a SQLite
+    store's LRU entries are re-read after CODE_STORE_LRU_TTL seconds
+    (SHARED_LRU_TTL by default).
+    """
+    if url.startswith("memory://"):
+        return MemoryCodeStore()
+    if url.startswith("sqlite:///"):
+        lru_size = int(os.getenv("CODE_STORE_LRU_SIZE", DEFAULT_LRU_SIZE))
+        lru_ttl = os.getenv("CODE_STORE_LRU_TTL",
+                            str(SHARED_LRU_TTL) if shared else "")
+        return SQLiteCodeStore(url[len("sqlite:///"):],
+                               lru_size=lru_size,
+                               lru_ttl=float(lru_ttl) if lru_ttl else None)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCodeStore(_redis_client(url))
+    raise ValueError(f"Unsupported code store URL: {url}")
+
+
+def open_session_store(url):
+    """Open the admin session store living next to the code store at url"""
+    if url.startswith("memory://"):
+        return MemorySessionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(_redis_client(url))
+    raise ValueError(f"Unsupported session store URL: {url}")
@@ -0,0 +1,58 @@
+import pytest
+
+from admission import AdmissionController, RateLimit
+
+
+def test_burst_then_rate():
+    limit = RateLimit(rate=1.0, burst=3)
+    assert [limit.admit(1, now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limit.admit(1, now=0.0) == pytest.approx(1.0)
+    assert limit.admit(1, now=1.0) == 0.0
+    assert (limit.admitted, limit.throttled) == (4, 1)
+
+
+def test_users_have_separate_budgets():
+    limit = RateLimit(rate=1.0, burst=1)
+    assert limit.admit(1, now=0.0) == 0.0
+    assert limit.admit(1, now=0.0) > 0
+    assert limit.admit(2, now=0.0) == 0.0
+
+
+def test_idle_users_are_forgotten():
+    limit = RateLimit(rate=1.0, burst=2)
+    for user_id in range(100):
+        limit.admit(user_id, now=0.0)
+    limit.admit(1000, now=10.0)
+    assert len(limit) == 1
+
+
+def test_tracked_users_are_bounded():
+    limit = RateLimit(rate=0.01, burst=5, max_users=10)
+    for user_id in range(50):
+        limit.admit(user_id, now=0.0)
+    assert len(limit) == 10
+
+
+def test_throttled_users_are_told_once_per_stretch():
+    controller = AdmissionController({"single": (1.0, 1)})
+    assert controller.admit(1, "single", now=0.0) == (0.0, False)
+
+    retry_after, notify = controller.admit(1, "single", now=0.0)
+    assert retry_after > 0 and notify
+    assert controller.admit(1, "single", now=0.5)[1] is False
+    assert controller.silenced == 1
+
+    # Admitted again, then throttled again: told again
+    assert controller.admit(1, "single", now=2.0) == (0.0, False)
+    assert controller.admit(1, "single", now=2.0)[1] is True
+
+
+def test_kinds_are_limited_separately():
+    controller = AdmissionController({"single": (1.0, 1), "batch": (0.1, 1)})
+    assert controller.admit(1, "batch", now=0.0)[0] == 0.0
+    assert controller.admit(1, "batch", now=1.0)[0] > 0
+    assert controller.admit(1, "single", now=1.0)[0] == 0.0
+
+    stats = controller.stats()
+    assert stats["admission_batch_throttled"] == 1
+    assert stats["admission_single_admitted"] == 1
@@ -0,0 +1,159 @@
+import base64
+import random
+import string
+from datetime import datetime, timedelta
+
+import pytest
+
+from codec import (PREFIX, MetadataError, decode_metadata, encode_metadata,
+                   join_parts, parse_part, peek_expires_at, split_token)
+
+CREATED_AT = datetime(2024, 5, 1, 12, 30, 15)
+EXPIRES_AT = CREATED_AT + timedelta(hours=48)
+
+
+def file_id(rng):
+    alphabet = string.ascii_letters + string.digits + "-_"
+    return "AgACAgQAAxkBAAI" + "".join(rng.choices(alphabet, k=58))
+
+
+def single(**fields):
+    return {
+        "code": "abc123",
+        "type": "single",
+        "file_id": "BQACAgQAAxkBAAIBQ2ZmZmZmZmZmZmZmZmZmZmZmZmZm",
+        "media_type": "document",
+        "created_at": CREATED_AT.isoformat(),
+        "expires_at": EXPIRES_AT.isoformat(),
+        **fields,
+    }
+
+
+def batch(count, seed=1):
+    rng = random.Random(seed)
+    return {
+        "code": "batch42",
+        "type": "batch",
+        "files": [(file_id(rng), rng.choice(["photo", "video", "document"]))
+                  for _ in range(count)],
+        "created_at": CREATED_AT.isoformat(),
+        "expires_at": EXPIRES_AT.isoformat(),
+    }
+
+
+def test_single_round_trip():
+    metadata = single()
+    decoded = decode_metadata(encode_metadata(metadata))
+    assert decoded == metadata
+
+
+@pytest.mark.parametrize("media_type", ["photo", "video", "document"])
+def test_single_media_type(media_type):
+    decoded = decode_metadata(encode_metadata(single(media_type=media_type)))
+    assert decoded["media_type"] == media_type
+    assert decoded["file_id"] == single()["file_id"]
+
+
+@pytest.mark.parametrize("count", [2, 10, 50])
+def test_batch_round_trip(count):
+    metadata = batch(count)
+    decoded = decode_metadata(encode_metadata(metadata))
+    assert decoded["type"] == "batch"
+    assert decoded["files"] == metadata["files"]
+    assert decoded["code"] == metadata["code"]
+
+
+@pytest.mark.parametrize("content", ["s:AQADAgATtbFxG3I", "b:" + "0f" * 16])
+def test_content_key_round_trip(content):
+    metadata = single(content=content)
+    assert decode_metadata(encode_metadata(metadata)) == metadata
+
+    metadata = batch(10)
+    metadata["content"] = content
+    assert decode_metadata(encode_metadata(metadata))["content"] == content
+
+
+def test_no_content_key_without_one():
+    assert "content" not in decode_metadata(encode_metadata(single()))
+
+
+def test_timestamps_keep_second_precision():
+    metadata = single(expires_at=(EXPIRES_AT +
+                                  timedelta(microseconds=999)).isoformat())
+    token = encode_metadata(metadata)
+    assert decode_metadata(token)["expires_at"] == EXPIRES_AT.isoformat()
+    assert decode_metadata(token)["created_at"] == CREATED_AT.isoformat()
+    assert peek_expires_at(token) == EXPIRES_AT
+
+
+@pytest.mark.parametrize("text_id", [
+    "not base64!",
+    "AgAC=padded",
+    "ünïcode-id",
+    "",
+])
+def test_file_ids_kept_as_text(text_id):
+    decoded = decode_metadata(encode_metadata(single(file_id=text_id)))
+    assert decoded["file_id"] == text_id
+
+
+def test_unicode_code():
+    decoded = decode_metadata(encode_metadata(single(code="cödé")))
+    assert decoded["code"] == "cödé"
+
+
+def test_split_short_token_unchanged():
+    token = encode_metadata(single())
+    assert split_token(token, 1024, 1024) == [token]
+
+
+@pytest.mark.parametrize("first_size, rest_size", [(200, 200), (1024, 4096),
+                                                   (100, 300)])
+def test_split_and_join_across_limit(first_size, rest_size):
+    token = encode_metadata(batch(50))
+    parts = split_token(token, first_size, rest_size)
+    assert len(parts) > 1
+    assert len(parts[0]) <= first_size
+    assert all(len(part) <= rest_size for part in parts[1:])
+
+    parsed = [parse_part(part) for part in parts]
+    assert [index for index, _, _ in parsed] == list(range(1, len(parts) + 1))
+    assert {total for _, total, _ in parsed} == {len(parts)}
+    joined = join_parts(chunk for _, _, chunk in parsed)
+    assert joined == token
+    assert decode_metadata(joined)["files"] == batch(50)["files"]
+
+
+def test_whole_token_is_not_a_part():
+    assert parse_part(encode_metadata(single())) is None
+
+
+@pytest.mark.parametrize("token", [
+    "{'code': 'abc'}",
+    PREFIX,
+    PREFIX + "!!!!",
+    PREFIX + "AQAA",
+])
+def test_rejects_corrupt_tokens(token):
+    with pytest.raises(MetadataError):
+        decode_metadata(token)
+
+
+def test_rejects_truncated_token():
+    token = encode_metadata(batch(10))
+    with pytest.raises(MetadataError):
+        decode_metadata(token[:len(token) // 2])
+
+
+def test_rejects_unsupported_version():
+    token = encode_metadata(single())
+    # Bump the version byte (the first header byte) to 2
+    body = token[len(PREFIX):]
+    data = bytearray(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+    data[0] = 2
+    forged = PREFIX + base64.urlsafe_b64encode(
+        bytes(data)).rstrip(b"=").decode("ascii")
+    with pytest.raises(MetadataError, match="version"):
+        decode_metadata(forged)
+    with pytest.raises(MetadataError, match="version"):
+        peek_expires_at(forged)
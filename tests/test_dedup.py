@@ -0,0 +1,229 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from dedup import DedupIndex
+from delivery import PreparedDelivery
+from expiry import ExpiryScheduler
+from hotcache import DeliveryCache
+from storage import MemoryCodeStore, open_code_store
+
+
+def test_single_key_is_the_unique_id():
+    index = DedupIndex()
+    index.remember("file-a", "unique-a")
+    assert index.content_key([("file-a", "photo")]) == "s:unique-a"
+
+
+def test_batch_key_ignores_order_and_repeats():
+    index = DedupIndex()
+    for i in range(3):
+        index.remember(f"file{i}", f"unique{i}")
+    files = [(f"file{i}", "photo") for i in range(3)]
+    key = index.content_key(files, "batch")
+    assert key.startswith("b:")
+    assert index.content_key(files[::-1] + files[:1], "batch") == key
+    assert index.content_key(files[:2], "batch") != key
+
+
+def test_unknown_file_has_no_key():
+    index = DedupIndex()
+    index.remember("file-a", "unique-a")
+    assert index.content_key([("file-a", "photo"), ("file-b", "photo")],
+                             "batch") is None
+
+
+def test_remembers_a_bounded_number_of_files():
+    index = DedupIndex(max_file_ids=2)
+    for i in range(3):
+        index.remember(f"file{i}", f"unique{i}")
+    assert index.content_key([("file0", "photo")]) is None
+    assert index.content_key([("file2", "photo")]) == "s:unique2"
+
+
+def test_discard_keeps_a_newer_code():
+    index = DedupIndex()
+    index.add("s:a", "old")
+    index.add("s:a", "new")
+    index.discard("s:a", "old")
+    assert index.lookup("s:a") == "new"
+    index.discard("s:a", "new")
+    assert index.lookup("s:a") is None
+
+
+def test_load_rebuilds_from_store():
+    store = MemoryCodeStore()
+    expires_at = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    store["with"] = {'message_id': 1, 'metadata': {
+        "code": "with", "expires_at": expires_at, "content": "s:a"}}
+    store["without"] = {'message_id': 2, 'metadata': {
+        "code": "without", "expires_at": expires_at}}
+    index = DedupIndex()
+    index.add("s:b", "minted-meanwhile")
+    index.load(store)
+    assert index.lookup("s:a") == "with"
+    assert index.lookup("s:b") == "minted-meanwhile"
+    assert len(index) == 2
+
+
+@pytest.fixture(scope="module")
+def main_module():
+    # main.py reads its configuration at import time
+    os.environ["BOT_TOKEN"] = "123456:test"
+    os.environ["CODE_STORE_URL"] = "memory://"
+    import main
+    return main
+
+
+@pytest.fixture
+def main(main_module, monkeypatch):
+    store = MemoryCodeStore()
+    monkeypatch.setattr(main_module, "channel_message_storage", store)
+    monkeypatch.setattr(main_module, "dedup_index", DedupIndex())
+    monkeypatch.setattr(main_module, "delivery_cache", DeliveryCache())
+    monkeypatch.setattr(main_module, "expiry_scheduler",
+                        ExpiryScheduler(store, post_action="delete"))
+    monkeypatch.setattr(main_module, "EXPIRED_POST_ACTION", "keep")
+    monkeypatch.setattr(main_module, "DEDUP_EXTEND_EXPIRY", True)
+    return main_module
+
+
+def share(main, code, expires_at, content="s:a", message_id=7):
+    """Store a code as save_media_to_channel would"""
+    main.channel_message_storage[code] = {
+        'message_id': message_id,
+        'metadata': {"code": code, "type": "single", "file_id": "file-a",
+                     "media_type": "photo", "content": content,
+                     "expires_at": expires_at.isoformat(),
+                     "created_at": datetime.utcnow().isoformat()}
+    }
+    main.dedup_index.add(content, code)
+
+
+def same_second(a, b):
+    return abs((a - b).total_seconds()) < 1
+
+
+def expiry_of(main, code):
+    metadata = main.channel_message_storage[code]["metadata"]
+    return datetime.fromisoformat(metadata["expires_at"])
+
+
+def test_reuses_code_with_same_expiry(main):
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    share(main, "abc", expires_at)
+    assert main.reuse_upload("s:a", expires_at) == "abc"
+    assert main.dedup_index.codes_reused == 1
+
+
+def test_unknown_content_is_not_reused(main):
+    assert main.reuse_upload("s:zzz", datetime.utcnow()) is None
+
+
+def test_stale_index_entry_is_dropped(main):
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    share(main, "abc", expires_at)
+    del main.channel_message_storage["abc"]
+    assert main.reuse_upload("s:a", expires_at) is None
+    assert main.dedup_index.lookup("s:a") is None
+
+
+def test_extends_a_code_that_expires_too_early(main):
+    soon = datetime.utcnow() + timedelta(hours=1)
+    later = soon + timedelta(days=1)
+    share(main, "abc", soon)
+    main.delivery_cache._store(
+        "abc", PreparedDelivery(main.channel_message_storage["abc"]
+                                ["metadata"], -100))
+
+    assert main.reuse_upload("s:a", later) == "abc"
+    assert same_second(expiry_of(main, "abc"), later)
+    assert len(main.delivery_cache) == 0
+    assert main.dedup_index.expiries_extended == 1
+
+
+def test_longer_lived_code_gets_a_shorter_code_on_its_post(main):
+    later = datetime.utcnow() + timedelta(days=2)
+    sooner = datetime.utcnow() + timedelta(hours=1)
+    share(main, "abc", later)
+
+    code = main.reuse_upload("s:a", sooner)
+    assert code not in (None, "abc")
+    assert main.channel_message_storage[code]["message_id"] == 7
+    assert same_second(expiry_of(main, code), sooner)
+    assert same_second(expiry_of(main, "abc"), later)
+    # The longer-lived code stays the one to reuse
+    assert main.dedup_index.lookup("s:a") == "abc"
+
+
+@pytest.mark.parametrize("action", ["delete", "edit"])
+def test_posts_are_not_shared_when_expired_posts_go(main, monkeypatch, action):
+    monkeypatch.setattr(main, "EXPIRED_POST_ACTION", action)
+    later = datetime.utcnow() + timedelta(days=2)
+    share(main, "abc", later)
+    assert main.reuse_upload("s:a", later - timedelta(days=1)) is None
+    assert list(main.channel_message_storage) == ["abc"]
+
+
+def test_expired_code_without_extension_reuses_post_only_if_kept(
+        main, monkeypatch):
+    monkeypatch.setattr(main, "DEDUP_EXTEND_EXPIRY", False)
+    share(main, "abc", datetime.utcnow() - timedelta(minutes=1))
+    later = datetime.utcnow() + timedelta(days=1)
+
+    code = main.reuse_upload("s:a", later)
+    assert code not in (None, "abc")
+    assert main.dedup_index.lookup("s:a") == code
+
+    monkeypatch.setattr(main, "EXPIRED_POST_ACTION", "delete")
+    main.dedup_index.add("s:a", "abc")
+    assert main.reuse_upload("s:a", later) is None
+
+
+def test_short_code_expiring_leaves_the_shared_post(main):
+    """The scheduler only cleans posts up when they are not shared"""
+    later = datetime.utcnow() + timedelta(days=2)
+    share(main, "abc", later)
+    code = main.reuse_upload("s:a", datetime.utcnow() + timedelta(hours=1))
+
+    scheduler = ExpiryScheduler(main.channel_message_storage,
+                                post_action=main.EXPIRED_POST_ACTION)
+    main.channel_message_storage[code]["metadata"]["expires_at"] = (
+        datetime.utcnow() - timedelta(seconds=1)).isoformat()
+    scheduler.schedule(code, datetime.utcnow() - timedelta(seconds=1), 7)
+    scheduler._evict_due()
+    assert code not in main.channel_message_storage
+    assert "abc" in main.channel_message_storage
+    assert not scheduler._posts
+
+
+def test_lookup_rereads_code_extended_by_another_replica(main, monkeypatch,
+                                                         tmp_path):
+    url = f"sqlite:///{tmp_path}/codes.db"
+    here, there = (open_code_store(url, shared=True) for _ in range(2))
+    monkeypatch.setattr(main, "channel_message_storage", here)
+    share(main, "abc", datetime.utcnow() - timedelta(seconds=1))
+
+    # Another replica extends the code while this one has it cached
+    later = datetime.utcnow() + timedelta(days=1)
+    there["abc"] = dict(here["abc"], metadata=dict(
+        here["abc"]["metadata"], expires_at=later.isoformat()))
+
+    metadata = asyncio.run(main.get_media_from_channel(None, "abc"))
+    assert metadata["expires_at"] == later.isoformat()
+    assert "abc" in there
+    here.close()
+    there.close()
+
+
+def test_lookup_deletes_expired_code_and_its_cached_delivery(main):
+    share(main, "abc", datetime.utcnow() - timedelta(seconds=1))
+    main.delivery_cache._store(
+        "abc", PreparedDelivery(main.channel_message_storage["abc"]
+                                ["metadata"], -100))
+
+    assert asyncio.run(main.get_media_from_channel(None, "abc")) is None
+    assert "abc" not in main.channel_message_storage
+    assert len(main.delivery_cache) == 0
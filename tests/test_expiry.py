@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from expiry import ExpiryScheduler
+from storage import MemoryCodeStore
+
+
+def entry(code, expires_at, message_id=1):
+    return {
+        'message_id': message_id,
+        'metadata': {"code": code, "type": "single",
+                     "expires_at": expires_at.isoformat()}
+    }
+
+
+@pytest.fixture
+def store():
+    return MemoryCodeStore()
+
+
+def past(seconds=1):
+    return datetime.utcnow() - timedelta(seconds=seconds)
+
+
+def future(days=1):
+    return datetime.utcnow() + timedelta(days=days)
+
+
+def test_unknown_post_action_is_rejected(store):
+    with pytest.raises(ValueError):
+        ExpiryScheduler(store, post_action="archive")
+
+
+def test_evicts_only_due_codes(store):
+    evicted = []
+    scheduler = ExpiryScheduler(store, on_evict=evicted.append)
+    for code, expires_at in (("old", past()), ("new", future())):
+        store[code] = entry(code, expires_at)
+        scheduler.schedule(code, expires_at)
+
+    scheduler._evict_due()
+    assert "old" not in store and "new" in store
+    assert evicted == ["old"]
+    assert scheduler.pending == 1
+
+
+def test_skips_codes_given_a_new_expiry(store):
+    scheduler = ExpiryScheduler(store, post_action="delete")
+    store["abc"] = entry("abc", past(), message_id=7)
+    scheduler.schedule("abc", past(), 7)
+    store["abc"] = entry("abc", future(), message_id=7)
+
+    scheduler._evict_due()
+    assert "abc" in store
+    assert scheduler.evicted == 0
+    assert not scheduler._posts
+
+
+def test_skips_codes_already_removed(store):
+    scheduler = ExpiryScheduler(store)
+    scheduler.schedule("gone", past())
+    scheduler._evict_due()
+    assert scheduler.evicted == 0
+
+
+@pytest.mark.parametrize("action, queued", [("keep", []),
+                                            ("delete", [("abc", 7)]),
+                                            ("edit", [("abc", 7)])])
+def test_queues_posts_of_evicted_codes(store, action, queued):
+    scheduler = ExpiryScheduler(store, post_action=action)
+    store["abc"] = entry("abc", past(), message_id=7)
+    scheduler.schedule("abc", past(), 7)
+    scheduler._evict_due()
+    assert list(scheduler._posts) == queued
+
+
+def test_replica_only_tracks_its_own_codes(store):
+    scheduler = ExpiryScheduler(store, owns=lambda code: code.startswith("a"))
+    for code in ("a1", "a2", "b1"):
+        store[code] = entry(code, future())
+    scheduler.rebuild()
+    assert scheduler.pending == 2
+    scheduler.schedule("b2", future())
+    assert scheduler.pending == 2
+
+
+def test_run_evicts_when_due(store):
+    async def run():
+        scheduler = ExpiryScheduler(store)
+        scheduler.start(bot=None)
+        expires_at = datetime.utcnow() + timedelta(milliseconds=50)
+        store["abc"] = entry("abc", expires_at)
+        scheduler.schedule("abc", expires_at)
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert "abc" not in store
+    assert scheduler.evicted == 1
+
+
+class Bot:
+    def __init__(self):
+        self.deleted = []
+        self.edited = []
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        self.deleted.append((chat_id, message_ids))
+
+    async def edit_message_caption(self, chat_id, message_id, caption,
+                                   **kwargs):
+        self.edited.append((chat_id, message_id, caption))
+
+
+@pytest.mark.parametrize("action", ["delete", "edit"])
+def test_cleans_posts_in_batches(store, action):
+    async def run():
+        bot = Bot()
+        scheduler = ExpiryScheduler(store, chat_id=-100, post_action=action,
+                                    batch_size=2, batch_interval=0.01)
+        for i in range(3):
+            store[f"c{i}"] = entry(f"c{i}", past(), message_id=i)
+            scheduler.schedule(f"c{i}", past(), i)
+        scheduler.start(bot)
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        return bot, scheduler
+
+    bot, scheduler = asyncio.run(run())
+    assert scheduler.posts_cleaned == 3
+    if action == "delete":
+        assert bot.deleted == [(-100, [0, 1]), (-100, [2])]
+    else:
+        assert [message_id for _, message_id, _ in bot.edited] == [0, 1, 2]
+        assert bot.edited[0][2].startswith("⌛ Expired")
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from delivery import PreparedDelivery
+from hotcache import DeliveryCache
+
+
+def prepared(code="abc", expires_in=timedelta(days=1)):
+    return PreparedDelivery({
+        "code": code,
+        "type": "single",
+        "file_id": "file1",
+        "media_type": "photo",
+        "expires_at": (datetime.utcnow() + expires_in).isoformat(),
+    }, -100)
+
+
+class Loader:
+    def __init__(self, result=None):
+        self.calls = 0
+        self.result = result or prepared()
+
+    async def __call__(self, code):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.result
+
+
+def test_concurrent_misses_share_one_load():
+    async def run():
+        cache = DeliveryCache()
+        load = Loader()
+        results = await asyncio.gather(*(cache.get("abc", load)
+                                         for _ in range(50)))
+        return load.calls, results, cache
+
+    calls, results, cache = asyncio.run(run())
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert cache.coalesced == 49
+
+
+def test_hits_call_on_hit():
+    hits = []
+
+    async def run():
+        cache = DeliveryCache(on_hit=hits.append)
+        load = Loader()
+        for _ in range(3):
+            await cache.get("abc", load)
+        return load.calls, cache
+
+    calls, cache = asyncio.run(run())
+    assert calls == 1
+    assert hits == ["abc", "abc"]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_unknown_codes_are_not_cached():
+    async def run():
+        cache = DeliveryCache()
+
+        async def load(code):
+            return None
+
+        assert await cache.get("nope", load) is None
+        return cache
+
+    assert len(asyncio.run(run())) == 0
+
+
+def test_invalidate_and_clear_force_a_reload():
+    async def run():
+        cache = DeliveryCache()
+        load = Loader()
+        await cache.get("abc", load)
+        cache.invalidate("abc")
+        await cache.get("abc", load)
+        cache.clear()
+        assert len(cache) == 0
+        await cache.get("abc", load)
+        return load.calls
+
+    assert asyncio.run(run()) == 3
+
+
+def test_expired_entries_are_reloaded():
+    async def run():
+        cache = DeliveryCache()
+        load = Loader(prepared(expires_in=timedelta(seconds=-1)))
+        await cache.get("abc", load)
+        await cache.get("abc", load)
+        return load.calls
+
+    assert asyncio.run(run()) == 2
+
+
+def test_max_age_bounds_entry_lifetime():
+    async def run():
+        cache = DeliveryCache(max_age=0.05)
+        load = Loader()
+        await cache.get("abc", load)
+        await cache.get("abc", load)
+        assert load.calls == 1
+        time.sleep(0.1)
+        await cache.get("abc", load)
+        return load.calls
+
+    assert asyncio.run(run()) == 2
+
+
+def test_least_popular_entry_is_evicted():
+    async def run():
+        cache = DeliveryCache(max_entries=2)
+        for code in ("a", "b"):
+            await cache.get(code, Loader(prepared(code)))
+        for _ in range(5):
+            await cache.get("a", Loader())
+        await cache.get("c", Loader(prepared("c")))
+        return cache
+
+    cache = asyncio.run(run())
+    assert set(cache._entries) == {"a", "c"}
+    assert cache.evictions == 1
@@ -0,0 +1,86 @@
+import asyncio
+
+from mediagroups import MediaGroupCollector
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, items):
+        self.calls.append(items)
+
+
+def test_album_is_handled_once_sorted():
+    async def run():
+        collector = MediaGroupCollector(delay=0.05)
+        callback = Recorder()
+        for item in (3, 1, 2):
+            collector.add("album", item, callback)
+        assert collector.pending == 1
+        await asyncio.sleep(0.15)
+        return collector, callback
+
+    collector, callback = asyncio.run(run())
+    assert callback.calls == [[1, 2, 3]]
+    assert collector.pending == 0
+    assert collector.groups_handled == 1
+
+
+def test_full_album_is_handled_right_away():
+    async def run():
+        collector = MediaGroupCollector(delay=10, max_items=2)
+        callback = Recorder()
+        collector.add("album", 1, callback)
+        collector.add("album", 2, callback)
+        await asyncio.sleep(0)
+        return callback
+
+    assert asyncio.run(run()).calls == [[1, 2]]
+
+
+def test_flush_only_matching_albums():
+    async def run():
+        collector = MediaGroupCollector(delay=10)
+        callback = Recorder()
+        collector.add((1, "a"), "x", callback)
+        collector.add((2, "b"), "y", callback)
+        await collector.flush(lambda key: key[0] == 1)
+        assert callback.calls == [["x"]]
+        await collector.flush()
+        return callback
+
+    assert asyncio.run(run()).calls == [["x"], ["y"]]
+
+
+def test_flush_waits_for_running_callbacks():
+    async def run():
+        collector = MediaGroupCollector(delay=10)
+        done = []
+
+        async def slow(items):
+            await asyncio.sleep(0.05)
+            done.extend(items)
+
+        collector.add("album", 1, slow)
+        await collector.flush()
+        return done
+
+    assert asyncio.run(run()) == [1]
+
+
+def test_failing_callback_does_not_break_the_collector():
+    async def run():
+        collector = MediaGroupCollector(delay=10)
+
+        async def fail(items):
+            raise RuntimeError("boom")
+
+        collector.add("bad", 1, fail)
+        await collector.flush()
+        callback = Recorder()
+        collector.add("good", 2, callback)
+        await collector.flush()
+        return callback
+
+    assert asyncio.run(run()).calls == [[2]]
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from memberset import MemberSet
+from membership import MembershipCache
+
+
+def test_member_set_add_discard():
+    members = MemberSet()
+    members.add(5, seen=100)
+    assert 5 in members and len(members) == 1
+    assert members.last_seen(5) == 100
+    members.discard(5)
+    assert 5 not in members and len(members) == 0
+    members.discard(5)
+    assert len(members) == 0
+
+
+def test_member_set_compacts_and_keeps_pending_changes():
+    members = MemberSet()
+    for user_id in (30, 10, 20):
+        members.add(user_id, seen=100)
+    members.compact()
+    assert list(members._ids) == [10, 20, 30]
+    assert members.pending_changes == 0
+
+    members.add(20, seen=200)
+    members.discard(30)
+    members.add(40, seen=300)
+    assert members.last_seen(20) == 200
+    assert 30 not in members
+    assert len(members) == 3
+    members.compact()
+    assert list(members._ids) == [10, 20, 40]
+    assert len(members) == 3
+
+
+def test_member_set_drops_members_not_seen_for_max_age():
+    members = MemberSet(max_age=60)
+    members.add(1, seen=time.time() - 120)
+    members.add(2)
+    members.compact()
+    assert 1 not in members and 2 in members
+    assert members.evicted == 1
+
+
+def test_member_set_is_saved_and_mapped_back(tmp_path):
+    path = str(tmp_path / "members.bin")
+    members = MemberSet(path=path)
+    for user_id in range(1000):
+        members.add(user_id * 7, seen=1000 + user_id)
+    members.compact()
+
+    mapped = MemberSet(path=path)
+    assert len(mapped) == 1000
+    assert mapped.last_seen(700) == 1100
+    assert 701 not in mapped
+    mapped.add(701, seen=5)
+    assert 701 in mapped
+
+
+def test_member_set_ignores_a_corrupt_file(tmp_path):
+    path = tmp_path / "members.bin"
+    path.write_bytes(b"not a member file")
+    assert len(MemberSet(path=str(path))) == 0
+
+
+class Checker:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    async def __call__(self, user_id):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.result
+
+
+def test_concurrent_checks_share_one_call():
+    async def run():
+        cache = MembershipCache()
+        check = Checker(True)
+        results = await asyncio.gather(*(cache.is_member(1, check)
+                                         for _ in range(20)))
+        return results, check.calls, cache
+
+    results, calls, cache = asyncio.run(run())
+    assert all(results)
+    assert calls == 1
+    assert 1 in cache
+
+
+def test_non_members_are_cached_for_negative_ttl():
+    async def run():
+        cache = MembershipCache(negative_ttl=0.05)
+        check = Checker(False)
+        assert not await cache.is_member(1, check)
+        assert not await cache.is_member(1, check)
+        assert check.calls == 1
+        await asyncio.sleep(0.1)
+        check.result = True
+        assert await cache.is_member(1, check)
+        return check.calls
+
+    assert asyncio.run(run()) == 2
+
+
+def test_unknown_answers_are_not_cached():
+    async def run():
+        cache = MembershipCache()
+        check = Checker(None)
+        assert not await cache.is_member(1, check)
+        assert not await cache.is_member(1, check)
+        return check.calls
+
+    assert asyncio.run(run()) == 2
+
+
+def test_stale_member_kept_while_api_is_down():
+    async def run():
+        cache = MembershipCache(positive_ttl=60)
+        cache.members.add(1, seen=time.time() - 120)
+        return await cache.is_member(1, Checker(None))
+
+    assert asyncio.run(run()) is True
+
+
+def test_forget_makes_the_next_request_check_again():
+    async def run():
+        cache = MembershipCache()
+        check = Checker(True)
+        await cache.is_member(1, check)
+        cache.forget(1)
+        assert 1 not in cache
+        check.result = False
+        return await cache.is_member(1, check), check.calls
+
+    assert asyncio.run(run()) == (False, 2)
+
+
+@pytest.mark.parametrize("left", [True, False])
+def test_member_who_left_is_revoked(left):
+    async def run():
+        cache = MembershipCache(positive_ttl=100, refresh_ahead=0.5)
+        cache.members.add(1, seen=time.time() - 60)
+        check = Checker(not left)
+        # Close to expiry: answered from the cache, re-checked behind it
+        assert await cache.is_member(1, check)
+        await asyncio.sleep(0.01)
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.refreshes == 1
+    assert (1 in cache) is not left
+    assert cache.revoked == int(left)
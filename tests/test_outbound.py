@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+from outbound import (PRIORITY_BULK, PRIORITY_HIGH, PRIORITY_NORMAL,
+                      OutboundScheduler, TokenBucket)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1.0) == 0.0
+    assert bucket.is_full(10.0)
+
+
+def test_priorities():
+    scheduler = OutboundScheduler(priority_chats={42})
+    assert scheduler._priority("sendMessage", 1, None) == PRIORITY_NORMAL
+    assert scheduler._priority("sendMessage", 42, None) == PRIORITY_HIGH
+    assert scheduler._priority("answerCallbackQuery", 1,
+                               None) == PRIORITY_HIGH
+    assert scheduler._priority("sendMessage", 42,
+                               PRIORITY_BULK) == PRIORITY_BULK
+    assert scheduler._priority("sendMessage", 1,
+                               {"priority": 9}) == PRIORITY_BULK
+
+
+def test_chat_limits():
+    scheduler = OutboundScheduler(chat_rate=1, chat_burst=3, group_rate=0.5,
+                                  group_burst=5,
+                                  chat_limits={-100: (20 / 60, 20)})
+    assert scheduler._chat_bucket(1, 0.0).capacity == 3
+    assert scheduler._chat_bucket(-5, 0.0).capacity == 5
+    assert scheduler._chat_bucket("@channel", 0.0).capacity == 5
+    bucket = scheduler._chat_bucket(-100, 0.0)
+    assert (bucket.rate, bucket.capacity) == (20 / 60, 20)
+
+
+def run_with(scheduler, coroutine):
+    async def run():
+        await scheduler.initialize()
+        try:
+            return await coroutine()
+        finally:
+            await scheduler.shutdown()
+
+    return asyncio.run(run())
+
+
+def test_higher_priority_goes_first():
+    scheduler = OutboundScheduler(overall_rate=1)
+    order = []
+
+    async def call(name):
+        order.append(name)
+
+    async def send():
+        # Use up the single global token so the rest queue up
+        await scheduler.process_request(call, ("first", ), {}, "sendMessage",
+                                        {"chat_id": 1}, None)
+        await asyncio.gather(*(
+            scheduler.process_request(call, (name, ), {}, "sendMessage",
+                                      {"chat_id": chat_id}, priority)
+            for name, chat_id, priority in (("bulk", 2, PRIORITY_BULK),
+                                            ("normal", 3, PRIORITY_NORMAL),
+                                            ("high", 4, PRIORITY_HIGH))))
+
+    scheduler._global = TokenBucket(20, 1)
+    run_with(scheduler, send)
+    assert order == ["first", "high", "normal", "bulk"]
+
+
+def test_unthrottled_endpoints_skip_the_queue():
+    scheduler = OutboundScheduler()
+
+    async def call():
+        return "ok"
+
+    async def send():
+        return await scheduler.process_request(call, (), {}, "getChatMember",
+                                               {"chat_id": 1}, None)
+
+    assert run_with(scheduler, send) == "ok"
+    assert scheduler.waited_requests == 0
+
+
+def test_retry_after_pauses_and_retries():
+    scheduler = OutboundScheduler()
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+        return "sent"
+
+    async def send():
+        return await scheduler.process_request(call, (), {}, "sendMessage",
+                                               {"chat_id": 1}, None)
+
+    assert run_with(scheduler, send) == "sent"
+    assert len(attempts) == 2
+    assert scheduler.retry_after_hits == 1
+    assert scheduler.dropped == 0
+
+
+def test_gives_up_after_max_retries():
+    scheduler = OutboundScheduler()
+
+    async def call():
+        raise RetryAfter(0)
+
+    async def send():
+        return await scheduler.process_request(call, (), {}, "sendMessage",
+                                               {"chat_id": 1},
+                                               {"max_retries": 1})
+
+    with pytest.raises(RetryAfter):
+        run_with(scheduler, send)
+    assert scheduler.retry_after_hits == 2
+    assert scheduler.dropped == 1
@@ -0,0 +1,170 @@
+"""Two replicas sharing one SQLite file, as with REPLICA_COUNT > 1"""
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from expiry import ExpiryScheduler
+from storage import SHARED_LRU_TTL, SQLiteSessionStore, open_code_store
+
+CODES = [f"code{i:03d}" for i in range(200)]
+
+
+def entry(code, expires_at, message_id=1, type="single"):
+    return {
+        'message_id': message_id,
+        'metadata': {"code": code, "type": type,
+                     "expires_at": expires_at.isoformat()}
+    }
+
+
+def claim_all(path):
+    """Runs in a replica process: try to reserve every code"""
+    store = open_code_store(f"sqlite:///{path}", shared=True)
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    claimed = [code for code in CODES
+               if store.add(code, entry(code, expires_at, None, "pending"))]
+    store.close()
+    return claimed
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "codes.db")
+
+
+@pytest.fixture
+def replicas(path):
+    stores = [open_code_store(f"sqlite:///{path}", shared=True)
+              for _ in range(2)]
+    yield stores
+    for store in stores:
+        store.close()
+
+
+def test_shared_store_rereads_cached_codes(replicas):
+    assert replicas[0].lru_ttl == SHARED_LRU_TTL
+
+
+def test_minting_never_hands_out_a_code_twice(path):
+    open_code_store(f"sqlite:///{path}").close()
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        claimed = pool.map(claim_all, [path, path])
+
+    assert not set(claimed[0]) & set(claimed[1])
+    assert sorted(claimed[0] + claimed[1]) == CODES
+    store = open_code_store(f"sqlite:///{path}")
+    assert len(store) == len(CODES)
+    store.close()
+
+
+def test_batch_session_is_shared(path):
+    a, b = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    try:
+        a.append_files(7, [("file1", "photo"), ("file2", "video")])
+        b.append_file(7, "file3", "document")
+        assert a.get_files(7) == b.get_files(7)
+        assert [file_id for file_id, _ in b.get_files(7)] == [
+            "file1", "file2", "file3"]
+
+        expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat()
+        a.set_progress(7, "batch1", 50, expires_at)
+        assert b.get_progress(7, "batch1") == 50
+        assert b.get_progress(7, "other") is None
+
+        assert len(b.take_files(7)) == 3
+        assert a.get_files(7) == []
+    finally:
+        a.close()
+        b.close()
+
+
+def test_extended_expiry_is_seen_after_ttl(path):
+    a = open_code_store(f"sqlite:///{path}")
+    a.lru_ttl = 0.05
+    b = open_code_store(f"sqlite:///{path}")
+    try:
+        soon = datetime.utcnow() + timedelta(minutes=1)
+        later = soon + timedelta(days=1)
+        a["abc"] = entry("abc", soon)
+        b["abc"] = entry("abc", later)
+
+        time.sleep(0.1)
+        assert a["abc"]["metadata"]["expires_at"] == later.isoformat()
+    finally:
+        a.close()
+        b.close()
+
+
+def test_refresh_skips_the_cache(replicas):
+    a, b = replicas
+    past = datetime.utcnow() - timedelta(minutes=1)
+    later = datetime.utcnow() + timedelta(days=1)
+    a["abc"] = entry("abc", past)
+    b["abc"] = entry("abc", later)
+
+    # Still cached on a, but refresh reads what b wrote
+    assert a["abc"]["metadata"]["expires_at"] == past.isoformat()
+    assert a.refresh("abc")["metadata"]["expires_at"] == later.isoformat()
+
+    del b["abc"]
+    assert a.refresh("abc") is None
+    assert "abc" not in a
+
+
+def test_contains_honours_ttl(path):
+    a = open_code_store(f"sqlite:///{path}")
+    a.lru_ttl = 0.05
+    b = open_code_store(f"sqlite:///{path}")
+    try:
+        a["abc"] = entry("abc", datetime.utcnow() + timedelta(days=1))
+        del b["abc"]
+        time.sleep(0.1)
+        assert "abc" not in a
+    finally:
+        a.close()
+        b.close()
+
+
+def test_expiry_keeps_code_extended_by_other_replica(replicas):
+    a, b = replicas
+    past = datetime.utcnow() - timedelta(seconds=1)
+    later = datetime.utcnow() + timedelta(days=1)
+    a["abc"] = entry("abc", past, message_id=42)
+    scheduler = ExpiryScheduler(a, chat_id=-100, post_action="delete")
+    scheduler.schedule("abc", past, 42)
+
+    b["abc"] = entry("abc", later, message_id=42)
+    scheduler._evict_due()
+
+    assert scheduler.evicted == 0
+    assert not scheduler._posts
+    assert b["abc"]["metadata"]["expires_at"] == later.isoformat()
+
+
+def test_expiry_evicts_expired_code_once(replicas):
+    a, b = replicas
+    past = datetime.utcnow() - timedelta(seconds=1)
+    a["abc"] = entry("abc", past, message_id=42)
+    schedulers = [ExpiryScheduler(store, post_action="edit")
+                  for store in replicas]
+    for scheduler in schedulers:
+        scheduler.schedule("abc", past, 42)
+        scheduler._evict_due()
+
+    assert sum(scheduler.evicted for scheduler in schedulers) == 1
+    assert "abc" not in b
+    assert b.refresh("abc") is None
+    assert [list(s._posts) for s in schedulers if s.evicted] == [[("abc", 42)]]
+
+
+def test_len_follows_other_replica(replicas, monkeypatch):
+    import storage
+
+    monkeypatch.setattr(storage, "SHARED_COUNT_TTL", 0)
+    a, b = replicas
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    for code in CODES[:10]:
+        b[code] = entry(code, expires_at)
+    assert len(a) == 10
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from sessions import WriteBehindSessionStore
+from storage import (MemoryCodeStore, MemorySessionStore, SQLiteCodeStore,
+                     SQLiteSessionStore, open_code_store, open_session_store)
+
+EXPIRES_AT = datetime.utcnow() + timedelta(days=1)
+
+
+def entry(code, message_id=1, expires_at=EXPIRES_AT):
+    return {
+        'message_id': message_id,
+        'metadata': {"code": code, "type": "single", "file_id": f"f{code}",
+                     "media_type": "photo",
+                     "expires_at": expires_at.isoformat()}
+    }
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def codes(request, tmp_path):
+    store = MemoryCodeStore() if request.param == "memory" else \
+        SQLiteCodeStore(str(tmp_path / "codes.db"), lru_size=4)
+    yield store
+    store.close()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def sessions(request, tmp_path):
+    store = MemorySessionStore() if request.param == "memory" else \
+        SQLiteSessionStore(str(tmp_path / "codes.db"))
+    yield store
+    store.close()
+
+
+def test_open_stores_by_url(tmp_path):
+    assert isinstance(open_code_store("memory://"), MemoryCodeStore)
+    assert isinstance(open_session_store("memory://"), MemorySessionStore)
+    store = open_code_store(f"sqlite:///{tmp_path}/codes.db")
+    assert isinstance(store, SQLiteCodeStore)
+    assert store.lru_ttl is None
+    store.close()
+    with pytest.raises(ValueError):
+        open_code_store("postgres://db")
+
+
+def test_set_get_delete(codes):
+    codes["abc"] = entry("abc")
+    assert codes["abc"] == entry("abc")
+    assert "abc" in codes
+    assert len(codes) == 1
+
+    codes["abc"] = entry("abc", message_id=2)
+    assert codes["abc"]["message_id"] == 2
+    assert len(codes) == 1
+
+    del codes["abc"]
+    assert "abc" not in codes
+    assert codes.get("abc") is None
+    assert codes.refresh("abc") is None
+    with pytest.raises(KeyError):
+        del codes["abc"]
+    assert len(codes) == 0
+
+
+def test_add_never_overwrites(codes):
+    assert codes.add("abc", entry("abc", message_id=1))
+    assert not codes.add("abc", entry("abc", message_id=2))
+    assert codes["abc"]["message_id"] == 1
+
+
+def test_load_many_skips_present_codes(codes):
+    codes["a"] = entry("a", message_id=1)
+    added = codes.load_many([(code, entry(code, message_id=2))
+                             for code in ("a", "b", "c")])
+    assert added == 2
+    assert len(codes) == 3
+    assert codes["a"]["message_id"] == 1
+    assert codes["c"]["message_id"] == 2
+
+
+def test_iter_expiries_and_pages(codes):
+    for i in range(25):
+        codes[f"c{i:02d}"] = entry(f"c{i:02d}", message_id=i)
+
+    expiries = sorted(codes.iter_expiries())
+    assert len(expiries) == 25
+    assert expiries[3] == ("c03", EXPIRES_AT.isoformat(), 3)
+
+    pages = list(codes.iter_pages(page_size=10))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    rows = [row for page in pages for row in page]
+    assert sorted(code for code, _, _ in rows) == sorted(codes)
+    code, message_id, metadata = sorted(rows)[0]
+    assert (code, message_id) == ("c00", 0)
+    assert json.loads(metadata) == entry("c00")["metadata"]
+
+
+def test_sqlite_lru_is_bounded_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "codes.db")
+    store = SQLiteCodeStore(path, lru_size=4)
+    for i in range(10):
+        store[f"c{i}"] = entry(f"c{i}")
+    assert len(store._lru) == 4
+
+    store["c9"]
+    assert store.lru_hits == 1
+    store["c0"]
+    assert store.lru_misses == 1
+    store.close()
+
+    reopened = SQLiteCodeStore(path)
+    assert len(reopened) == 10
+    assert reopened["c5"] == entry("c5")
+    reopened.close()
+
+
+def test_sessions_timers_and_batches(sessions):
+    assert sessions.get_timer(1, 2880) == 2880
+    sessions.set_timer(1, 60)
+    assert sessions.get_timer(1, 2880) == 60
+
+    assert sessions.append_file(1, "f1", "photo") == 1
+    assert sessions.append_files(1, [("f2", "video"), ("f3", "document")]) == 3
+    assert list(sessions.get_files(1)) == [("f1", "photo"), ("f2", "video"),
+                                          ("f3", "document")]
+    assert sessions.get_files(2) == []
+
+    assert len(sessions.take_files(1)) == 3
+    assert sessions.take_files(1) == []
+
+
+def test_sessions_progress(sessions):
+    assert sessions.get_progress(1, "abc") is None
+    sessions.set_progress(1, "abc", 0, time.time() + 60)
+    assert sessions.get_progress(1, "abc") == 0
+    sessions.set_progress(1, "abc", 50, time.time() + 60)
+    assert sessions.get_progress(1, "abc") == 50
+
+    sessions.set_progress(1, "old", 10, time.time() - 1)
+    assert sessions.get_progress(1, "old") is None
+
+    sessions.clear_progress(1, "abc")
+    assert sessions.get_progress(1, "abc") is None
+
+
+def test_sessions_save_and_load(sessions):
+    later = time.time() + 60
+    sessions.save_sessions({1: 30}, {1: [("f1", "photo")], 2: []},
+                           {(1, "abc"): (5, later)})
+    timers, files, progress = sessions.load_sessions()
+    assert timers == {1: 30}
+    assert files == {1: [("f1", "photo")]}
+    assert progress == {(1, "abc"): (5, later)}
+
+    sessions.save_sessions({}, {1: []}, {(1, "abc"): None})
+    timers, files, progress = sessions.load_sessions()
+    assert files == {}
+    assert progress == {}
+
+
+def test_write_behind_flushes_changes(tmp_path):
+    path = str(tmp_path / "codes.db")
+
+    async def run():
+        store = WriteBehindSessionStore(SQLiteSessionStore(path))
+        store.set_timer(1, 90)
+        store.append_files(1, [("f1", "photo"), ("f2", "video")])
+        store.set_progress(1, "abc", 0, time.time() + 60)
+        assert store.stats()["session_dirty_users"] == 1
+
+        await store.flush()
+        assert store.flushes == 1
+        assert store.stats()["session_dirty_users"] == 0
+
+        store.take_files(1)
+        store.clear_progress(1, "abc")
+        await store.stop()
+        store.close()
+
+    asyncio.run(run())
+
+    backend = SQLiteSessionStore(path)
+    assert backend.get_timer(1, 2880) == 90
+    assert backend.get_files(1) == []
+    assert backend.get_progress(1, "abc") is None
+    backend.close()
+
+
+def test_write_behind_loads_existing_state(tmp_path):
+    path = str(tmp_path / "codes.db")
+    backend = SQLiteSessionStore(path)
+    backend.set_timer(1, 15)
+    backend.append_file(1, "f1", "photo")
+    backend.set_progress(1, "abc", 20, time.time() + 60)
+
+    store = WriteBehindSessionStore(backend)
+    assert store.get_timer(1, 2880) == 15
+    assert store.get_files(1) == [("f1", "photo")]
+    assert store.get_progress(1, "abc") == 20
+    store.close()
@@ -0,0 +1,91 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import MemoryCodeStore, SQLiteCodeStore
+from transfer import (Importer, export_to_file, import_from_file,
+                      validate_entry)
+
+NOW = datetime.utcnow()
+LATER = (NOW + timedelta(days=1)).isoformat()
+
+
+def single(code, **fields):
+    return {"code": code, "message_id": 5, "metadata": {
+        "code": code, "type": "single", "file_id": "file1",
+        "media_type": "photo", "expires_at": LATER, **fields}}
+
+
+def batch(code):
+    return {"code": code, "message_id": None, "metadata": {
+        "code": code, "type": "batch",
+        "files": [["file1", "photo"], ["file2", "video"]],
+        "expires_at": LATER}}
+
+
+@pytest.mark.parametrize("name", ["codes.jsonl", "codes.jsonl.gz"])
+def test_export_import_round_trip(tmp_path, name):
+    source = SQLiteCodeStore(str(tmp_path / "source.db"))
+    for i in range(25):
+        record = single(f"s{i}") if i % 2 else batch(f"b{i}")
+        source[record["code"]] = {'message_id': record["message_id"],
+                                  'metadata': record["metadata"]}
+    path = str(tmp_path / name)
+    assert export_to_file(source, path) == 25
+
+    target = MemoryCodeStore()
+    stats = import_from_file(target, path)
+    assert stats["imported"] == 25
+    assert dict(target) == {code: source[code] for code in source}
+    source.close()
+
+
+def test_existing_codes_win(tmp_path):
+    target = MemoryCodeStore()
+    target["abc"] = {'message_id': 1, 'metadata': single("abc")["metadata"]}
+    importer = Importer(target)
+    importer.feed([json.dumps(single("abc")), json.dumps(single("new"))])
+    stats = importer.finish()
+    assert (stats["imported"], stats["existing"]) == (1, 1)
+    assert target["abc"]["message_id"] == 1
+
+
+def test_invalid_and_expired_lines_are_counted():
+    importer = Importer(MemoryCodeStore(), page_size=2)
+    expired = single("old", expires_at=(NOW - timedelta(days=1)).isoformat())
+    importer.feed([
+        json.dumps(single("ok")),
+        json.dumps(expired),
+        "not json",
+        b"",
+        json.dumps(single("bad", media_type="sticker")).encode(),
+    ])
+    stats = importer.finish()
+    assert stats["lines"] == 4
+    assert (stats["imported"], stats["expired"], stats["invalid"]) == (1, 1, 2)
+
+
+@pytest.mark.parametrize("record", [
+    [],
+    {"code": "has space", "metadata": single("x")["metadata"]},
+    dict(single("abc"), message_id="5"),
+    dict(single("abc"), code="other"),
+    single("abc", expires_at="soon"),
+    single("abc", type="pending"),
+    dict(batch("abc"), metadata=dict(batch("abc")["metadata"], files=[])),
+    dict(batch("abc"), metadata=dict(batch("abc")["metadata"],
+                                     files=[["file1"]])),
+])
+def test_validate_rejects(record):
+    assert validate_entry(record, NOW) is None
+
+
+def test_gzip_is_detected_by_content(tmp_path):
+    path = tmp_path / "export"
+    with gzip.open(path, "wt") as fp:
+        fp.write(json.dumps(single("abc")) + "\n")
+    store = MemoryCodeStore()
+    assert import_from_file(store, str(path))["imported"] == 1
+    assert "abc" in store
@@ -0,0 +1,223 @@
+import gzip
+import json
+import logging
+import re
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Entries per page read from the store / per bulk insert
+PAGE_SIZE = 1000
+
+# Codes are random lowercase/digit strings; signed codes are never stored
+CODE_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+MEDIA_TYPES = ("photo", "video", "document")
+
+# Bound decoder: skips json.loads' type and encoding checks on every line
+_decode = json.JSONDecoder().decode
+
+
+def export_chunks(store, page_size=PAGE_SIZE):
+    """Yield the code index as JSONL, one encoded chunk per store page
+
+    Each line is ``{"code": ..., "message_id": ..., "metadata": {...}}``.
+    Metadata is copied as stored, without being decoded.
+    """
+    for page in store.iter_pages(page_size):
+        if not page:
+            continue
+        yield "".join(
+            f'{{"code":{json.dumps(code)},"message_id":'
+            f'{"null" if message_id is None else int(message_id)},'
+            f'"metadata":{metadata}}}\n'
+            for code, message_id, metadata in page).encode("utf-8")
+
+
+def export_to_file(store, path):
+    """Write the index to path (gzip-compressed if it ends in .gz)"""
+    if path.endswith(".gz"):
+        # Level 5 is several times faster than the default 9 and almost
+        # as small for this kind of data
+        fp = gzip.open(path, "wb", compresslevel=5)
+    else:
+        fp = open(path, "wb")
+    count = 0
+    with fp:
+        for chunk in export_chunks(store):
+            fp.write(chunk)
+            count += chunk.count(b"\n")
+    return count
+
+
+def validate_entry(record, now):
+    """Return (code, entry) for a valid record, False if expired, else None"""
+    if not isinstance(record, dict):
+        return None
+    code = record.get("code")
+    metadata = record.get("metadata")
+    message_id = record.get("message_id")
+    if not isinstance(code, str) or not CODE_PATTERN.fullmatch(code):
+        return None
+    if not isinstance(metadata, dict) or metadata.get("code", code) != code:
+        return None
+    if message_id is not None and not isinstance(message_id, int):
+        return None
+
+    try:
+        expires_at = datetime.fromisoformat(metadata["expires_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if expires_at <= now:
+        return False
+
+    kind = metadata.get("type")
+    if kind == "single":
+        if (not isinstance(metadata.get("file_id"), str) or
+                metadata.get("media_type") not in MEDIA_TYPES):
+            return None
+    elif kind == "batch":
+        files = metadata.get("files")
+        if not isinstance(files, list) or not files:
+            return None
+        for item in files:
+            if (not isinstance(item, (list, tuple)) or len(item) != 2 or
+                    not isinstance(item[0], str) or
+                    item[1] not in MEDIA_TYPES):
+                return None
+    else:
+        # Pending reservations and unknown types are not worth moving
+        return None
+
+    return code, {'message_id': message_id, 'metadata': metadata}
+
+
+class Importer:
+    """Validates JSONL lines and loads them into a store in bulk
+
+    Feed lines in any number of calls; entries already in the store win.
+    Memory use is bounded by one page of entries.
+    """
+
+    def __init__(self, store, page_size=PAGE_SIZE):
+        self.store = store
+        self.page_size = page_size
+        self.now = datetime.utcnow()
+        self.started = time.monotonic()
+        self._batch = []
+        self.stats = {
+            "lines": 0,
+            "imported": 0,
+            "existing": 0,
+            "expired": 0,
+            "invalid": 0
+        }
+
+    def _load(self):
+        added = self.store.load_many(self._batch)
+        self.stats["imported"] += added
+        self.stats["existing"] += len(self._batch) - added
+        self._batch = []
+
+    def feed(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            self.stats["lines"] += 1
+            if isinstance(line, bytes):
+                line = line.decode("utf-8", "replace")
+            try:
+                result = validate_entry(_decode(line), self.now)
+            except ValueError:
+                result = None
+
+            if result is None:
+                self.stats["invalid"] += 1
+            elif result is False:
+                self.stats["expired"] += 1
+            else:
+                self._batch.append(result)
+                if len(self._batch) >= self.page_size:
+                    self._load()
+
+    def finish(self):
+        if self._batch:
+            self._load()
+        elapsed = time.monotonic() - self.started
+        self.stats["seconds"] = round(elapsed, 3)
+        logger.info(
+            f"Import finished: {self.stats['lines']} lines, "
+            f"{self.stats['imported']} imported, "
+            f"{self.stats['existing']} already present, "
+            f"{self.stats['expired']} expired, "
+            f"{self.stats['invalid']} invalid in {elapsed:.1f}s")
+        return self.stats
+
+
+def import_from_file(store, path):
+    """Import a JSONL export (plain or gzip-compressed)"""
+    with open(path, "rb") as fp:
+        compressed = fp.read(2) == b"\x1f\x8b"
+    opener = gzip.open if compressed else open
+    importer = Importer(store)
+    with opener(path, "rt", encoding="utf-8", errors="replace") as fp:
+        importer.feed(fp)
+    return importer.finish()
+
+
+if __name__ == "__main__":
+    # Throughput of exporting and re-importing a million codes (SQLite)
+    import os
+    import sys
+    import tempfile
+    from datetime import timedelta
+
+    from storage import SQLiteCodeStore
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    expires_at = (datetime.utcnow() + timedelta(days=2)).isoformat()
+
+    def entries():
+        for i in range(count):
+            code = f"{i:06x}"
+            yield code, {
+                'message_id': i,
+                'metadata': {
+                    "code": code,
+                    "type": "single",
+                    "file_id": f"BAACAgQAAxkBAAI{i:058d}",
+                    "media_type": "video",
+                    "expires_at": expires_at,
+                }
+            }
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = SQLiteCodeStore(os.path.join(directory, "source.db"))
+        batch = []
+        for item in entries():
+            batch.append(item)
+            if len(batch) == PAGE_SIZE:
+                source.load_many(batch)
+                batch = []
+        source.load_many(batch)
+
+        for name in ("codes.jsonl", "codes.jsonl.gz"):
+            path = os.path.join(directory, name)
+            started = time.perf_counter()
+            export_to_file(source, path)
+            exported = time.perf_counter() - started
+
+            target = SQLiteCodeStore(os.path.join(directory, f"{name}.db"))
+            started = time.perf_counter()
+            stats = import_from_file(target, path)
+            imported = time.perf_counter() - started
+            assert stats["imported"] == count, stats
+            target.close()
+
+            scale = 1_000_000 / count
+            print(f"{name:16s} {os.path.getsize(path) / 2**20:7.1f} MiB  "
+                  f"export {exported * scale:5.1f}s/M  "
+                  f"import {imported * scale:5.1f}s/M")
+        source.close()